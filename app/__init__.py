@@ -1,26 +1,76 @@
+import os
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
+from app.cache import Cache
+from app.metrics import Metrics
+from app.replica import RoutingSession, init_replica
 from config import Config
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
+cache = Cache()
+metrics = Metrics()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    from app.database import configure_sqlite, pool_options, WriteQueue
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', pool_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
     db.init_app(app)
-    migrate.init_app(app, db)
+    with app.app_context():
+        engines = list(db.engines.values())
+    replica = init_replica(app)
+    if replica is not None:
+        engines.append(replica)
+    for engine in engines:
+        configure_sqlite(engine, app.config.get('SQLITE_PRAGMAS'))
+    if app.config.get('SQLITE_WRITE_QUEUE'):
+        app.extensions['write_queue'] = WriteQueue(
+            app,
+            max_batch=app.config['SQLITE_WRITE_QUEUE_MAX_BATCH'],
+            max_wait=app.config['SQLITE_WRITE_QUEUE_MAX_WAIT']
+        )
+    # Alembic is only needed by the 'flask db' commands, so web workers
+    # (and serverless cold starts) skip importing it
+    if click.get_current_context(silent=True) is not None:
+        init_migrations(app)
     jwt.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    
+    if app.config.get('TEMPLATE_CACHE'):
+        from jinja2 import FileSystemBytecodeCache
+        directory = app.config.get('TEMPLATE_CACHE_DIR')
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+    
+    if app.config.get('PROFILING_ENABLED'):
+        from app.profiling import init_profiling
+        init_profiling(app, engines)
     
     from app.routes import main_bp, api_bp
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
     
-    with app.app_context():
-        db.create_all()
+    from app.cli import register_commands
+    register_commands(app)
+    
+    if app.config['AUTO_CREATE_SCHEMA']:
+        with app.app_context():
+            db.create_all()
+    
+    # Typeahead index; CLI commands never serve lookups, so they skip the preload
+    from app.suggest import init_suggest
+    init_suggest(app, preload=app.config['SUGGEST_PRELOAD'] and click.get_current_context(silent=True) is None)
     
     return app
+
+
+def init_migrations(app):
+    """Register Flask-Migrate with app, enabling the 'flask db' commands and flask_migrate.upgrade()"""
+    from flask_migrate import Migrate
+    Migrate(app, db)
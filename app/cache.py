@@ -0,0 +1,162 @@
+"""Read-through cache for rarely changing reference data.
+
+Values are kept in-process for fast reads. Invalidation works per namespace
+through a generation token held by a pluggable backend. Bumping the token
+orphans every entry cached under the old one, in this process and in any
+other worker sharing the backend. MemoryBackend suits a single process.
+FileBackend keeps the tokens in a local directory, standing in for a
+shared store such as Redis when several workers run on one host.
+
+Cache plain data (dicts, lists), not ORM instances. An ORM instance is
+bound to the session that loaded it.
+"""
+import os
+import threading
+import time
+from flask import current_app
+
+
+class MemoryBackend:
+    """Generation tokens held in this process only"""
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_generation(self, namespace):
+        return self._generations.get(namespace, '0')
+
+    def bump_generation(self, namespace):
+        with self._lock:
+            self._generations[namespace] = os.urandom(8).hex()
+
+
+class FileBackend:
+    """Generation tokens in files under a directory shared by local workers"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, f'{namespace}.generation')
+
+    def get_generation(self, namespace):
+        try:
+            with open(self._path(namespace)) as f:
+                return f.read() or '0'
+        except FileNotFoundError:
+            return '0'
+
+    def bump_generation(self, namespace):
+        # Random tokens rather than a counter: concurrent bumps from two
+        # workers can never write the same value back
+        tmp_path = f'{self._path(namespace)}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'w') as f:
+            f.write(os.urandom(8).hex())
+        os.replace(tmp_path, self._path(namespace))
+
+
+class CacheStore:
+    """In-process entries, TTLs and hit/miss counters for one application"""
+
+    def __init__(self, backend, default_ttl=300, max_entries=10000):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        # No entry expires before this time, so eviction can skip scanning for expired ones
+        self._next_expiry = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+            counters[outcome] += 1
+
+    def get_or_set(self, namespace, key, loader, ttl=None, version=None):
+        generation = self.backend.get_generation(namespace)
+        entry = self._entries.get((namespace, key))
+        now = time.monotonic()
+        if entry is not None and entry[0] == generation and entry[1] > now and entry[3] == version:
+            self._count(namespace, 'hits')
+            return entry[2]
+
+        self._count(namespace, 'misses')
+        value = loader()
+        with self._lock:
+            # Rewriting a key replaces its entry and makes it the newest, so it needs no room
+            if self._entries.pop((namespace, key), None) is None and len(self._entries) >= self.max_entries:
+                self._evict(now)
+            expires = now + (ttl or self.default_ttl)
+            self._entries[(namespace, key)] = (generation, expires, value, version)
+            self._next_expiry = min(self._next_expiry, expires)
+        return value
+
+    def _evict(self, now):
+        """Make room for one entry: drop the expired entries, or else the oldest live one"""
+        if now >= self._next_expiry:
+            expired = [cache_key for cache_key, entry in self._entries.items() if entry[1] <= now]
+            for cache_key in expired:
+                del self._entries[cache_key]
+            self._next_expiry = min((entry[1] for entry in self._entries.values()), default=0)
+            if expired:
+                return
+        # Entries are kept in insertion order; drop the oldest
+        self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, namespace):
+        self.backend.bump_generation(namespace)
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[cache_key]
+        self._count(namespace, 'invalidations')
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._stats.items()}
+        for counters in namespaces.values():
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+        return {'backend': type(self.backend).__name__, 'entries': len(self._entries),
+                'namespaces': namespaces}
+
+
+class Cache:
+    """Flask extension giving each application its own CacheStore"""
+
+    def init_app(self, app):
+        backend_name = app.config.get('CACHE_BACKEND', 'memory')
+        if backend_name == 'file':
+            backend = FileBackend(app.config.get('CACHE_DIR') or os.path.join(app.instance_path, 'cache'))
+        elif backend_name == 'memory':
+            backend = MemoryBackend()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND: {backend_name}')
+
+        app.extensions['cache'] = CacheStore(
+            backend,
+            default_ttl=app.config.get('CACHE_DEFAULT_TTL', 300),
+            max_entries=app.config.get('CACHE_MAX_ENTRIES', 10000)
+        )
+
+    @property
+    def store(self):
+        return current_app.extensions['cache']
+
+    def get_or_set(self, namespace, key, loader, ttl=None, version=None):
+        """Return the cached value for key, calling loader() to fill a miss.
+
+        An entry cached under another version is a miss, and the new value
+        replaces it under the same key.
+        """
+        return self.store.get_or_set(namespace, key, loader, ttl, version)
+
+    def invalidate(self, namespace):
+        """Drop every entry in namespace, in all workers sharing the backend"""
+        self.store.invalidate(namespace)
+
+    def stats(self):
+        """Hit/miss/invalidation counters per namespace"""
+        return self.store.stats()
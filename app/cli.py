@@ -0,0 +1,100 @@
+import json
+from datetime import datetime
+import click
+from flask import current_app
+from app import db
+from app import search
+from app.services import DeduplicationService, ImportService, ExportService
+
+def register_commands(app):
+    """Attach the maintenance commands to the flask CLI"""
+    
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Rebuild the client full-text search index"""
+        with db.engine.begin() as connection:
+            indexed = search.rebuild_search_index(connection)
+        if indexed is None:
+            click.echo('Full-text index is only used on SQLite; nothing to rebuild.')
+        else:
+            click.echo(f'Indexed {indexed} clients.')
+
+    
+    @app.cli.command('rebuild-dedup-index')
+    @click.option('--batch-size', type=int, default=10000, help='Clients per transaction.')
+    def rebuild_dedup_index(batch_size):
+        """Recompute the duplicate-detection block keys of every client"""
+        indexed = DeduplicationService.rebuild_block_index(batch_size)
+        click.echo(f'Indexed {indexed} clients.')
+
+    
+    @app.cli.command('find-duplicates')
+    @click.option('--threshold', type=float, default=None,
+                  help='Minimum similarity score (defaults to DEDUP_THRESHOLD).')
+    @click.option('--max-block', type=int, default=None,
+                  help='Skip blocks with more clients than this (defaults to DEDUP_MAX_BLOCK).')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='Destination file (defaults to stdout).')
+    def find_duplicates(threshold, max_block, output):
+        """Write likely duplicate client pairs and their clusters as JSON"""
+        report = DeduplicationService.find_duplicate_pairs(threshold, max_block)
+        json.dump(report, output, indent=2)
+        output.write('\n')
+        click.echo(
+            f"{len(report['pairs'])} pairs in {len(report['clusters'])} clusters from "
+            f"{report['comparisons']} comparisons in {report['blocks']} blocks "
+            f"({report['oversized_blocks']} oversized blocks skipped), {report['elapsed_seconds']}s", err=True
+        )
+
+    
+    @app.cli.command('import-clients')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+                  help='Input format; guessed from the file extension by default.')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Rows per transaction (defaults to IMPORT_BATCH_SIZE).')
+    def import_clients(path, fmt, batch_size):
+        """Bulk import clients from a CSV or NDJSON file"""
+        fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            try:
+                report = ImportService.import_clients(ImportService.read_rows(stream, fmt), batch_size)
+            except UnicodeDecodeError as e:
+                raise click.ClickException(f'{path} is not valid UTF-8 text ({e.reason}); rows before the '
+                                           f'invalid bytes may already have been imported')
+        
+        for error in report['errors']:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        click.echo(
+            f"Imported {report['imported']} of {report['total']} rows "
+            f"({report['failed']} failed) in {report['batches']} batches, "
+            f"{report['elapsed_seconds']}s, {report['rows_per_second']} rows/s"
+        )
+
+    
+    @app.cli.command('export-clients')
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='Destination file (defaults to stdout).')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Clients per round trip (defaults to EXPORT_BATCH_SIZE).')
+    def export_clients(fmt, output, batch_size):
+        """Stream every client with their enrollments as NDJSON or CSV"""
+        batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+        for chunk in ExportService.iter_export(fmt, batch_size):
+            output.write(chunk)
+
+    
+    @app.cli.command('cohort-report')
+    @click.option('--as-of', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Date ages and cohorts are computed on (defaults to today).')
+    @click.option('--horizon', type=int, default=12, help='Months of follow-up per cohort.')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='Destination file (defaults to stdout).')
+    def cohort_report(as_of, horizon, output):
+        """Write age distribution, cohort and co-enrollment tables as JSON (needs NumPy)"""
+        from app import reporting
+        report = reporting.quarterly_report((as_of or datetime.now()).date(), horizon)
+        json.dump(report, output, indent=2)
+        output.write('\n')
@@ -0,0 +1,194 @@
+"""Engine setup and write-path plumbing.
+
+- pool_options() builds connection pool settings for server databases.
+- configure_sqlite() applies connection pragmas (WAL journaling, a relaxed
+  synchronous level, mmap, busy timeout) through an engine connect event.
+- retry_on_locked / with_lock_retry re-run a whole unit of work with
+  jittered exponential backoff when SQLite reports "database is locked".
+- WriteQueue is an optional single writer thread. It applies queued write
+  jobs from every request thread and commits them in groups, so one fsync
+  covers many registrations.
+
+Services send their writes through run_write(). It uses the queue when one
+is configured, and otherwise runs the job inline with lock retries.
+"""
+import functools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import db
+
+LOCK_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def pool_options(uri, config):
+    """Engine options for the connection pool behind uri, from the DB_POOL_* settings.
+
+    SQLite engines keep SQLAlchemy's defaults: a file database gets a small
+    queue pool and an in-memory one a single static connection.
+    """
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_sqlite(engine, pragmas):
+    """Run PRAGMA name=value for every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and any(
+        message in str(error.orig) for message in LOCK_MESSAGES
+    )
+
+
+def _backoff(attempt):
+    config = current_app.config
+    delay = min(config['SQLITE_RETRY_BACKOFF'] * 2 ** attempt, config['SQLITE_RETRY_MAX_BACKOFF'])
+    time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def with_lock_retry(unit_of_work):
+    """Call unit_of_work(), rolling back and re-running it while the database is locked"""
+    retries = current_app.config['SQLITE_LOCK_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            return unit_of_work()
+        except OperationalError as e:
+            if not is_lock_error(e) or attempt == retries:
+                raise
+            db.session.rollback()
+            _backoff(attempt)
+
+
+def retry_on_locked(fn):
+    """Decorator form of with_lock_retry for service methods that commit"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return with_lock_retry(lambda: fn(*args, **kwargs))
+    return wrapper
+
+
+def run_write(job, *args):
+    """Run a write job (which flushes but never commits) and commit it.
+
+    With a write queue configured, the job runs on the writer thread and is
+    committed together with concurrent jobs. Any pending work in the caller's
+    session is committed first, which also ends its read snapshot so that the
+    caller sees the job's rows afterwards. Returns whatever the job returns.
+    """
+    write_queue = current_app.extensions.get('write_queue')
+    if write_queue is not None:
+        db.session.commit()
+        return write_queue.submit(job, *args)
+
+    def unit_of_work():
+        result = job(*args)
+        db.session.commit()
+        return result
+    return with_lock_retry(unit_of_work)
+
+
+class WriteQueue:
+    """Single writer thread applying queued write jobs with group commit.
+
+    The writer takes the first waiting job, then collects more for up to
+    max_wait seconds (at most max_batch in total), runs them in one
+    transaction and commits once. A job that raises is dropped from the
+    group and the rest are re-run without it. On a lock error the whole
+    group is retried with backoff.
+    """
+
+    def __init__(self, app, max_batch=64, max_wait=0.002):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, job, *args):
+        """Queue job(*args) and block until its group has committed"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, args, future))
+        return future.result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                    self._thread.start()
+
+    def _next_group(self):
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(group) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                group.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                self._apply(self._next_group())
+                db.session.close()
+
+    def _apply(self, group):
+        pending = list(group)
+        retries = current_app.config['SQLITE_LOCK_RETRIES']
+        attempt = 0
+        while pending:
+            results = []
+            try:
+                for item in pending:
+                    job, args, future = item
+                    try:
+                        results.append(job(*args))
+                    except Exception as e:
+                        if is_lock_error(e):
+                            raise
+                        # Drop the failing job and replay the rest from scratch
+                        db.session.rollback()
+                        future.set_exception(e)
+                        pending.remove(item)
+                        break
+                else:
+                    db.session.commit()
+                    self.commits += 1
+                    for (_, _, future), result in zip(pending, results):
+                        future.set_result(result)
+                    return
+            except Exception as e:
+                db.session.rollback()
+                if not is_lock_error(e) or attempt == retries:
+                    for _, _, future in pending:
+                        future.set_exception(e)
+                    return
+                _backoff(attempt)
+                attempt += 1
@@ -0,0 +1,167 @@
+"""Record linkage for duplicate client registrations.
+
+Comparing every client with every other is O(n^2). Clients are instead
+grouped into blocks by cheap blocking keys, and the similarity scorer only
+compares clients that share a block. Each client gets up to three keys:
+
+- soundex of the first name + date of birth
+- soundex of the last name + date of birth
+- soundex of both names, in sorted order, + birth year
+
+No key says which name it came from, so swapped first and last names
+still share a block. Either name can be misspelled as long as the date of
+birth matches. The combined key catches a mistyped date when both names
+sound alike. Keys are stored in the client_block_key table, written
+alongside the client on every insert and every change of name or date of
+birth.
+
+This module is pure Python with no database access; DeduplicationService
+in app/services.py maintains the index and runs the checks.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+
+# Columns the scorer reads; a Client instance or a result row works too
+ClientRecord = namedtuple('ClientRecord', ['id', 'first_name', 'last_name', 'date_of_birth', 'gender',
+                                           'contact_number'])
+
+_SOUNDEX_CODES = {}
+for _letters, _code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+
+def normalize_name(name):
+    """Lowercase ASCII letters only: 'Njoroge-Mwangi ' -> 'njorogemwangi'"""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z]', '', name.lower())
+
+
+def soundex(name):
+    """American Soundex code of name, e.g. 'Robert' -> 'R163'; '' for a name without letters"""
+    name = normalize_name(name)
+    if not name:
+        return ''
+    code = name[0].upper()
+    previous = _SOUNDEX_CODES.get(name[0])
+    for letter in name[1:]:
+        digit = _SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w don't separate letters with the same code; vowels do
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def jaro(a, b):
+    """Jaro similarity of two strings, 0.0 to 1.0"""
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+    window = max(max(len_a, len_b) // 2 - 1, 0)
+    matched_b = [False] * len_b
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(i + window + 1, len_b)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    matches = len(matches_a)
+    if not matches:
+        return 0.0
+    matches_b = [char for char, matched in zip(b, matched_b) if matched]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    return (matches / len_a + matches / len_b + (matches - transpositions) / matches) / 3
+
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    """Jaro-Winkler similarity: Jaro boosted for a common prefix of up to four characters"""
+    similarity = jaro(a, b)
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return similarity + prefix * prefix_scale * (1 - similarity)
+
+
+def ngrams(name, n=3):
+    """The distinct n-grams of a normalized name; a name shorter than n is its own gram"""
+    name = normalize_name(name)
+    if len(name) <= n:
+        return {name} if name else set()
+    return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+
+def name_keys(first_name, last_name):
+    """Fuzzy-search columns of a client: Soundex codes of both names and their trigrams"""
+    return {
+        'first_name_phonetic': soundex(first_name) or None,
+        'last_name_phonetic': soundex(last_name) or None,
+        'name_ngrams': ' '.join(sorted(ngrams(first_name) | ngrams(last_name))) or None
+    }
+
+
+def name_similarity(terms, first_name, last_name):
+    """Mean over normalized query terms of each term's best Jaro-Winkler score against either name"""
+    names = (normalize_name(first_name), normalize_name(last_name))
+    return sum(max(jaro_winkler(term, name) for name in names) for term in terms) / len(terms)
+
+
+def blocking_keys(first_name, last_name, date_of_birth):
+    """The block keys of a client, as a set of short strings"""
+    first, last = soundex(first_name), soundex(last_name)
+    keys = set()
+    if date_of_birth is None:
+        return keys
+    born = date_of_birth.isoformat()
+    for code in (first, last):
+        if code:
+            keys.add(f'{code}:{born}')
+    if first and last:
+        keys.add(f"{''.join(sorted((first, last)))}:{date_of_birth.year}")
+    return keys
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def _date_similarity(a, b):
+    if a is None or b is None:
+        return 0.0
+    if a == b:
+        return 1.0
+    # Same year with one of day and month mistyped, or day and month swapped
+    if a.year == b.year and (a.month == b.month or a.day == b.day or (a.month, a.day) == (b.day, b.month)):
+        return 0.8
+    return 0.0
+
+
+def similarity(a, b):
+    """How likely records a and b describe the same person, 0.0 to 1.0.
+
+    Names weigh 70% (Jaro-Winkler, allowing for swapped first and last
+    names) and date of birth 30%. Different recorded genders scale the
+    score down; the same phone number raises it.
+    """
+    first_a, last_a = normalize_name(a.first_name), normalize_name(a.last_name)
+    first_b, last_b = normalize_name(b.first_name), normalize_name(b.last_name)
+    names = max(jaro_winkler(first_a, first_b) + jaro_winkler(last_a, last_b),
+                jaro_winkler(first_a, last_b) + jaro_winkler(last_a, first_b)) / 2
+    score = 0.7 * names + 0.3 * _date_similarity(a.date_of_birth, b.date_of_birth)
+    if a.gender and b.gender and a.gender != b.gender:
+        score *= 0.85
+    phone = _digits(a.contact_number)
+    if len(phone) >= 7 and phone == _digits(b.contact_number):
+        score = min(1.0, score + 0.1)
+    return score
@@ -0,0 +1,311 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are sharded per thread. Each thread updates only
+its own shard, a plain dict reached through threading.local, so recording
+a value takes no lock. The registry lock is taken only when a thread
+records its first value, to register its shard, and when the thread exits,
+to fold its shard into a retired total. Servers that start a thread per
+request therefore keep one shard per live thread, not one per request. A
+scrape sums the shards and the retired total.
+Copying a shard's items is a single C-level operation under the GIL, so a
+scrape sees each shard at some instant without pausing the writers.
+
+Gauges that describe current state (connection pool usage, cache hit
+ratios) are not updated on the request path at all. They are read from
+their source by collector callbacks at scrape time.
+
+GET /metrics serves every registered metric. Scrape it from an internal
+network only; like /api/cache/stats it exposes operational data.
+"""
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from operator import itemgetter
+from flask import current_app, g, request
+
+# Request latency buckets in seconds, from fast cached reads to slow exports
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardOwner:
+    """Referenced only from one thread's threading.local, so it is freed when the thread exits"""
+
+    __slots__ = ('__weakref__',)
+
+
+class _ShardedMetric:
+    """Base for metrics whose values live in per-thread shards"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Label values in labelnames order, as a tuple; itemgetter avoids a Python-level loop
+        if len(self.labelnames) > 1:
+            self._label_getter = itemgetter(*self.labelnames)
+        elif self.labelnames:
+            name = self.labelnames[0]
+            self._label_getter = lambda labels: (labels[name],)
+        else:
+            self._label_getter = lambda labels: ()
+        self._local = threading.local()
+        self._shards = []
+        # Values recorded by threads that have exited, in the same form as a shard
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(owner, self._retire, shard)
+            return shard
+
+    def _retire(self, shard):
+        """Fold the shard of an exited thread into the retired total"""
+        with self._lock:
+            self._shards.remove(shard)
+            self._fold(self._retired, list(shard.items()))
+
+    def _fold(self, totals, items):
+        """Add one shard's (key, value) items to totals"""
+        raise NotImplementedError
+
+    def _key(self, labels):
+        return self._label_getter(labels)
+
+    def _snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+            retired = list(self._retired.items())
+        return [list(shard.items()) for shard in shards] + [retired]
+
+    def values(self):
+        totals = {}
+        for items in self._snapshot():
+            self._fold(totals, items)
+        return totals
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _fold(self, totals, items):
+        for key, value in items:
+            totals[key] = totals.get(key, 0) + value
+
+    def value(self, **labels):
+        return self.values().get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_ShardedMetric):
+    """Distribution of observed values in cumulative buckets, with their sum and count"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        cells = shard.get(key)
+        if cells is None:
+            # One cell per bucket, one for +Inf, then the sum
+            cells = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def _fold(self, totals, items):
+        for key, cells in items:
+            if key in totals:
+                merged = totals[key]
+                for index, value in enumerate(cells):
+                    merged[index] += value
+            else:
+                totals[key] = list(cells)
+
+    def values(self):
+        """{label values: (per-bucket counts including +Inf, sum)}"""
+        totals = super().values()
+        return {key: (cells[:-1], cells[-1]) for key, cells in totals.items()}
+
+    def count(self, **labels):
+        counts, _ = self.values().get(self._key(labels), ([], 0))
+        return sum(counts)
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(float(total))}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of one application, plus scrape-time collectors for gauges"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect):
+        """Register collect(), returning (name, type, help, [(labels dict, value)]) tuples at scrape time"""
+        self.collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels, labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pool_samples(app):
+    """Connection pool gauges for the primary and replica engines"""
+    from app import db
+    with app.app_context():
+        engines = {'primary': db.engine}
+    if app.extensions.get('replica_engine') is not None:
+        engines['replica'] = app.extensions['replica_engine']
+
+    gauges = {'db_pool_size': [], 'db_pool_checked_out': [], 'db_pool_overflow': []}
+    for role, engine in engines.items():
+        pool = engine.pool
+        # Static and null pools (in-memory SQLite) have no counters to report
+        if not hasattr(pool, 'checkedout'):
+            continue
+        gauges['db_pool_size'].append(({'engine': role}, pool.size()))
+        gauges['db_pool_checked_out'].append(({'engine': role}, pool.checkedout()))
+        gauges['db_pool_overflow'].append(({'engine': role}, max(pool.overflow(), 0)))
+    return [
+        ('db_pool_size', 'gauge', 'Configured connection pool size', gauges['db_pool_size']),
+        ('db_pool_checked_out', 'gauge', 'Connections currently checked out', gauges['db_pool_checked_out']),
+        ('db_pool_overflow', 'gauge', 'Connections open beyond the pool size', gauges['db_pool_overflow']),
+    ]
+
+
+def _cache_samples(app):
+    namespaces = app.extensions['cache'].stats()['namespaces']
+    requests, ratios = [], []
+    for namespace, counters in sorted(namespaces.items()):
+        requests.append(({'namespace': namespace, 'result': 'hit'}, counters['hits']))
+        requests.append(({'namespace': namespace, 'result': 'miss'}, counters['misses']))
+        if counters['hit_ratio'] is not None:
+            ratios.append(({'namespace': namespace}, counters['hit_ratio']))
+    return [
+        ('cache_requests_total', 'counter', 'Cache lookups by namespace and result', requests),
+        ('cache_hit_ratio', 'gauge', 'Share of cache lookups served from the cache', ratios),
+    ]
+
+
+class Metrics:
+    """Flask extension giving each application its own MetricsRegistry"""
+
+    def init_app(self, app):
+        registry = MetricsRegistry()
+        registry.histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                           ('endpoint', 'method'))
+        registry.counter('http_requests_total', 'Requests by endpoint and status', ('endpoint', 'method', 'status'))
+        registry.counter('login_attempts_total', 'Login attempts by channel and result', ('channel', 'result'))
+        registry.counter('enrollment_changes_total', 'Enrollments created, removed or moved to another status',
+                         ('operation', 'mode'))
+        registry.collector(lambda: _pool_samples(app))
+        registry.collector(lambda: _cache_samples(app))
+        app.extensions['metrics'] = registry
+
+        if app.config.get('METRICS_ENABLED', True):
+            app.before_request(_start_timer)
+            app.after_request(_record_request)
+            app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+    @property
+    def registry(self):
+        return current_app.extensions['metrics']
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        self.registry.metrics[name].inc(amount, **labels)
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        self.registry.metrics[name].observe(value, **labels)
+
+
+def _start_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        registry = current_app.extensions['metrics'].metrics
+        endpoint = request.endpoint or 'unmatched'
+        registry['http_request_duration_seconds'].observe(
+            time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        registry['http_requests_total'].inc(endpoint=endpoint, method=request.method,
+                                            status=response.status_code)
+    return response
+
+
+def _metrics_view():
+    return current_app.response_class(current_app.extensions['metrics'].render(),
+                                      mimetype='text/plain; version=0.0.4')
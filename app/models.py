@@ -1,13 +1,75 @@
 from datetime import datetime
+from flask import current_app
 from app import db
+from app.matching import name_keys
 from werkzeug.security import generate_password_hash, check_password_hash
 
-# Association table for many-to-many relationship between clients and programs
-enrollments = db.Table('enrollments',
-    db.Column('client_id', db.Integer, db.ForeignKey('client.id'), primary_key=True),
-    db.Column('program_id', db.Integer, db.ForeignKey('health_program.id'), primary_key=True),
-    db.Column('enrollment_date', db.DateTime, default=datetime.utcnow),
-    db.Column('status', db.String(20), default='Active')
+class Enrollment(db.Model):
+    """A client's enrollment in a program: the association row behind Client.programs.
+
+    Services change status with UPDATE statements on the table (see
+    EnrollmentService.set_status), so the relationships here are read-only.
+    """
+    __tablename__ = 'enrollments'
+    __table_args__ = (
+        # Program rosters filter by program and status, and page through them by client
+        db.Index('ix_enrollments_program_id_status_client_id', 'program_id', 'status', 'client_id'),
+        # Every enrollment in a status, e.g. defaulters across programs
+        db.Index('ix_enrollments_status', 'status'),
+        # Client filters on enrollment date, across programs or within one
+        db.Index('ix_enrollments_enrollment_date_program_id', 'enrollment_date', 'program_id'),
+    )
+    # Statuses an enrollment can move to from each status
+    TRANSITIONS = {
+        'Active': ('Completed', 'Defaulted', 'Withdrawn'),
+        'Defaulted': ('Active', 'Completed', 'Withdrawn'),
+        'Withdrawn': ('Active',),
+        'Completed': (),
+    }
+    
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    program_id = db.Column(db.Integer, db.ForeignKey('health_program.id'), primary_key=True)
+    enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='Active')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    client = db.relationship('Client', viewonly=True)
+    program = db.relationship('HealthProgram', viewonly=True)
+    
+    @staticmethod
+    def validate_status(status):
+        """Return status if it is an enrollment status; ValueError otherwise"""
+        if status not in Enrollment.TRANSITIONS:
+            raise ValueError(f"Unknown status: {status}; expected one of {', '.join(Enrollment.TRANSITIONS)}")
+        return status
+    
+    @staticmethod
+    def statuses_before(status):
+        """Statuses an enrollment can move to status from"""
+        return [before for before, after in Enrollment.TRANSITIONS.items()
+                if Enrollment.validate_status(status) in after]
+    
+    def __repr__(self):
+        return f'<Enrollment {self.client_id} in {self.program_id}: {self.status}>'
+    
+    def to_dict(self):
+        return {
+            'client_id': self.client_id,
+            'program_id': self.program_id,
+            'status': self.status,
+            'enrollment_date': self.enrollment_date.isoformat() if self.enrollment_date else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+# The enrollments table, for bulk statements and the secondary of Client.programs
+enrollments = Enrollment.__table__
+
+# Blocking index for duplicate detection: each client's keys from app.matching.blocking_keys
+client_block_keys = db.Table('client_block_key',
+    db.Column('key', db.String(40), primary_key=True),
+    db.Column('client_id', db.Integer, db.ForeignKey('client.id', ondelete='CASCADE'), primary_key=True),
+    # Re-keying a client on update deletes its rows by client_id
+    db.Index('ix_client_block_key_client_id', 'client_id')
 )
 
 class User(db.Model):
@@ -18,16 +80,49 @@ class User(db.Model):
     role = db.Column(db.String(20), default='doctor')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @staticmethod
+    def password_hash_method():
+        """Werkzeug hash method string for the configured scheme and cost, e.g. 'pbkdf2:sha256:260000'"""
+        return f"{current_app.config['PASSWORD_HASH_METHOD']}:{current_app.config['PASSWORD_HASH_ITERATIONS']}"
+    
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=User.password_hash_method())
         
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def needs_rehash(self):
+        """Whether the stored hash was made with a different scheme or cost than configured"""
+        return self.password_hash.split('$', 1)[0] != User.password_hash_method()
+    
     def __repr__(self):
         return f'<User {self.username}>'
 
+def _name_key_default(column):
+    """Column default deriving a fuzzy-search key from the inserted row's names.
+
+    A context-sensitive default fires for ORM and bulk Core inserts alike, so
+    every insert path fills the key without calling anything.
+    """
+    def default(context):
+        values = context.get_current_parameters()
+        return name_keys(values.get('first_name'), values.get('last_name'))[column]
+    return default
+
 class Client(db.Model):
+    __table_args__ = (
+        # Name lookups and sorting; first_name alone for given-name searches
+        db.Index('ix_client_last_name_first_name', 'last_name', 'first_name'),
+        db.Index('ix_client_first_name', 'first_name'),
+        # Age filters are date_of_birth ranges; gender narrows them further
+        db.Index('ix_client_date_of_birth', 'date_of_birth'),
+        db.Index('ix_client_gender_date_of_birth', 'gender', 'date_of_birth'),
+        db.Index('ix_client_created_at', 'created_at'),
+        # Fuzzy search looks names up by Soundex code, optionally within a date_of_birth range
+        db.Index('ix_client_last_name_phonetic_date_of_birth', 'last_name_phonetic', 'date_of_birth'),
+        db.Index('ix_client_first_name_phonetic_date_of_birth', 'first_name_phonetic', 'date_of_birth'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(64), nullable=False)
     last_name = db.Column(db.String(64), nullable=False)
@@ -37,17 +132,29 @@ class Client(db.Model):
     email = db.Column(db.String(120))
     address = db.Column(db.String(200))
     medical_history = db.Column(db.Text)
+    # Derived from the names for fuzzy search (app.matching.name_keys); see refresh_name_keys
+    first_name_phonetic = db.Column(db.String(4), default=_name_key_default('first_name_phonetic'))
+    last_name_phonetic = db.Column(db.String(4), default=_name_key_default('last_name_phonetic'))
+    name_ngrams = db.Column(db.Text, default=_name_key_default('name_ngrams'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every change, including enrollment changes; drives ETag/Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # Many-to-many relationship with HealthProgram
+    # Many-to-many relationship with HealthProgram, in any enrollment status
     programs = db.relationship('HealthProgram', secondary=enrollments,
                               backref=db.backref('clients', lazy='dynamic'))
+    enrollments = db.relationship('Enrollment', viewonly=True)
     
     def __repr__(self):
         return f'<Client {self.first_name} {self.last_name}>'
     
-    def to_dict(self):
-        return {
+    def refresh_name_keys(self):
+        """Recompute the fuzzy-search columns after a name change"""
+        for key, value in name_keys(self.first_name, self.last_name).items():
+            setattr(self, key, value)
+    
+    def to_dict(self, include_programs=True):
+        data = {
             'id': self.id,
             'first_name': self.first_name,
             'last_name': self.last_name,
@@ -58,8 +165,11 @@ class Client(db.Model):
             'address': self.address,
             'medical_history': self.medical_history,
             'created_at': self.created_at.isoformat(),
-            'programs': [program.to_dict() for program in self.programs]
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+        if include_programs:
+            data['programs'] = [program.to_dict() for program in self.programs]
+        return data
 
 class HealthProgram(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -69,6 +179,7 @@ class HealthProgram(db.Model):
     end_date = db.Column(db.Date)
     status = db.Column(db.String(20), default='Active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<HealthProgram {self.name}>'
@@ -81,5 +192,32 @@ class HealthProgram(db.Model):
             'start_date': self.start_date.isoformat() if self.start_date else None,
             'end_date': self.end_date.isoformat() if self.end_date else None,
             'status': self.status,
-            'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ChangeLog(db.Model):
+    """Append-only record of writes, read by the delta sync feed.
+
+    The autoincrement id doubles as the monotonic change token handed to
+    sync clients. That relies on ids being visible in commit order, which
+    holds on SQLite, where one writer commits at a time. On PostgreSQL a
+    sequence hands out ids at insert time, so a transaction that commits
+    late can publish an id below a token a client has already seen, and
+    the client would skip that change. Before serving sync from PostgreSQL,
+    serialize the writes to change_log (e.g. a transaction-level advisory
+    lock taken by record_changes) or cap tokens below the oldest in-flight
+    transaction. Enrollment entries carry the client in entity_id and the
+    program in related_id; 'delete' entries are tombstones for removed rows.
+    """
+    __tablename__ = 'change_log'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    related_id = db.Column(db.Integer)
+    operation = db.Column(db.String(10), nullable=False, default='upsert')
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChangeLog {self.id} {self.operation} {self.entity} {self.entity_id}>'
@@ -0,0 +1,304 @@
+"""Opt-in request profiling.
+
+With PROFILING_ENABLED set, every request records:
+- its endpoint and wall time
+- the number of SQL statements and the time spent in them, from
+  before/after_cursor_execute events on every engine
+- rows fetched from SELECTs, rows written by DML and ORM instances loaded
+- time spent rendering templates and serializing JSON
+
+The figures go out in a Server-Timing header, so they show up in the
+browser's network panel. They are also logged, and aggregated per endpoint
+for GET /api/profiling. A request that runs the same statement many times
+(the signature of an N+1 loop, such as to_dict() lazily loading each
+client's programs) is logged as a warning.
+
+With PROFILE_SAMPLER_ENABLED also set, a background thread samples the
+stacks of in-flight requests every PROFILE_SAMPLE_INTERVAL seconds.
+Requests slower than PROFILE_SLOW_REQUEST_MS have their samples written to
+PROFILE_DIR in folded-stack format ("frame;frame;frame count" per line),
+ready for flamegraph.pl or speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine.cursor import CursorFetchStrategy
+from sqlalchemy.orm import Mapper
+
+
+class RequestProfile:
+    """Measurements for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.orm_loads = 0
+        self.render_time = 0.0
+        self.statements = Counter()
+
+    def to_dict(self, endpoint, status, wall_time):
+        statement, repeats = self.statements.most_common(1)[0] if self.statements else (None, 0)
+        return {
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': status,
+            'wall_ms': round(wall_time * 1000, 2),
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'rows': self.rows,
+            'orm_loads': self.orm_loads,
+            'serialize_ms': round(self.render_time * 1000, 2),
+            'max_repeats': repeats,
+            'most_repeated': statement if repeats > 1 else None
+        }
+
+
+def current_profile():
+    """The profile of the request being handled, or None"""
+    return g.get('_profile') if has_request_context() else None
+
+
+def _add_rows(count):
+    profile = current_profile()
+    if profile is not None:
+        profile.rows += count
+
+
+class CountingFetchStrategy(CursorFetchStrategy):
+    """Default cursor fetching that adds the rows handed out to the request profile"""
+
+    __slots__ = ()
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = super().fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            _add_rows(1)
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = super().fetchmany(result, dbapi_cursor, size)
+        _add_rows(len(rows))
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = super().fetchall(result, dbapi_cursor)
+        _add_rows(len(rows))
+        return rows
+
+
+_COUNTING_FETCH = CountingFetchStrategy()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Keyed by cursor so _handle_error can drop the entry of a statement that failed
+    conn.info.setdefault('profile_query_start', {})[id(cursor)] = time.perf_counter()
+    # The driver's rowcount is -1 for SELECTs on SQLite, so rows read are counted
+    # as they are fetched; streamed results keep their own buffering strategy
+    if (context is not None and not context.is_crud and current_profile() is not None
+            and type(context.cursor_fetch_strategy) is CursorFetchStrategy
+            and not context.execution_options.get('stream_results')):
+        context.cursor_fetch_strategy = _COUNTING_FETCH
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['profile_query_start'].pop(id(cursor))
+    profile = current_profile()
+    if profile is None:
+        return
+    profile.queries += 1
+    profile.db_time += time.perf_counter() - started
+    profile.statements[statement] += 1
+    if context is not None and context.is_crud and cursor.rowcount > 0:
+        profile.rows += cursor.rowcount
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    if exception_context.connection is not None and context is not None:
+        exception_context.connection.info.get('profile_query_start', {}).pop(id(context.cursor), None)
+
+
+def _instance_loaded(target, context):
+    profile = current_profile()
+    if profile is not None:
+        profile.orm_loads += 1
+
+
+class TimedTemplate(Template):
+    """Template that adds its render time to the request profile"""
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            profile = current_profile()
+            if profile is not None:
+                profile.render_time += time.perf_counter() - started
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that adds serialization time to the request profile"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            profile = current_profile()
+            if profile is not None:
+                profile.render_time += time.perf_counter() - started
+
+
+class StackSampler:
+    """Background thread sampling the stacks of registered request threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._samples.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.fold(frame)] += 1
+
+    @staticmethod
+    def fold(frame):
+        """A stack as 'outermost;...;innermost' of module:function:line frames"""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+            stack.append(f'{module}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+class Profiler:
+    """Per-app profiling state: recent request profiles and per-endpoint totals"""
+
+    def __init__(self, app, engines):
+        self.app = app
+        self.recent = deque(maxlen=app.config['PROFILE_HISTORY'])
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self.sampler = None
+        if app.config['PROFILE_SAMPLER_ENABLED']:
+            self.sampler = StackSampler(app.config['PROFILE_SAMPLE_INTERVAL'])
+
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+        if not event.contains(Mapper, 'load', _instance_loaded):
+            event.listen(Mapper, 'load', _instance_loaded)
+        app.jinja_env.template_class = TimedTemplate
+        app.json = TimedJSONProvider(app)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g._profile = RequestProfile()
+        if self.sampler is not None:
+            self.sampler.start(threading.get_ident())
+
+    def finish_request(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        wall_time = time.perf_counter() - profile.started
+        record = profile.to_dict(request.endpoint, response.status_code, wall_time)
+
+        response.headers.add('Server-Timing', f"db;dur={record['db_ms']};desc=\"{profile.queries} queries\"")
+        response.headers.add('Server-Timing', f"serialize;dur={record['serialize_ms']}")
+        response.headers.add('Server-Timing', f"total;dur={record['wall_ms']}")
+
+        self.record(record)
+        self.app.logger.info(
+            'profile %(method)s %(path)s %(status)s %(wall_ms)sms queries=%(queries)s db=%(db_ms)sms '
+            'rows=%(rows)s orm_loads=%(orm_loads)s serialize=%(serialize_ms)sms', record
+        )
+        if record['max_repeats'] >= self.app.config['PROFILE_REPEATED_QUERY_WARNING']:
+            self.app.logger.warning('possible N+1 in %s: statement ran %d times: %s',
+                                    record['endpoint'], record['max_repeats'], record['most_repeated'])
+
+        if self.sampler is not None:
+            samples = self.sampler.stop(threading.get_ident())
+            if record['wall_ms'] >= self.app.config['PROFILE_SLOW_REQUEST_MS'] and samples:
+                self.dump_samples(record, samples)
+        return response
+
+    def record(self, record):
+        with self._lock:
+            self.recent.append(record)
+            totals = self.endpoints.setdefault(record['endpoint'], {
+                'requests': 0, 'wall_ms': 0.0, 'db_ms': 0.0, 'queries': 0, 'serialize_ms': 0.0, 'max_wall_ms': 0.0
+            })
+            totals['requests'] += 1
+            totals['max_wall_ms'] = max(totals['max_wall_ms'], record['wall_ms'])
+            for key in ('wall_ms', 'db_ms', 'queries', 'serialize_ms'):
+                totals[key] += record[key]
+
+    def dump_samples(self, record, samples):
+        """Write a slow request's stack samples as a folded-stack file; returns its path"""
+        directory = self.app.config['PROFILE_DIR'] or os.path.join(self.app.instance_path, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{record['endpoint'] or 'unknown'}.folded"
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        self.app.logger.warning('slow request %s %s took %sms; stack samples in %s',
+                                record['method'], record['path'], record['wall_ms'], path)
+        return path
+
+    def stats(self):
+        """Per-endpoint averages and the most recent request profiles"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, totals in self.endpoints.items():
+                count = totals['requests']
+                endpoints[endpoint] = {
+                    'requests': count,
+                    'avg_wall_ms': round(totals['wall_ms'] / count, 2),
+                    'max_wall_ms': totals['max_wall_ms'],
+                    'avg_db_ms': round(totals['db_ms'] / count, 2),
+                    'avg_queries': round(totals['queries'] / count, 2),
+                    'avg_serialize_ms': round(totals['serialize_ms'] / count, 2)
+                }
+            return {'endpoints': endpoints, 'recent': list(self.recent)}
+
+
+def init_profiling(app, engines):
+    """Install the profiler on app and its engines when PROFILING_ENABLED is set"""
+    if app.config.get('PROFILING_ENABLED'):
+        app.extensions['profiler'] = Profiler(app, engines)
+    return app.extensions.get('profiler')
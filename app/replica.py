@@ -0,0 +1,53 @@
+"""Read/write splitting between the primary database and a read replica.
+
+When REPLICA_DATABASE_URL is set, init_replica() creates an engine for it
+next to Flask-SQLAlchemy's primary engine. Views decorated with
+use_replica send their reads there. Flushes and Core INSERT/UPDATE/DELETE
+statements always go to the primary, as do all reads outside those views,
+so service writes and read-your-own-write paths are unaffected. Without a
+replica every query uses the primary.
+
+The replica is expected to trail the primary by at most a few seconds.
+Decorate only views that can tolerate that: listings, search, exports and
+the sync feed.
+"""
+import functools
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+
+
+def init_replica(app):
+    """Create the replica engine for app, if REPLICA_DATABASE_URL is configured"""
+    from app.database import pool_options
+    url = app.config.get('REPLICA_DATABASE_URL')
+    if url:
+        app.extensions['replica_engine'] = create_engine(url, **pool_options(url, app.config))
+    return app.extensions.get('replica_engine')
+
+
+def replica_engine():
+    """The current application's replica engine, or None"""
+    return current_app.extensions.get('replica_engine')
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica inside use_replica views"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get('use_replica')
+                and not getattr(clause, 'is_dml', False)):
+            replica = replica_engine()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica(view):
+    """Serve a read-only view from the replica (GET and HEAD requests only)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,231 @@
+"""Vectorized cohort analytics over columnar extracts of clients and enrollments.
+
+Quarterly reports cover every client, so this module never builds ORM
+instances. load_clients() and load_enrollments() stream plain column
+values in batches into NumPy arrays. Dates are fetched as ISO strings and
+parsed by NumPy in one call per batch. The report functions then work on
+whole arrays: age bands come from searchsorted and bincount, cohorts from
+ufunc.at reductions, and the co-enrollment matrix from chunked matrix
+products of the client x program incidence matrix.
+
+NumPy is an optional dependency (see requirements.txt). Importing this
+module always works, and require_numpy() raises a clear error when it is
+missing.
+"""
+from collections import namedtuple
+from sqlalchemy import String, cast, func, select
+from app import db
+from app.models import Client, enrollments
+from app.services import AnalyticsService
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columns of the extracts. Categorical values are stored as small integer
+# codes into the accompanying label tuples.
+ClientExtract = namedtuple('ClientExtract', ['ids', 'birth_dates', 'gender_codes', 'genders'])
+EnrollmentExtract = namedtuple('EnrollmentExtract', [
+    'client_ids', 'program_ids', 'status_codes', 'statuses', 'enrollment_dates'
+])
+
+# Rows of the co-enrollment product computed at a time, bounding its memory
+CHUNK_SIZE = 100000
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('Cohort reporting needs NumPy: pip install numpy')
+
+
+def _iso_date(column):
+    """The date part of a date or datetime column as 'YYYY-MM-DD' text, for bulk parsing"""
+    return func.substr(cast(column, String), 1, 10)
+
+
+def _encode(values, labels):
+    """Integer codes of values in labels, extending labels with unseen values"""
+    index = {label: code for code, label in enumerate(labels)}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    labels[:] = list(index)
+    return codes
+
+
+def _stream_columns(statement, batch_size):
+    """Yield the columns of statement's rows, batch_size rows at a time.
+
+    Rows come straight from a DBAPI cursor. Building SQLAlchemy Row objects
+    costs more than the rest of the extract put together. The statements
+    here only hold constants, so they are rendered with literal binds.
+    """
+    connection = db.session.connection()
+    sql = str(statement.compile(bind=connection, compile_kwargs={'literal_binds': True}))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield list(zip(*rows))
+    finally:
+        cursor.close()
+
+
+def load_clients(batch_size=50000):
+    """Extract id, date of birth and gender of every client into arrays"""
+    require_numpy()
+    ids, birth_dates, gender_codes, genders = [], [], [], []
+    statement = select(Client.id, _iso_date(Client.date_of_birth), Client.gender).order_by(Client.id)
+    for batch_ids, batch_dates, batch_genders in _stream_columns(statement, batch_size):
+        ids.append(np.array(batch_ids, dtype=np.int64))
+        birth_dates.append(np.array(batch_dates, dtype='datetime64[D]'))
+        gender_codes.append(np.array(_encode(batch_genders, genders), dtype=np.int16))
+    return ClientExtract(
+        np.concatenate(ids) if ids else np.empty(0, dtype=np.int64),
+        np.concatenate(birth_dates) if birth_dates else np.empty(0, dtype='datetime64[D]'),
+        np.concatenate(gender_codes) if gender_codes else np.empty(0, dtype=np.int16),
+        tuple(genders)
+    )
+
+
+def load_enrollments(batch_size=50000):
+    """Extract every enrollment's client, program, status and enrollment day into arrays"""
+    require_numpy()
+    client_ids, program_ids, status_codes, statuses, enrollment_dates = [], [], [], [], []
+    statement = select(
+        enrollments.c.client_id, enrollments.c.program_id, enrollments.c.status,
+        _iso_date(enrollments.c.enrollment_date)
+    ).order_by(enrollments.c.client_id, enrollments.c.program_id)
+    for batch_clients, batch_programs, batch_statuses, batch_dates in _stream_columns(statement, batch_size):
+        client_ids.append(np.array(batch_clients, dtype=np.int64))
+        program_ids.append(np.array(batch_programs, dtype=np.int64))
+        status_codes.append(np.array(_encode(batch_statuses, statuses), dtype=np.int16))
+        enrollment_dates.append(np.array(batch_dates, dtype='datetime64[D]'))
+
+    def join(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    return EnrollmentExtract(
+        join(client_ids, np.int64), join(program_ids, np.int64),
+        join(status_codes, np.int16), tuple(statuses), join(enrollment_dates, 'datetime64[D]')
+    )
+
+
+def ages(birth_dates, on):
+    """Whole years between each birth date and the date on"""
+    require_numpy()
+    on = np.datetime64(on, 'D')
+    years = birth_dates.astype('datetime64[Y]')
+    months = birth_dates.astype('datetime64[M]')
+    # Month and day packed as MMDD, so "birthday not reached yet" is one comparison
+    birth_mmdd = (months - years).astype(np.int64) * 100 + (birth_dates - months).astype(np.int64)
+    on_years, on_months = on.astype('datetime64[Y]'), on.astype('datetime64[M]')
+    on_mmdd = (on_months - on_years).astype(np.int64) * 100 + (on - on_months).astype(np.int64)
+    return (on_years - years).astype(np.int64) - (birth_mmdd > on_mmdd)
+
+
+def age_distribution(clients, on, bands=AnalyticsService.AGE_BANDS):
+    """Client counts per age band and gender.
+
+    Returns the band labels, the gender labels and a (gender x band) count
+    matrix. Clients born after on are left out.
+    """
+    require_numpy()
+    labels = [f'{low}-{high - 1}' for low, high in zip(bands, bands[1:])] + [f'{bands[-1]}+']
+    client_ages = ages(clients.birth_dates, on)
+    known = client_ages >= bands[0]
+    band_index = np.searchsorted(np.asarray(bands), client_ages[known], side='right') - 1
+    cells = clients.gender_codes[known].astype(np.int64) * len(labels) + band_index
+    counts = np.bincount(cells, minlength=len(clients.genders) * len(labels))
+    return {
+        'bands': labels,
+        'genders': list(clients.genders),
+        'counts': counts.reshape(len(clients.genders), len(labels)).tolist(),
+        'totals': counts.reshape(len(clients.genders), len(labels)).sum(axis=0).tolist()
+    }
+
+
+def cohort_table(enrollment_extract, horizon=12):
+    """Monthly enrollment cohorts and how many of each cohort enroll again later.
+
+    A client's cohort is the month of their first enrollment. retained[c][k]
+    counts clients of cohort c with an enrollment starting k months after
+    it (so retained[c][0] is the cohort size). still_active counts the
+    cohort's clients with at least one Active enrollment today.
+    """
+    require_numpy()
+    extract = enrollment_extract
+    if not len(extract.client_ids):
+        return {'cohorts': [], 'sizes': [], 'retained': [], 'still_active': []}
+
+    months = extract.enrollment_dates.astype('datetime64[M]').astype(np.int64)
+    clients, client_index = np.unique(extract.client_ids, return_inverse=True)
+    first_month = np.full(len(clients), np.iinfo(np.int64).max)
+    np.minimum.at(first_month, client_index, months)
+
+    first_cohort = first_month.min()
+    cohort_index = first_month - first_cohort
+    cohort_count = int(cohort_index.max()) + 1
+
+    offsets = months - first_month[client_index]
+    in_horizon = offsets < horizon
+    # One count per (client, offset), however many programs they joined that month
+    pairs = np.unique(client_index[in_horizon] * horizon + offsets[in_horizon])
+    pair_clients, pair_offsets = pairs // horizon, pairs % horizon
+    retained = np.bincount(cohort_index[pair_clients] * horizon + pair_offsets,
+                           minlength=cohort_count * horizon).reshape(cohort_count, horizon)
+
+    active_code = extract.statuses.index('Active') if 'Active' in extract.statuses else -1
+    has_active = np.zeros(len(clients), dtype=bool)
+    has_active[client_index[extract.status_codes == active_code]] = True
+    still_active = np.bincount(cohort_index[has_active], minlength=cohort_count)
+
+    cohorts = (np.arange(cohort_count) + first_cohort).astype('datetime64[M]')
+    sizes = retained[:, 0]
+    keep = sizes > 0
+    return {
+        'cohorts': [str(month) for month in cohorts[keep]],
+        'sizes': sizes[keep].tolist(),
+        'retained': retained[keep].tolist(),
+        'still_active': still_active[keep].tolist()
+    }
+
+
+def co_enrollment_matrix(enrollment_extract, active_only=True):
+    """Program x program counts of clients enrolled in both programs.
+
+    The diagonal holds each program's own enrollment count. The matrix is
+    B.T @ B for the client x program incidence matrix B, accumulated over
+    blocks of CHUNK_SIZE clients so memory stays bounded.
+    """
+    require_numpy()
+    extract = enrollment_extract
+    selected = np.ones(len(extract.client_ids), dtype=bool)
+    if active_only:
+        active_code = extract.statuses.index('Active') if 'Active' in extract.statuses else -1
+        selected = extract.status_codes == active_code
+
+    programs, program_index = np.unique(extract.program_ids[selected], return_inverse=True)
+    clients, client_index = np.unique(extract.client_ids[selected], return_inverse=True)
+    matrix = np.zeros((len(programs), len(programs)), dtype=np.int64)
+    for start in range(0, len(clients), CHUNK_SIZE):
+        rows = (client_index >= start) & (client_index < start + CHUNK_SIZE)
+        block = np.zeros((min(CHUNK_SIZE, len(clients) - start), len(programs)), dtype=np.float32)
+        block[client_index[rows] - start, program_index[rows]] = 1
+        matrix += (block.T @ block).astype(np.int64)
+    return {'program_ids': programs.tolist(), 'counts': matrix.tolist()}
+
+
+def quarterly_report(on, horizon=12, batch_size=50000):
+    """Age distribution, cohorts and co-enrollment for the whole database"""
+    clients = load_clients(batch_size)
+    enrollment_extract = load_enrollments(batch_size)
+    return {
+        'as_of': str(np.datetime64(on, 'D')),
+        'clients': len(clients.ids),
+        'enrollments': len(enrollment_extract.client_ids),
+        'age_distribution': age_distribution(clients, on),
+        'cohorts': cohort_table(enrollment_extract, horizon),
+        'co_enrollment': co_enrollment_matrix(enrollment_extract)
+    }
@@ -1,18 +1,83 @@
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, session, current_app, abort, Response, stream_with_context
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from app import cache, jwt, metrics
+from app.replica import use_replica
 from app.models import Client, HealthProgram, User
-from app.services import ClientService, ProgramService, EnrollmentService, UserService
-from datetime import datetime
+from app.utils import make_etag, decode_cursor
+from app.services import ClientService, ProgramService, EnrollmentService, UserService, ImportService, ExportService, SyncService, AnalyticsService, DeduplicationService
+from datetime import datetime, timezone
+import io
 
 main_bp = Blueprint('main', __name__)
 api_bp = Blueprint('api', __name__)
 
+def page_args():
+    """Read the limit and cursor query parameters for a paginated listing"""
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    return limit, request.args.get('cursor')
+
+# Query parameters accepted as client filters (see client_filter_clauses)
+CLIENT_FILTER_ARGS = ('gender', 'min_age', 'max_age', 'born_after', 'born_before',
+                      'registered_after', 'registered_before',
+                      'program', 'status', 'enrolled_after', 'enrolled_before')
+
+def client_filter_args():
+    """Client filter criteria given as query parameters"""
+    return {key: request.args[key] for key in CLIENT_FILTER_ARGS if request.args.get(key)}
+
+def suggest_limit():
+    """Read the limit query parameter of a typeahead lookup"""
+    limit = request.args.get('limit', current_app.config['SUGGEST_LIMIT'], type=int)
+    return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+def paginated_response(records, next_cursor, endpoint, limit, params=None):
+    """Return a page of serialized records, advertising the next page in a Link header.
+
+    params are further query parameters (filters, sort) the next page keeps.
+    """
+    response = jsonify(records)
+    if next_cursor:
+        next_url = url_for(endpoint, limit=limit, cursor=next_cursor, _external=True, **(params or {}))
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+def conditional_response(etag, last_modified, build):
+    """Answer a GET with 304 if the client's validators still match, else build() it.
+
+    The validators are computed by the caller from row versions, so a
+    matching If-None-Match or If-Modified-Since never loads or serializes
+    the body.
+    """
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = bool(since and last_modified and last_modified <= since)
+    
+    response = current_app.response_class(status=304) if not_modified else build()
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def possible_duplicates(client):
+    """Other clients that may be the same person as a newly registered client"""
+    return DeduplicationService.find_possible_duplicates(
+        client.first_name, client.last_name, client.date_of_birth, client.gender, client.contact_number,
+        exclude_id=client.id
+    )
+
 # Web routes
 @main_bp.route('/')
+@use_replica
 def index():
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
-    return render_template('index.html')
+    return render_template('index.html', dashboard=AnalyticsService.get_dashboard())
 
 @main_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -21,6 +86,7 @@ def login():
         password = request.form.get('password')
         
         user = UserService.authenticate_user(username, password)
+        metrics.inc('login_attempts_total', channel='web', result='success' if user else 'failure')
         if user:
             session['user_id'] = user.id
             session['username'] = user.username
@@ -36,12 +102,18 @@ def logout():
     return redirect(url_for('main.login'))
 
 @main_bp.route('/clients')
+@use_replica
 def clients():
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    clients = ClientService.get_all_clients()
-    return render_template('clients.html', clients=clients)
+    limit, cursor = page_args()
+    try:
+        clients, next_cursor = ClientService.get_clients_page(limit, cursor)
+    except ValueError:
+        abort(400)
+    return render_template('clients.html', clients=clients, cursor=cursor,
+                           next_cursor=next_cursor, limit=limit)
 
 @main_bp.route('/clients/new', methods=['GET', 'POST'])
 def new_client():
@@ -60,6 +132,11 @@ def new_client():
             medical_history=request.form.get('medical_history')
         )
         flash('Client created successfully')
+        duplicates = possible_duplicates(client)
+        if duplicates:
+            flash('Possible duplicate of ' + ', '.join(
+                f"{match['first_name']} {match['last_name']} (#{match['id']}, born {match['date_of_birth']})"
+                for match in duplicates))
         return redirect(url_for('main.client_profile', client_id=client.id))
     
     return render_template('new_client.html')
@@ -69,34 +146,61 @@ def client_profile(client_id):
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    client = ClientService.get_client(client_id)
+    client = ClientService.get_client(client_id, with_programs=True)
     if not client:
         flash('Client not found')
         return redirect(url_for('main.clients'))
     
-    programs = ProgramService.get_all_programs()
-    return render_template('client_profile.html', client=client, programs=programs)
+    programs = ProgramService.get_program_catalog()
+    enrolled_program_ids = {program.id for program in client.programs}
+    return render_template('client_profile.html', client=client, programs=programs,
+                           enrolled_program_ids=enrolled_program_ids)
 
 @main_bp.route('/clients/search')
+@use_replica
 def search_clients():
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
     query = request.args.get('query', '')
+    limit, _ = page_args()
+    clients, fuzzy = [], False
     if query:
-        clients = ClientService.search_clients(query)
-    else:
-        clients = []
+        # One extra match tells whether the list was cut at limit
+        clients = ClientService.search_clients(query, limit=limit + 1)
+        if not clients:
+            # Misspelled or differently transliterated names: offer the closest ones
+            clients = [client for client, _ in ClientService.fuzzy_search_clients(query, limit + 1)]
+            fuzzy = bool(clients)
+    truncated = len(clients) > limit
+    # Results are ranked, so a longer list is the next "page"; past MAX_PAGE_SIZE the query needs narrowing
+    max_limit = current_app.config['MAX_PAGE_SIZE']
+    more_limit = min(limit * 2, max_limit) if truncated and limit < max_limit else None
     
-    return render_template('search_clients.html', clients=clients, query=query)
+    return render_template('search_clients.html', clients=clients[:limit], query=query, fuzzy=fuzzy,
+                           truncated=truncated, more_limit=more_limit)
+
+@main_bp.route('/clients/suggest')
+@use_replica
+def suggest_clients():
+    # Fetched by the search page as the user types
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    return jsonify(ClientService.suggest_clients(request.args.get('prefix', ''), suggest_limit()))
 
 @main_bp.route('/programs')
+@use_replica
 def programs():
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    programs = ProgramService.get_all_programs()
-    return render_template('programs.html', programs=programs)
+    limit, cursor = page_args()
+    try:
+        programs, next_cursor = ProgramService.get_programs_page_data(limit, cursor)
+    except ValueError:
+        abort(400)
+    return render_template('programs.html', programs=programs, cursor=cursor,
+                           next_cursor=next_cursor, limit=limit)
 
 @main_bp.route('/programs/new', methods=['GET', 'POST'])
 def new_program():
@@ -148,6 +252,11 @@ def unenroll_client():
     return redirect(url_for('main.client_profile', client_id=client_id))
 
 # API routes
+@jwt.user_lookup_loader
+def load_jwt_user(jwt_header, jwt_data):
+    """Resolve the token's user for current_user; unknown users get a 401"""
+    return UserService.get_user_snapshot(jwt_data['sub'])
+
 @api_bp.route('/login', methods=['POST'])
 def api_login():
     data = request.get_json()
@@ -155,6 +264,7 @@ def api_login():
     password = data.get('password')
     
     user = UserService.authenticate_user(username, password)
+    metrics.inc('login_attempts_total', channel='api', result='success' if user else 'failure')
     if not user:
         return jsonify({'error': 'Invalid credentials'}), 401
     
@@ -163,18 +273,52 @@ def api_login():
 
 @api_bp.route('/clients', methods=['GET'])
 @jwt_required()
+@use_replica
 def api_get_clients():
-    clients = ClientService.get_all_clients()
-    return jsonify([client.to_dict() for client in clients])
+    limit, cursor = page_args()
+    criteria, sort = client_filter_args(), request.args.get('sort')
+    try:
+        versions, next_cursor = ClientService.get_clients_page_versions(limit, cursor, criteria, sort)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    program_count, programs_changed = ProgramService.get_catalog_version()
+    etag = make_etag('clients', limit, cursor, sort, sorted(criteria.items()), program_count, programs_changed,
+                     *(f'{row.id}:{row.updated_at}' for row in versions))
+    changes = [row.updated_at for row in versions if row.updated_at]
+    if programs_changed:
+        changes.append(programs_changed)
+    last_modified = max(changes, default=None)
+    
+    def build():
+        # The filters and sort already picked the page; load its clients by ID
+        clients = ClientService.get_clients_by_ids([row.id for row in versions], with_programs=True)
+        params = dict(criteria, sort=sort) if sort else criteria
+        return paginated_response([client.to_dict() for client in clients], next_cursor,
+                                  'api.api_get_clients', limit, params)
+    return conditional_response(etag, last_modified, build)
 
 @api_bp.route('/clients/<int:client_id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def api_get_client(client_id):
-    client = ClientService.get_client(client_id)
-    if not client:
+    version = ClientService.get_client_version(client_id)
+    if version is None:
         return jsonify({'error': 'Client not found'}), 404
     
-    return jsonify(client.to_dict())
+    def build():
+        client = ClientService.get_client(client_id, with_programs=True)
+        return jsonify(client.to_dict())
+    return conditional_response(make_etag('client', client_id, version), version, build)
+
+@api_bp.route('/clients/<int:client_id>/duplicates', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_client_duplicates(client_id):
+    duplicates = DeduplicationService.get_client_duplicates(client_id)
+    if duplicates is None:
+        return jsonify({'error': 'Client not found'}), 404
+    return jsonify(duplicates)
 
 @api_bp.route('/clients', methods=['POST'])
 @jwt_required()
@@ -192,24 +336,87 @@ def api_create_client():
             address=data.get('address'),
             medical_history=data.get('medical_history')
         )
-        return jsonify(client.to_dict()), 201
+        return jsonify(dict(client.to_dict(), possible_duplicates=possible_duplicates(client))), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@api_bp.route('/clients/import', methods=['POST'])
+@jwt_required()
+def api_import_clients():
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if not fmt:
+        content_type = upload.mimetype if upload else request.mimetype
+        fmt = 'csv' if content_type == 'text/csv' else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    
+    batch_size = request.args.get('batch_size', current_app.config['IMPORT_BATCH_SIZE'], type=int)
+    if batch_size < 1:
+        return jsonify({'error': 'batch_size must be positive'}), 400
+    
+    stream = upload.stream if upload else request.stream
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        report = ImportService.import_clients(ImportService.read_rows(text, fmt), batch_size)
+    except UnicodeDecodeError as e:
+        # Batches read before the bad bytes are already committed
+        return jsonify({'error': f'The file is not valid UTF-8 text ({e.reason}). Save it as UTF-8 and upload it '
+                                 f'again; rows before the invalid bytes may already have been imported'}), 400
+    return jsonify(report)
+
+@api_bp.route('/clients/export', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_export_clients():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    # Taken before streaming starts: replaying /api/sync from here catches up
+    # on anything written while the export runs
+    sync_token = SyncService.current_token()
+    return Response(
+        stream_with_context(ExportService.iter_export(fmt, batch_size)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=clients.{fmt}',
+                 'X-Sync-Token': str(sync_token)}
+    )
+
 @api_bp.route('/programs', methods=['GET'])
 @jwt_required()
+@use_replica
 def api_get_programs():
-    programs = ProgramService.get_all_programs()
-    return jsonify([program.to_dict() for program in programs])
+    limit, cursor = page_args()
+    try:
+        decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    program_count, programs_changed = ProgramService.get_catalog_version()
+    etag = make_etag('programs', limit, cursor, program_count, programs_changed)
+    
+    def build():
+        programs, next_cursor = ProgramService.get_programs_page_data(limit, cursor)
+        return paginated_response(programs, next_cursor, 'api.api_get_programs', limit)
+    try:
+        return conditional_response(etag, programs_changed, build)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @api_bp.route('/programs/<int:program_id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def api_get_program(program_id):
-    program = ProgramService.get_program(program_id)
+    program = ProgramService.get_program_data(program_id)
     if not program:
         return jsonify({'error': 'Program not found'}), 404
     
-    return jsonify(program.to_dict())
+    updated_at = datetime.fromisoformat(program['updated_at']) if program['updated_at'] else None
+    etag = make_etag('program', program_id, program['updated_at'])
+    return conditional_response(etag, updated_at, lambda: jsonify(program))
 
 @api_bp.route('/programs', methods=['POST'])
 @jwt_required()
@@ -246,9 +453,149 @@ def api_unenroll_client(client_id, program_id):
     
     return jsonify({'error': 'Failed to unenroll client'}), 400
 
+@api_bp.route('/clients/<int:client_id>/programs/<int:program_id>', methods=['PATCH'])
+@jwt_required()
+def api_set_enrollment_status(client_id, program_id):
+    data = request.get_json() or {}
+    try:
+        changed = EnrollmentService.set_status(client_id, program_id, data.get('status'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if changed:
+        return jsonify({'message': 'Enrollment status updated'})
+    return jsonify({'error': 'Failed to update enrollment status'}), 400
+
+def bulk_enrollment_targets(data):
+    """Read the client_ids list or filter object of a bulk enrollment request"""
+    client_ids = data.get('client_ids')
+    criteria = data.get('filter')
+    if client_ids is None and not criteria:
+        raise ValueError('Provide client_ids or a filter')
+    if client_ids is not None and not isinstance(client_ids, list):
+        raise ValueError('client_ids must be a list')
+    if criteria is not None and not isinstance(criteria, dict):
+        raise ValueError('filter must be an object')
+    return client_ids, criteria
+
+@api_bp.route('/programs/<int:program_id>/enrollments', methods=['POST'])
+@jwt_required()
+def api_bulk_enroll(program_id):
+    try:
+        client_ids, criteria = bulk_enrollment_targets(request.get_json() or {})
+        report = EnrollmentService.bulk_enroll(program_id, client_ids, criteria)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if report is None:
+        return jsonify({'error': 'Program not found'}), 404
+    return jsonify(report)
+
+@api_bp.route('/programs/<int:program_id>/enrollments', methods=['DELETE'])
+@jwt_required()
+def api_bulk_unenroll(program_id):
+    try:
+        client_ids, criteria = bulk_enrollment_targets(request.get_json() or {})
+        report = EnrollmentService.bulk_unenroll(program_id, client_ids, criteria)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if report is None:
+        return jsonify({'error': 'Program not found'}), 404
+    return jsonify(report)
+
+@api_bp.route('/programs/<int:program_id>/enrollments', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_get_program_enrollments(program_id):
+    limit, cursor = page_args()
+    status = request.args.get('status') or None
+    try:
+        page = EnrollmentService.get_program_enrollments_page(program_id, limit, cursor, status)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if page is None:
+        return jsonify({'error': 'Program not found'}), 404
+    enrollments, next_cursor = page
+    records = [dict(enrollment.to_dict(), client=enrollment.client.to_dict(include_programs=False))
+               for enrollment in enrollments]
+    return paginated_response(records, next_cursor, 'api.api_get_program_enrollments', limit,
+                              {'program_id': program_id, 'status': status})
+
+@api_bp.route('/programs/<int:program_id>/enrollments/status', methods=['POST'])
+@jwt_required()
+def api_bulk_set_enrollment_status(program_id):
+    data = request.get_json() or {}
+    try:
+        client_ids, criteria = bulk_enrollment_targets(data)
+        report = EnrollmentService.bulk_set_status(program_id, data.get('status'), client_ids, criteria)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if report is None:
+        return jsonify({'error': 'Program not found'}), 404
+    return jsonify(report)
+
+@api_bp.route('/sync', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_sync():
+    since = request.args.get('since', '0')
+    # str.isdigit() also accepts digits such as '²' that int() rejects
+    if not (since.isascii() and since.isdigit()):
+        return jsonify({'error': 'since must be a change token'}), 400
+    
+    limit, _ = page_args()
+    return jsonify(SyncService.get_changes(int(since), limit))
+
+@api_bp.route('/analytics/dashboard', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_dashboard():
+    today = datetime.now().date()
+    etag = make_etag('dashboard', SyncService.current_token(), today.isoformat())
+    return conditional_response(etag, None, lambda: jsonify(AnalyticsService.get_dashboard(today)))
+
+@api_bp.route('/profiling', methods=['GET'])
+@jwt_required()
+def api_profiling():
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    return jsonify(profiler.stats())
+
+@api_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def api_cache_stats():
+    return jsonify(cache.stats())
+
+@api_bp.route('/clients/suggest', methods=['GET'])
+@jwt_required()
+@use_replica
+def api_suggest_clients():
+    return jsonify(ClientService.suggest_clients(request.args.get('prefix', ''), suggest_limit()))
+
 @api_bp.route('/clients/search', methods=['GET'])
 @jwt_required()
+@use_replica
 def api_search_clients():
     query = request.args.get('query', '')
-    clients = ClientService.search_clients(query)
-    return jsonify([client.to_dict() for client in clients])
\ No newline at end of file
+    limit, _ = page_args()
+    # One extra match tells whether the list was cut at limit
+    try:
+        if request.args.get('fuzzy', type=int):
+            matches = ClientService.fuzzy_search_clients(query, limit + 1, with_programs=True,
+                                                         criteria=client_filter_args())
+            records = [dict(client.to_dict(), score=score) for client, score in matches[:limit]]
+            truncated = len(matches) > limit
+        else:
+            clients = ClientService.search_clients(query, with_programs=True, limit=limit + 1,
+                                                   criteria=client_filter_args())
+            records = [client.to_dict() for client in clients[:limit]]
+            truncated = len(clients) > limit
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(records)
+    response.headers['X-Truncated'] = 'true' if truncated else 'false'
+    return response
\ No newline at end of file
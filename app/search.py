@@ -0,0 +1,210 @@
+"""Indexed client search.
+
+On SQLite, clients are indexed in an FTS5 external-content table. Triggers
+on the client table keep it in sync, so every write path (create_client,
+update_client, or raw SQL) updates the index in the same transaction.
+Searches are ranked prefix queries over names, phone number and email;
+two and three character prefixes are indexed so short as-you-type terms
+don't have to expand every matching token.
+Other databases fall back to ILIKE matching over the same columns, which
+the migrations back with trigram indexes on PostgreSQL.
+
+Fuzzy search tolerates misspelled and inconsistently transliterated names
+("Otiyeno" for "Otieno"). It never scans the client table. Candidates come
+from two indexed lookups:
+- the Soundex code columns, through ordinary B-tree indexes, together
+  with the clients whose first or last name is spelled exactly like a
+  query term, through the name indexes
+- on SQLite, the name trigram column (Client.name_ngrams), indexed in a
+  second FTS5 table and matched as "any of the query's trigrams", best
+  BM25 rank first
+At most FUZZY_SEARCH_CANDIDATES of each are then scored with Jaro-Winkler
+and the top few returned.
+"""
+import re
+from sqlalchemy import event, inspect, literal_column, or_, select, table, column, union_all
+from app import matching
+from app.models import Client
+
+FTS_TABLE = 'client_fts'
+INDEXED_COLUMNS = ('first_name', 'last_name', 'contact_number', 'email')
+
+client_fts = table(FTS_TABLE, column('rowid'), column('rank'))
+
+NGRAM_TABLE = 'client_ngram_fts'
+client_ngram_fts = table(NGRAM_TABLE, column('rowid'), column('rank'))
+
+
+def _indexed_values(row):
+    """SQL expressions for the indexed columns of row ('new', 'old' or 'client')"""
+    # Phone numbers are indexed digits-only so "0712 345 678" and
+    # "0712-345678" both match a search for "0712345"
+    phone = f"{row}.contact_number"
+    for char in (' ', '-', '(', ')', '+'):
+        phone = f"replace({phone}, '{char}', '')"
+    return f"{row}.first_name, {row}.last_name, {phone}, {row}.email"
+
+_COLUMN_LIST = ', '.join(INDEXED_COLUMNS)
+
+CREATE_STATEMENTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_COLUMN_LIST}, content='client', content_rowid='id', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS client_fts_ai AFTER INSERT ON client BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMN_LIST}) VALUES (new.id, {_indexed_values('new')}); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS client_fts_ad AFTER DELETE ON client BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMN_LIST}) "
+    f"VALUES ('delete', old.id, {_indexed_values('old')}); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS client_fts_au AFTER UPDATE OF {_COLUMN_LIST} ON client BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMN_LIST}) "
+    f"VALUES ('delete', old.id, {_indexed_values('old')}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMN_LIST}) VALUES (new.id, {_indexed_values('new')}); "
+    f"END",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {NGRAM_TABLE} USING fts5("
+    f"name_ngrams, content='client', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS client_ngram_fts_ai AFTER INSERT ON client BEGIN "
+    f"INSERT INTO {NGRAM_TABLE}(rowid, name_ngrams) VALUES (new.id, new.name_ngrams); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS client_ngram_fts_ad AFTER DELETE ON client BEGIN "
+    f"INSERT INTO {NGRAM_TABLE}({NGRAM_TABLE}, rowid, name_ngrams) VALUES ('delete', old.id, old.name_ngrams); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS client_ngram_fts_au AFTER UPDATE OF name_ngrams ON client BEGIN "
+    f"INSERT INTO {NGRAM_TABLE}({NGRAM_TABLE}, rowid, name_ngrams) VALUES ('delete', old.id, old.name_ngrams); "
+    f"INSERT INTO {NGRAM_TABLE}(rowid, name_ngrams) VALUES (new.id, new.name_ngrams); "
+    f"END",
+)
+
+DROP_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS client_ngram_fts_au",
+    "DROP TRIGGER IF EXISTS client_ngram_fts_ad",
+    "DROP TRIGGER IF EXISTS client_ngram_fts_ai",
+    f"DROP TABLE IF EXISTS {NGRAM_TABLE}",
+    "DROP TRIGGER IF EXISTS client_fts_au",
+    "DROP TRIGGER IF EXISTS client_fts_ad",
+    "DROP TRIGGER IF EXISTS client_fts_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+# (engine, table) pairs already checked, mapped to whether the FTS table exists
+_fts_available = {}
+
+
+@event.listens_for(Client.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    """Create the FTS table and its sync triggers alongside the client table"""
+    if connection.dialect.name == 'sqlite':
+        for statement in CREATE_STATEMENTS:
+            connection.exec_driver_sql(statement)
+        _fts_available.clear()
+
+
+@event.listens_for(Client.__table__, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    """Drop the FTS table and triggers before the client table goes away"""
+    if connection.dialect.name == 'sqlite':
+        for statement in DROP_STATEMENTS:
+            connection.exec_driver_sql(statement)
+        _fts_available.clear()
+
+
+def rebuild_search_index(connection):
+    """(Re)create the FTS table and repopulate it from the client table.
+
+    Used for databases created before the index existed. Returns the number
+    of indexed clients, or None when the database is not SQLite.
+    """
+    if connection.dialect.name != 'sqlite':
+        return None
+    for statement in CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+    result = connection.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMN_LIST}) "
+        f"SELECT client.id, {_indexed_values('client')} FROM client"
+    )
+    connection.exec_driver_sql(f"INSERT INTO {NGRAM_TABLE}({NGRAM_TABLE}) VALUES ('rebuild')")
+    _fts_available.clear()
+    return result.rowcount
+
+
+def fts_available(engine, name=FTS_TABLE):
+    """Whether engine has the FTS table `name`, checked once per engine"""
+    if (engine, name) not in _fts_available:
+        _fts_available[(engine, name)] = (
+            engine.dialect.name == 'sqlite' and inspect(engine).has_table(name)
+        )
+    return _fts_available[(engine, name)]
+
+
+def search_terms(query):
+    """Split a search string into normalized terms.
+
+    Separators inside phone numbers are dropped so the number is one term,
+    matching how contact_number is indexed.
+    """
+    query = re.sub(r'(?<=\d)[\s\-()]+(?=\d)', '', query or '')
+    return re.findall(r'\w+', query)
+
+
+def match_expression(terms):
+    """FTS5 query requiring every term as a prefix, e.g. '"jo"* "doe"*'"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def apply_search(query, terms, engine):
+    """Restrict a Client query to clients matching all terms, best match first"""
+    if fts_available(engine):
+        return query.join(client_fts, client_fts.c.rowid == Client.id).filter(
+            literal_column(FTS_TABLE).op('MATCH')(match_expression(terms))
+        ).order_by(client_fts.c.rank)
+
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(
+            Client.first_name.ilike(pattern),
+            Client.last_name.ilike(pattern),
+            Client.contact_number.ilike(pattern),
+            Client.email.ilike(pattern)
+        ))
+    return query.order_by(Client.last_name, Client.first_name, Client.id)
+
+
+def fuzzy_terms(query, max_terms=3):
+    """The normalized alphabetic terms of a fuzzy query; digits and punctuation are dropped"""
+    terms = [matching.normalize_name(term) for term in search_terms(query)]
+    return [term for term in terms if term][:max_terms]
+
+
+def fuzzy_candidates(terms, engine, clauses, limit):
+    """SELECTs of candidate client IDs for fuzzy terms, each using an index and returning at most limit rows.
+
+    clauses (such as a date_of_birth range) restrict both lookups.
+
+    A common Soundex code can match far more than limit clients, and the
+    phonetic lookup keeps whichever limit of them its index yields first;
+    sorting the whole code's clients would cost more than the search. So
+    the same statement first takes up to limit clients whose name is
+    spelled exactly like a term (capitalized as typed, title case or upper
+    case), through the name indexes, and those are never truncated away.
+    """
+    codes = {matching.soundex(term) for term in terms}
+    spellings = {spelling for term in terms for spelling in (term, term.capitalize(), term.upper())}
+    exact = select(Client.id).where(
+        or_(Client.first_name.in_(spellings), Client.last_name.in_(spellings)), *clauses
+    ).limit(limit).subquery()
+    phonetic = select(Client.id).where(
+        or_(Client.first_name_phonetic.in_(codes), Client.last_name_phonetic.in_(codes)), *clauses
+    ).limit(limit).subquery()
+    selections = [union_all(select(exact.c.id), select(phonetic.c.id))]
+    if fts_available(engine, NGRAM_TABLE):
+        grams = set().union(*(matching.ngrams(term) for term in terms))
+        selections.append(
+            select(client_ngram_fts.c.rowid)
+            .join(Client, Client.id == client_ngram_fts.c.rowid)
+            .where(literal_column(NGRAM_TABLE).op('MATCH')(' OR '.join(f'"{gram}"' for gram in sorted(grams))),
+                   *clauses)
+            .order_by(client_ngram_fts.c.rank)
+            .limit(limit)
+        )
+    return selections
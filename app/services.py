@@ -1,30 +1,282 @@
-from datetime import datetime
-from app import db
-from app.models import Client, HealthProgram, User
-from sqlalchemy.exc import IntegrityError
+import csv
+import io
+import json
+import time
+from collections import namedtuple
+from itertools import groupby
+from operator import attrgetter
+from datetime import date, datetime, time as clock_time, timedelta
+from flask import current_app
+from app import db, cache, metrics
+from app import matching, search
+from app.database import retry_on_locked, run_write, with_lock_retry
+from app.models import ChangeLog, Client, Enrollment, HealthProgram, User, client_block_keys, enrollments
+from app.utils import encode_cursor, decode_cursor, validate_email, validate_date_format
+from sqlalchemy import case, delete, exists, func, insert, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash
 
+def _cursor_value(column, value):
+    """A cursor value decoded back into the Python type of column; ValueError for any other JSON value"""
+    python_type = column.type.python_type
+    if python_type in (date, datetime):
+        if isinstance(value, str):
+            try:
+                return python_type.fromisoformat(value)
+            except ValueError:
+                pass
+    # Checked, not converted: int('7'), int(1.5) and str({}) would all quietly succeed
+    elif isinstance(value, python_type) and not isinstance(value, bool):
+        return value
+    raise ValueError('Invalid cursor')
+
+def keyset_page(query, key_column, limit, cursor=None, order_by=(), descending=False):
+    """Return (items, next_cursor) for the page of query rows after cursor.
+
+    Rows are ordered by the order_by columns, then by key_column, which must
+    be unique (normally the primary key); descending reverses the order. The
+    cursor holds the last row's values of all of them, so with an index on
+    those columns each page is a single index range scan regardless of its
+    depth.
+    """
+    columns = (*order_by, key_column)
+    after = decode_cursor(cursor)
+    if after is not None:
+        if len(after) != len(columns):
+            raise ValueError('Invalid cursor')
+        if order_by:
+            position = tuple_(*columns)
+            bound = tuple_(*(literal(_cursor_value(column, value), column.type)
+                             for column, value in zip(columns, after)))
+        else:
+            position, bound = key_column, _cursor_value(key_column, after[0])
+        query = query.filter(position < bound if descending else position > bound)
+    rows = query.order_by(*(column.desc() if descending else column for column in columns)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = [getattr(rows[-1], column.key) for column in columns]
+    return rows, encode_cursor([value.isoformat() if isinstance(value, date) else value for value in last])
+
+# Read-only view of a user, safe to share across requests from the cache
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'email', 'role'])
+
 class UserService:
+    CACHE_NAMESPACE = 'users'
+    
     @staticmethod
+    @retry_on_locked
     def create_user(username, email, password, role='doctor'):
         user = User(username=username, email=email, role=role)
         user.set_password(password)
         db.session.add(user)
         try:
             db.session.commit()
-            return user
         except IntegrityError:
             db.session.rollback()
             return None
+        # Drop any cached miss for the new ID
+        cache.invalidate(UserService.CACHE_NAMESPACE)
+        return user
 
     @staticmethod
     def authenticate_user(username, password):
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
+            if user.needs_rehash():
+                UserService._rehash_password(user, password)
             return user
         return None
+    
+    @staticmethod
+    def _rehash_password(user, password):
+        """Re-hash a verified password with the current settings; login still succeeds if this fails"""
+        def rehash():
+            # A lock error rolls the new hash back, so each retry sets it again
+            user.set_password(password)
+            db.session.commit()
+        
+        try:
+            with_lock_retry(rehash)
+        except SQLAlchemyError:
+            db.session.rollback()
+    
+    @staticmethod
+    def get_user_snapshot(user_id):
+        """Get a UserSnapshot by ID, cached for USER_CACHE_TTL seconds; None if there is no such user"""
+        def load():
+            user = db.session.get(User, user_id)
+            return UserSnapshot(user.id, user.username, user.email, user.role) if user else None
+        return cache.get_or_set(UserService.CACHE_NAMESPACE, user_id, load,
+                                ttl=current_app.config['USER_CACHE_TTL'])
+
+def client_query(with_programs=False):
+    """Build a Client query, optionally batch-loading enrolled programs.
+
+    With with_programs the programs of every returned client are fetched by a
+    single extra SELECT ... IN query instead of one lazy load per client, so
+    serializing a list with Client.to_dict() costs a constant number of queries.
+    """
+    query = Client.query
+    if with_programs:
+        query = query.options(selectinload(Client.programs))
+    return query
+
+def years_before(day, years):
+    """The date `years` whole years before day (Feb 29 falls back to Feb 28)"""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+def _filter_day(key, value):
+    if not validate_date_format(str(value)):
+        raise ValueError(f'{key} must be a YYYY-MM-DD date')
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _filter_day_span(key, value):
+    """(start, end) datetimes of the filter day, for inclusive date filters on timestamp columns"""
+    start = datetime.combine(_filter_day(key, value), clock_time.min)
+    return start, start + timedelta(days=1)
+
+def _filter_int(key, value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a whole number')
+
+def client_filter_parts(criteria, today=None):
+    """Split client filter criteria into (clauses on Client, clauses on enrollments).
+
+    See client_filter_clauses for the criteria. Raises ValueError for
+    unknown criteria or malformed values.
+    """
+    today = today or date.today()
+    clauses, enrollment_clauses = [], []
+    for key, value in (criteria or {}).items():
+        if value is None or value == '':
+            continue
+        if key == 'gender':
+            clauses.append(Client.gender == value)
+        elif key == 'min_age':
+            clauses.append(Client.date_of_birth <= years_before(today, _filter_int(key, value)))
+        elif key == 'max_age':
+            clauses.append(Client.date_of_birth > years_before(today, _filter_int(key, value) + 1))
+        elif key in ('born_after', 'born_before'):
+            day = _filter_day(key, value)
+            clauses.append(Client.date_of_birth >= day if key == 'born_after'
+                           else Client.date_of_birth <= day)
+        elif key in ('registered_after', 'registered_before'):
+            start, end = _filter_day_span(key, value)
+            clauses.append(Client.created_at >= start if key == 'registered_after'
+                           else Client.created_at < end)
+        elif key == 'program':
+            enrollment_clauses.append(enrollments.c.program_id == _filter_int(key, value))
+        elif key == 'status':
+            enrollment_clauses.append(enrollments.c.status == value)
+        elif key in ('enrolled_after', 'enrolled_before'):
+            start, end = _filter_day_span(key, value)
+            enrollment_clauses.append(enrollments.c.enrollment_date >= start if key == 'enrolled_after'
+                                      else enrollments.c.enrollment_date < end)
+        else:
+            raise ValueError(f'Unknown filter: {key}')
+    return clauses, enrollment_clauses
+
+# Criteria answered by one index, in the order ClientService._filter probes them:
+# Client.created_at, enrollment dates (in any program), program and status, then
+# Client.gender/date_of_birth
+CLIENT_FILTER_GROUPS = (
+    ('registered_after', 'registered_before'),
+    ('enrolled_after', 'enrolled_before'),
+    ('program', 'status'),
+    ('gender', 'min_age', 'max_age', 'born_after', 'born_before'),
+)
+
+def enrolled_clause(enrollment_clauses):
+    """Client has an enrollment matching enrollment_clauses; probes the (client_id, program_id) key"""
+    return exists().where(enrollments.c.client_id == Client.id, *enrollment_clauses)
+
+def client_filter_clauses(criteria, today=None):
+    """Translate client filter criteria into SQL clauses on Client.
+
+    Supported criteria:
+    - gender
+    - min_age and max_age (whole years on today)
+    - born_after and born_before (inclusive YYYY-MM-DD dates)
+    - registered_after and registered_before (inclusive dates of Client.created_at)
+    - program (a program id), status, enrolled_after and enrolled_before,
+      which all apply to the same enrollment: program=1&status=Active means
+      an active enrollment in program 1
+
+    Ages and dates become ranges on indexed columns, and the enrollment
+    criteria an EXISTS on the enrollments primary key. Raises ValueError for
+    unknown criteria or malformed values.
+    """
+    clauses, enrollment_clauses = client_filter_parts(criteria, today)
+    if enrollment_clauses:
+        clauses.append(enrolled_clause(enrollment_clauses))
+    return clauses
+
+# Orders accepted by the client listings: the columns sorted on ahead of Client.id.
+# Each matches an index, so keyset pages stay range scans
+CLIENT_SORTS = {
+    'id': (),
+    'name': (Client.last_name, Client.first_name),
+    'date_of_birth': (Client.date_of_birth,),
+    'created_at': (Client.created_at,),
+}
+
+def client_sort(sort):
+    """(order_by columns, descending) for a sort key such as 'name' or '-created_at'"""
+    sort = sort or 'id'
+    descending = sort.startswith('-')
+    key = sort.lstrip('-')
+    if key not in CLIENT_SORTS:
+        raise ValueError(f"Unknown sort: {key}; expected one of {', '.join(CLIENT_SORTS)}")
+    return CLIENT_SORTS[key], descending
+
+def record_changes(entity, keys, operation='upsert'):
+    """Append change-log entries for the sync feed in the current transaction.
+
+    keys are entity IDs, or (client_id, program_id) pairs for enrollments.
+    """
+    now = datetime.utcnow()
+    entries = []
+    for key in keys:
+        entity_id, related_id = key if isinstance(key, tuple) else (key, None)
+        entries.append({'entity': entity, 'entity_id': entity_id, 'related_id': related_id,
+                        'operation': operation, 'changed_at': now})
+    if entries:
+        db.session.execute(insert(ChangeLog), entries)
+
+def record_enrollment_changes(selection, operation):
+    """Log every enrollment row matched by selection, a SELECT of (client_id, program_id)"""
+    rows = selection.add_columns(literal('enrollment'), literal(operation), literal(datetime.utcnow()))
+    db.session.execute(insert(ChangeLog).from_select(
+        ['entity_id', 'related_id', 'entity', 'operation', 'changed_at'], rows
+    ))
+
+def record_block_keys(clients, replace=False):
+    """Write the duplicate-detection block keys of (id, first_name, last_name, date_of_birth) rows.
+
+    With replace, the clients' existing keys are removed first, as after a
+    change of name or date of birth.
+    """
+    clients = list(clients)
+    if replace and clients:
+        db.session.execute(delete(client_block_keys).where(
+            client_block_keys.c.client_id.in_([client[0] for client in clients])))
+    rows = [{'key': key, 'client_id': client_id}
+            for client_id, first_name, last_name, date_of_birth in clients
+            for key in matching.blocking_keys(first_name, last_name, date_of_birth)]
+    if rows:
+        db.session.execute(insert(client_block_keys), rows)
 
 class ClientService:
+    # Filtered listings with at most this many matches are sorted from their IDs
+    SELECTIVE_FILTER_ROWS = 2000
+    
     @staticmethod
     def create_client(first_name, last_name, date_of_birth, gender, contact_number=None, 
                      email=None, address=None, medical_history=None):
@@ -32,7 +284,7 @@ class ClientService:
         if isinstance(date_of_birth, str):
             date_of_birth = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
             
-        client = Client(
+        client_id = run_write(ClientService._insert_client, dict(
             first_name=first_name,
             last_name=last_name,
             date_of_birth=date_of_birth,
@@ -41,47 +293,220 @@ class ClientService:
             email=email,
             address=address,
             medical_history=medical_history
-        )
+        ))
+        return db.session.get(Client, client_id)
+    
+    @staticmethod
+    def _insert_client(values):
+        """Write job for create_client; returns the new client's ID"""
+        client = Client(**values)
         db.session.add(client)
-        db.session.commit()
-        return client
+        db.session.flush()
+        record_changes('client', [client.id])
+        record_block_keys([(client.id, client.first_name, client.last_name, client.date_of_birth)])
+        return client.id
     
     @staticmethod
-    def get_client(client_id):
+    def get_client(client_id, with_programs=False):
         """Get a client by ID"""
-        return Client.query.get(client_id)
+        return client_query(with_programs).filter(Client.id == client_id).first()
     
     @staticmethod
-    def search_clients(query):
-        """Search for clients by name"""
-        return Client.query.filter(
-            (Client.first_name.ilike(f'%{query}%')) | 
-            (Client.last_name.ilike(f'%{query}%'))
-        ).all()
+    def search_clients(query, with_programs=False, limit=None, criteria=None):
+        """Search for clients by name, phone number or email, best matches first.
+
+        criteria takes the client_filter_clauses filters, such as a
+        born_after/born_before date_of_birth range.
+        """
+        terms = search.search_terms(query)
+        if not terms:
+            return []
+        results = search.apply_search(client_query(with_programs), terms, db.engine)
+        results = results.filter(*client_filter_clauses(criteria))
+        if limit:
+            results = results.limit(limit)
+        return results.all()
     
     @staticmethod
-    def get_all_clients():
+    def fuzzy_search_clients(query, limit=10, with_programs=False, criteria=None):
+        """Clients whose names sound or are spelled like the query, as (client, score) pairs, best first.
+
+        Candidates come from the phonetic and n-gram indexes only (see
+        app/search.py), so the cost does not grow with the table. Matches
+        scoring under FUZZY_SEARCH_MIN_SCORE are dropped.
+        """
+        terms = search.fuzzy_terms(query)
+        if not terms:
+            return []
+        clauses = client_filter_clauses(criteria)
+        candidate_ids = set()
+        for selection in search.fuzzy_candidates(terms, db.engine, clauses,
+                                                 current_app.config['FUZZY_SEARCH_CANDIDATES']):
+            candidate_ids.update(db.session.execute(selection).scalars())
+        if not candidate_ids:
+            return []
+        
+        # Score on the names alone, then load the full rows of the winners
+        min_score = current_app.config['FUZZY_SEARCH_MIN_SCORE']
+        scores = {}
+        for client_id, first_name, last_name in db.session.execute(
+            select(Client.id, Client.first_name, Client.last_name).where(Client.id.in_(candidate_ids))
+        ):
+            score = matching.name_similarity(terms, first_name, last_name)
+            if score >= min_score:
+                scores[client_id] = score
+        best = sorted(scores, key=lambda client_id: (-scores[client_id], client_id))[:limit]
+        if not best:
+            return []
+        clients = {client.id: client for client in client_query(with_programs).filter(Client.id.in_(best))}
+        return [(clients[client_id], round(scores[client_id], 3)) for client_id in best]
+
+    @staticmethod
+    def suggest_clients(prefix, limit=10):
+        """Clients whose name or phone number starts with prefix, for as-you-type lookups.
+
+        Matching runs in the in-memory index (app/suggest.py); only the
+        display columns of the matches are read from the database. While
+        the index is still being built, the full-text search stands in.
+        """
+        client_ids = current_app.extensions['suggest'].suggest(prefix, limit)
+        if client_ids is None:
+            terms = search.search_terms(prefix)
+            client_ids = [client_id for client_id, in search.apply_search(
+                db.session.query(Client.id), terms, db.engine).limit(limit)] if terms else []
+        if not client_ids:
+            return []
+        rows = {row.id: row for row in db.session.execute(
+            select(Client.id, Client.first_name, Client.last_name, Client.date_of_birth, Client.gender,
+                   Client.contact_number).where(Client.id.in_(client_ids))
+        )}
+        return [{
+            'id': row.id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'date_of_birth': row.date_of_birth.isoformat() if row.date_of_birth else None,
+            'gender': row.gender,
+            'contact_number': row.contact_number
+        } for row in (rows.get(client_id) for client_id in client_ids) if row is not None]
+
+    @staticmethod
+    def get_all_clients(with_programs=False):
         """Get all clients"""
-        return Client.query.all()
+        return client_query(with_programs).all()
+    
+    @staticmethod
+    def get_clients_page(limit, cursor=None, with_programs=False, criteria=None, sort=None):
+        """Get a page of clients matching criteria (see client_filter_clauses), starting after cursor.
+
+        sort is a CLIENT_SORTS key, prefixed with '-' for descending order;
+        clients are ordered by ID by default.
+        """
+        order_by, descending = client_sort(sort)
+        query = ClientService._filter(client_query(with_programs), criteria)
+        return keyset_page(query, Client.id, limit, cursor, order_by, descending)
+    
+    @staticmethod
+    def _filter(query, criteria):
+        """Apply client filter criteria to query, choosing the plan by how many clients match.
+
+        Without statistics on value distributions, SQLite prefers walking the
+        index of the sort order and testing every client against the
+        filters, which reads most of the table when few clients match. So
+        each group of criteria in CLIENT_FILTER_GROUPS is first probed on its
+        own index for up to SELECTIVE_FILTER_ROWS clients. The first probe
+        that finds all its matches restricts the query to those IDs, and the
+        page is sorted from them. If none does, matches are common enough for
+        the database's own plan to fill a page quickly.
+        """
+        clauses = client_filter_clauses(criteria)
+        if not clauses:
+            return query
+        probe_size = ClientService.SELECTIVE_FILTER_ROWS + 1
+        for group in CLIENT_FILTER_GROUPS:
+            client_clauses, enrollment_clauses = client_filter_parts(
+                {key: value for key, value in criteria.items() if key in group})
+            if enrollment_clauses:
+                # No DISTINCT: SQLite would answer it by walking the primary key
+                probe = select(enrollments.c.client_id).where(*enrollment_clauses)
+            elif client_clauses:
+                probe = select(Client.id).where(*client_clauses)
+            else:
+                continue
+            matches = db.session.execute(probe.limit(probe_size)).scalars().all()
+            if len(matches) < probe_size:
+                return query.filter(Client.id.in_(set(matches)), *clauses)
+        return query.filter(*clauses)
+    
+    @staticmethod
+    def get_client_version(client_id):
+        """Latest change time of a client's representation, or None if it does not exist.
+
+        Covers the client row and the programs embedded in Client.to_dict(), in
+        one aggregate query that never builds ORM instances.
+        """
+        row = db.session.execute(
+            select(Client.updated_at, func.max(HealthProgram.updated_at))
+            .outerjoin(enrollments, enrollments.c.client_id == Client.id)
+            .outerjoin(HealthProgram, HealthProgram.id == enrollments.c.program_id)
+            .where(Client.id == client_id)
+            .group_by(Client.id)
+        ).first()
+        if row is None:
+            return None
+        return max((version for version in row if version), default=datetime.min)
+    
+    @staticmethod
+    def get_clients_page_versions(limit, cursor=None, criteria=None, sort=None):
+        """(id, updated_at) rows of a clients page, fetched without loading the clients"""
+        order_by, descending = client_sort(sort)
+        query = ClientService._filter(db.session.query(Client.id, Client.updated_at, *order_by), criteria)
+        return keyset_page(query, Client.id, limit, cursor, order_by, descending)
+    
+    @staticmethod
+    def get_clients_by_ids(client_ids, with_programs=False):
+        """Get clients by ID, in the order of client_ids; IDs that don't exist are skipped.
+
+        Loads a page already selected by get_clients_page_versions with a
+        primary key lookup, instead of filtering and sorting it again.
+        """
+        clients = {client.id: client for client in client_query(with_programs).filter(Client.id.in_(client_ids))}
+        return [clients[client_id] for client_id in client_ids if client_id in clients]
     
     @staticmethod
     def update_client(client_id, **kwargs):
         """Update client information"""
-        client = Client.query.get(client_id)
-        if not client:
+        if 'date_of_birth' in kwargs and isinstance(kwargs['date_of_birth'], str):
+            kwargs['date_of_birth'] = datetime.strptime(kwargs['date_of_birth'], '%Y-%m-%d').date()
+        
+        if not run_write(ClientService._apply_client_update, client_id, kwargs):
             return None
+        return db.session.get(Client, client_id)
+    
+    @staticmethod
+    def _apply_client_update(client_id, changes):
+        """Write job for update_client; returns False if the client does not exist"""
+        client = db.session.get(Client, client_id)
+        if not client:
+            return False
         
-        for key, value in kwargs.items():
+        for key, value in changes.items():
             if hasattr(client, key):
-                if key == 'date_of_birth' and isinstance(value, str):
-                    value = datetime.strptime(value, '%Y-%m-%d').date()
                 setattr(client, key, value)
+        if 'first_name' in changes or 'last_name' in changes:
+            client.refresh_name_keys()
         
-        db.session.commit()
-        return client
+        db.session.flush()
+        record_changes('client', [client.id])
+        if any(field in changes for field in DeduplicationService.MATCHED_FIELDS):
+            record_block_keys([(client.id, client.first_name, client.last_name, client.date_of_birth)],
+                              replace=True)
+        return True
 
 class ProgramService:
+    CACHE_NAMESPACE = 'programs'
+    
     @staticmethod
+    @retry_on_locked
     def create_program(name, description=None, start_date=None, end_date=None, status='Active'):
         """Create a new health program"""
         if isinstance(start_date, str) and start_date:
@@ -98,11 +523,14 @@ class ProgramService:
         )
         db.session.add(program)
         try:
-            db.session.commit()
-            return program
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return None
+        record_changes('program', [program.id])
+        db.session.commit()
+        cache.invalidate(ProgramService.CACHE_NAMESPACE)
+        return program
     
     @staticmethod
     def get_program(program_id):
@@ -115,6 +543,45 @@ class ProgramService:
         return HealthProgram.query.all()
     
     @staticmethod
+    def get_programs_page(limit, cursor=None):
+        """Get a page of health programs ordered by ID, starting after cursor"""
+        return keyset_page(HealthProgram.query, HealthProgram.id, limit, cursor)
+    
+    @staticmethod
+    def get_catalog_version():
+        """(program count, latest updated_at) of the catalog, served from the program cache"""
+        def load():
+            count, latest = db.session.execute(
+                select(func.count(HealthProgram.id), func.max(HealthProgram.updated_at))
+            ).one()
+            return count, latest
+        return cache.get_or_set(ProgramService.CACHE_NAMESPACE, 'version', load)
+    
+    @staticmethod
+    def get_program_catalog():
+        """Get all health programs as dicts, served from the program cache"""
+        def load():
+            return [program.to_dict() for program in HealthProgram.query.order_by(HealthProgram.id)]
+        return cache.get_or_set(ProgramService.CACHE_NAMESPACE, 'all', load)
+    
+    @staticmethod
+    def get_program_data(program_id):
+        """Get a program as a dict (None if missing), served from the program cache"""
+        def load():
+            program = db.session.get(HealthProgram, program_id)
+            return program.to_dict() if program else None
+        return cache.get_or_set(ProgramService.CACHE_NAMESPACE, f'id:{program_id}', load)
+    
+    @staticmethod
+    def get_programs_page_data(limit, cursor=None):
+        """Get a page of programs as (dicts, next_cursor), served from the program cache"""
+        def load():
+            programs, next_cursor = ProgramService.get_programs_page(limit, cursor)
+            return [program.to_dict() for program in programs], next_cursor
+        return cache.get_or_set(ProgramService.CACHE_NAMESPACE, f'page:{limit}:{cursor}', load)
+    
+    @staticmethod
+    @retry_on_locked
     def update_program(program_id, **kwargs):
         """Update program information"""
         program = HealthProgram.query.get(program_id)
@@ -127,39 +594,267 @@ class ProgramService:
                     value = datetime.strptime(value, '%Y-%m-%d').date()
                 setattr(program, key, value)
         
+        record_changes('program', [program.id])
         db.session.commit()
+        cache.invalidate(ProgramService.CACHE_NAMESPACE)
         return program
 
 class EnrollmentService:
+    # Client IDs per statement in bulk operations, well under SQLite's bound parameter limit
+    BULK_CHUNK_SIZE = 500
+    
+    @staticmethod
+    def _is_enrolled(client_id, program_id):
+        return db.session.query(exists().where(
+            enrollments.c.client_id == client_id,
+            enrollments.c.program_id == program_id
+        )).scalar()
+    
+    @staticmethod
+    def _touch_clients(*criteria):
+        """Bump updated_at on clients whose enrollments changed, refreshing their ETags"""
+        db.session.execute(
+            update(Client).where(*criteria).values(updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+    
     @staticmethod
     def enroll_client(client_id, program_id):
         """Enroll a client in a health program"""
-        client = Client.query.get(client_id)
-        program = HealthProgram.query.get(program_id)
+        enrolled = run_write(EnrollmentService._enroll, client_id, program_id)
+        if enrolled:
+            metrics.inc('enrollment_changes_total', operation='enroll', mode='single')
+        return enrolled
+    
+    @staticmethod
+    def _enroll(client_id, program_id):
+        """Write job for enroll_client"""
+        client = db.session.get(Client, client_id)
+        program = db.session.get(HealthProgram, program_id)
         
         if not client or not program:
             return False
         
-        if program not in client.programs:
-            client.programs.append(program)
-            db.session.commit()
-            return True
-        return False
+        if EnrollmentService._is_enrolled(client.id, program.id):
+            return False
+        
+        db.session.execute(insert(enrollments).values(
+            client_id=client.id, program_id=program.id,
+            enrollment_date=datetime.utcnow(), status='Active'
+        ))
+        EnrollmentService._touch_clients(Client.id == client.id)
+        record_changes('enrollment', [(client.id, program.id)])
+        return True
     
     @staticmethod
     def unenroll_client(client_id, program_id):
         """Remove a client from a health program"""
-        client = Client.query.get(client_id)
-        program = HealthProgram.query.get(program_id)
+        unenrolled = run_write(EnrollmentService._unenroll, client_id, program_id)
+        if unenrolled:
+            metrics.inc('enrollment_changes_total', operation='unenroll', mode='single')
+        return unenrolled
+    
+    @staticmethod
+    def _unenroll(client_id, program_id):
+        """Write job for unenroll_client"""
+        client = db.session.get(Client, client_id)
+        program = db.session.get(HealthProgram, program_id)
         
         if not client or not program:
             return False
         
-        if program in client.programs:
-            client.programs.remove(program)
-            db.session.commit()
-            return True
-        return False
+        result = db.session.execute(delete(enrollments).where(
+            enrollments.c.client_id == client.id,
+            enrollments.c.program_id == program.id
+        ))
+        if result.rowcount:
+            EnrollmentService._touch_clients(Client.id == client.id)
+            record_changes('enrollment', [(client.id, program.id)], operation='delete')
+        return result.rowcount > 0
+    
+    @staticmethod
+    def set_status(client_id, program_id, status):
+        """Move an enrollment to status, if its current status allows it (see Enrollment.TRANSITIONS).
+
+        The check and the change are a single UPDATE, so of two concurrent
+        transitions only the one still allowed applies. Returns whether the
+        enrollment changed; raises ValueError for an unknown status.
+        """
+        sources = Enrollment.statuses_before(status)
+        changed = run_write(EnrollmentService._set_status, client_id, program_id, status, sources)
+        if changed:
+            metrics.inc('enrollment_changes_total', operation='status', mode='single')
+        return changed
+    
+    @staticmethod
+    def _set_status(client_id, program_id, status, sources):
+        """Write job for set_status"""
+        result = db.session.execute(update(enrollments).where(
+            enrollments.c.client_id == client_id,
+            enrollments.c.program_id == program_id,
+            enrollments.c.status.in_(sources)
+        ).values(status=status, updated_at=datetime.utcnow()))
+        if result.rowcount:
+            EnrollmentService._touch_clients(Client.id == client_id)
+            record_changes('enrollment', [(client_id, program_id)])
+        return result.rowcount > 0
+    
+    @staticmethod
+    def _target_selects(client_ids, criteria):
+        """SELECTs of the client IDs targeted by a bulk operation.
+
+        Explicit client IDs are chunked to keep each statement's parameter
+        count bounded; criteria become a single filtered SELECT. Raises
+        ValueError for criteria without any usable condition, which would
+        otherwise target every client.
+        """
+        if client_ids is not None:
+            client_ids = sorted({int(client_id) for client_id in client_ids})
+            return [select(Client.id).where(Client.id.in_(client_ids[start:start + EnrollmentService.BULK_CHUNK_SIZE]))
+                    for start in range(0, len(client_ids), EnrollmentService.BULK_CHUNK_SIZE)]
+        clauses = client_filter_clauses(criteria)
+        if not clauses:
+            raise ValueError('The filter has no criteria')
+        return [select(Client.id).where(*clauses)]
+    
+    @staticmethod
+    @retry_on_locked
+    def bulk_enroll(program_id, client_ids=None, criteria=None):
+        """Enroll many clients in a program with set-based INSERT ... SELECT statements.
+
+        Targets either an explicit list of client IDs or every client matching
+        criteria (see client_filter_clauses). Existing enrollments are skipped
+        inside the statement itself. Returns a report of counts, or None if the
+        program does not exist.
+        """
+        targets = EnrollmentService._target_selects(client_ids, criteria)
+        program = db.session.get(HealthProgram, program_id)
+        if not program:
+            return None
+        
+        already_enrolled = exists().where(
+            enrollments.c.client_id == Client.id,
+            enrollments.c.program_id == program.id
+        )
+        now = datetime.utcnow()
+        matched = enrolled = 0
+        for target in targets:
+            matched += db.session.execute(
+                select(func.count()).select_from(target.subquery())
+            ).scalar()
+            new_rows = target.add_columns(
+                literal(program.id), literal(now), literal('Active'), literal(now)
+            ).where(~already_enrolled)
+            result = db.session.execute(insert(enrollments).from_select(
+                ['client_id', 'program_id', 'enrollment_date', 'status', 'updated_at'], new_rows
+            ))
+            if result.rowcount:
+                EnrollmentService._touch_clients(Client.id.in_(target.scalar_subquery()))
+                # Rows written by this statement are the ones stamped with `now`
+                record_enrollment_changes(select(enrollments.c.client_id, enrollments.c.program_id).where(
+                    enrollments.c.program_id == program.id,
+                    enrollments.c.updated_at == now,
+                    enrollments.c.client_id.in_(target.scalar_subquery())
+                ), 'upsert')
+            enrolled += result.rowcount
+        db.session.commit()
+        
+        report = {'program_id': program.id, 'matched': matched, 'enrolled': enrolled,
+                  'already_enrolled': matched - enrolled}
+        if client_ids is not None:
+            report['not_found'] = len(set(client_ids)) - matched
+        metrics.inc('enrollment_changes_total', enrolled, operation='enroll', mode='bulk')
+        return report
+    
+    @staticmethod
+    @retry_on_locked
+    def bulk_unenroll(program_id, client_ids=None, criteria=None):
+        """Remove many clients from a program with set-based DELETE statements.
+
+        Accepts the same targets as bulk_enroll. Returns a report of counts, or
+        None if the program does not exist.
+        """
+        targets = EnrollmentService._target_selects(client_ids, criteria)
+        program = db.session.get(HealthProgram, program_id)
+        if not program:
+            return None
+        
+        unenrolled = 0
+        for target in targets:
+            removed = (
+                enrollments.c.program_id == program.id,
+                enrollments.c.client_id.in_(target.scalar_subquery())
+            )
+            # Tombstones are written first, while the rows still exist
+            record_enrollment_changes(
+                select(enrollments.c.client_id, enrollments.c.program_id).where(*removed), 'delete'
+            )
+            result = db.session.execute(delete(enrollments).where(*removed))
+            if result.rowcount:
+                EnrollmentService._touch_clients(Client.id.in_(target.scalar_subquery()))
+            unenrolled += result.rowcount
+        db.session.commit()
+        metrics.inc('enrollment_changes_total', unenrolled, operation='unenroll', mode='bulk')
+        return {'program_id': program.id, 'unenrolled': unenrolled}
+    
+    @staticmethod
+    @retry_on_locked
+    def bulk_set_status(program_id, status, client_ids=None, criteria=None):
+        """Move many of a program's enrollments to status with set-based UPDATE statements.
+
+        Accepts the same targets as bulk_enroll. Enrollments whose status
+        cannot move to status are left as they are. Returns a report of
+        counts, or None if the program does not exist; raises ValueError for
+        an unknown status.
+        """
+        sources = Enrollment.statuses_before(status)
+        targets = EnrollmentService._target_selects(client_ids, criteria)
+        program = db.session.get(HealthProgram, program_id)
+        if not program:
+            return None
+        
+        now = datetime.utcnow()
+        changed = 0
+        for target in targets:
+            result = db.session.execute(update(enrollments).where(
+                enrollments.c.program_id == program.id,
+                enrollments.c.client_id.in_(target.scalar_subquery()),
+                enrollments.c.status.in_(sources)
+            ).values(status=status, updated_at=now))
+            if result.rowcount:
+                # Rows changed by this statement are the ones stamped with `now`
+                changed_rows = select(enrollments.c.client_id, enrollments.c.program_id).where(
+                    enrollments.c.program_id == program.id,
+                    enrollments.c.updated_at == now,
+                    enrollments.c.client_id.in_(target.scalar_subquery())
+                )
+                EnrollmentService._touch_clients(Client.id.in_(
+                    changed_rows.with_only_columns(enrollments.c.client_id).scalar_subquery()))
+                record_enrollment_changes(changed_rows, 'upsert')
+            changed += result.rowcount
+        db.session.commit()
+        metrics.inc('enrollment_changes_total', changed, operation='status', mode='bulk')
+        return {'program_id': program.id, 'status': status, 'changed': changed}
+    
+    @staticmethod
+    def get_program_enrollments_page(program_id, limit, cursor=None, status=None):
+        """Get a page of a program's enrollments and their clients, in client ID order.
+
+        With a status, the page is a range scan of the (program_id, status,
+        client_id) index however large the program is; without one, the
+        program's enrollments are sorted first. Returns None if the program
+        does not exist.
+        """
+        if status is not None:
+            Enrollment.validate_status(status)
+        program = db.session.get(HealthProgram, program_id)
+        if not program:
+            return None
+        
+        query = Enrollment.query.options(joinedload(Enrollment.client)).filter(Enrollment.program_id == program.id)
+        if status is not None:
+            query = query.filter(Enrollment.status == status)
+        return keyset_page(query, Enrollment.client_id, limit, cursor)
     
     @staticmethod
     def get_client_programs(client_id):
@@ -175,4 +870,544 @@ class EnrollmentService:
         program = HealthProgram.query.get(program_id)
         if not program:
             return []
-        return program.clients.all()
\ No newline at end of file
+        return program.clients.all()
+
+class ImportService:
+    CLIENT_FIELDS = ('first_name', 'last_name', 'date_of_birth', 'gender', 'contact_number',
+                     'email', 'address', 'medical_history')
+    REQUIRED_FIELDS = ('first_name', 'last_name', 'date_of_birth', 'gender')
+    MAX_REPORTED_ERRORS = 1000
+    
+    @staticmethod
+    def read_rows(stream, fmt):
+        """Yield (row_number, record) pairs from a CSV or NDJSON text stream.
+
+        A record that cannot be parsed is yielded as an Exception so that it is
+        reported against its row instead of aborting the import.
+        """
+        if fmt == 'csv':
+            for row_number, record in enumerate(csv.DictReader(stream), start=1):
+                yield row_number, record
+        elif fmt == 'ndjson':
+            row_number = 0
+            for line in stream:
+                if not line.strip():
+                    continue
+                row_number += 1
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError('Expected a JSON object')
+                except ValueError as e:
+                    record = e
+                yield row_number, record
+        else:
+            raise ValueError(f'Unsupported import format: {fmt}')
+    
+    @staticmethod
+    def validate_row(record):
+        """Return (values, None) for a valid client record, or (None, error)"""
+        values, not_text = {}, []
+        for field in ImportService.CLIENT_FIELDS:
+            value = record.get(field)
+            # NDJSON can carry numbers, lists or objects; every field is text or null
+            if value is not None and not isinstance(value, str):
+                not_text.append(field)
+                continue
+            value = value.strip() if value is not None else None
+            values[field] = value or None
+        if not_text:
+            return None, f'Fields must be text or null: {", ".join(not_text)}'
+        
+        missing = [field for field in ImportService.REQUIRED_FIELDS if not values[field]]
+        if missing:
+            return None, f'Missing required fields: {", ".join(missing)}'
+        if not validate_date_format(str(values['date_of_birth'])):
+            return None, 'Invalid date_of_birth, expected YYYY-MM-DD'
+        if values['email'] and not validate_email(values['email']):
+            return None, 'Invalid email address'
+        
+        values['date_of_birth'] = datetime.strptime(values['date_of_birth'], '%Y-%m-%d').date()
+        return values, None
+    
+    @staticmethod
+    def _insert_returning():
+        """INSERT of client rows returning what the change log and block index need"""
+        return insert(Client).returning(Client.id, Client.first_name, Client.last_name, Client.date_of_birth)
+    
+    @staticmethod
+    def _record_inserted(rows):
+        record_changes('client', [row.id for row in rows])
+        record_block_keys(rows)
+    
+    @staticmethod
+    def _insert_batch(batch, errors):
+        """Insert one batch in a single transaction; returns the number of rows inserted.
+
+        If the batch fails as a whole it is retried row by row so that only the
+        offending rows are reported and the rest of the batch still lands.
+        """
+        def insert_all():
+            result = db.session.execute(ImportService._insert_returning(), [values for _, values in batch])
+            ImportService._record_inserted(result.all())
+            db.session.commit()
+        
+        try:
+            with_lock_retry(insert_all)
+            return len(batch)
+        except SQLAlchemyError:
+            db.session.rollback()
+        
+        inserted = 0
+        for row_number, values in batch:
+            try:
+                result = db.session.execute(ImportService._insert_returning(), [values])
+                ImportService._record_inserted(result.all())
+                db.session.commit()
+                inserted += 1
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                errors.append({'row': row_number, 'error': str(e.orig if hasattr(e, 'orig') else e)})
+        return inserted
+    
+    @staticmethod
+    def import_clients(rows, batch_size=1000):
+        """Validate and bulk insert client records from (row_number, record) pairs.
+
+        Valid rows are inserted batch_size at a time with one transaction per
+        batch. Invalid rows are skipped and reported, so one bad record never
+        aborts the load. Returns a report with counts, errors and throughput.
+        """
+        started = time.perf_counter()
+        errors = []
+        batch = []
+        total = imported = batches = 0
+        
+        for row_number, record in rows:
+            total += 1
+            if isinstance(record, Exception):
+                errors.append({'row': row_number, 'error': f'Unparseable record: {record}'})
+                continue
+            values, error = ImportService.validate_row(record)
+            if error:
+                errors.append({'row': row_number, 'error': error})
+                continue
+            batch.append((row_number, values))
+            if len(batch) >= batch_size:
+                imported += ImportService._insert_batch(batch, errors)
+                batches += 1
+                batch = []
+        if batch:
+            imported += ImportService._insert_batch(batch, errors)
+            batches += 1
+        
+        elapsed = time.perf_counter() - started
+        errors.sort(key=lambda error: error['row'])
+        return {
+            'total': total,
+            'imported': imported,
+            'failed': len(errors),
+            'errors': errors[:ImportService.MAX_REPORTED_ERRORS],
+            'errors_truncated': len(errors) > ImportService.MAX_REPORTED_ERRORS,
+            'batches': batches,
+            'batch_size': batch_size,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(imported / elapsed, 1) if elapsed else None
+        }
+
+
+class ExportService:
+    CLIENT_COLUMNS = ('id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'contact_number',
+                      'email', 'address', 'medical_history', 'created_at')
+    
+    @staticmethod
+    def _serialize(value):
+        return value.isoformat() if isinstance(value, (date, datetime)) else value
+    
+    @staticmethod
+    def iter_client_batches(batch_size=500):
+        """Yield lists of client records with their enrollments, batch_size at a time.
+
+        Clients are streamed from a server-side cursor (yield_per) as plain rows,
+        never as ORM instances, and each batch's enrollments are fetched with one
+        IN query. Memory use is bounded by batch_size, not by the table size.
+        """
+        columns = [getattr(Client, name) for name in ExportService.CLIENT_COLUMNS]
+        result = db.session.execute(
+            select(*columns).order_by(Client.id).execution_options(yield_per=batch_size)
+        )
+        for partition in result.partitions():
+            records = {}
+            for row in partition:
+                record = {key: ExportService._serialize(value) for key, value in row._mapping.items()}
+                record['enrollments'] = []
+                records[row.id] = record
+            
+            enrollment_rows = db.session.execute(
+                select(enrollments.c.client_id, HealthProgram.id, HealthProgram.name,
+                       enrollments.c.status, enrollments.c.enrollment_date)
+                .join(HealthProgram, HealthProgram.id == enrollments.c.program_id)
+                .where(enrollments.c.client_id.in_(list(records)))
+                .order_by(enrollments.c.client_id, HealthProgram.id)
+            )
+            for client_id, program_id, name, status, enrolled_on in enrollment_rows:
+                records[client_id]['enrollments'].append({
+                    'program_id': program_id,
+                    'program_name': name,
+                    'status': status,
+                    'enrollment_date': ExportService._serialize(enrolled_on)
+                })
+            yield list(records.values())
+    
+    @staticmethod
+    def iter_export(fmt, batch_size=500):
+        """Yield the client export as NDJSON or CSV text, one chunk per batch"""
+        if fmt not in ('ndjson', 'csv'):
+            raise ValueError(f'Unsupported export format: {fmt}')
+        
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(ExportService.CLIENT_COLUMNS + ('programs',))
+            yield buffer.getvalue()
+        
+        for records in ExportService.iter_client_batches(batch_size):
+            if fmt == 'ndjson':
+                yield ''.join(json.dumps(record) + '\n' for record in records)
+                continue
+            
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for record in records:
+                programs = '; '.join(
+                    f"{enrollment['program_name']} ({enrollment['status']})"
+                    for enrollment in record['enrollments']
+                )
+                writer.writerow([record[column] for column in ExportService.CLIENT_COLUMNS] + [programs])
+            yield buffer.getvalue()
+
+
+class SyncService:
+    @staticmethod
+    def current_token():
+        """The newest change token, for clients bootstrapping from a full export"""
+        return db.session.execute(select(func.max(ChangeLog.id))).scalar() or 0
+    
+    @staticmethod
+    def get_changes(since=0, limit=500):
+        """Collect the changes recorded after token `since`, at most limit log entries.
+
+        Work is proportional to the number of changes, not the database size:
+        a range scan of the change log followed by primary key lookups of the
+        touched rows. Several changes to the same row collapse into its current
+        state, and removed enrollments come back as tombstones.
+        """
+        entries = ChangeLog.query.filter(ChangeLog.id > since).order_by(ChangeLog.id).limit(limit + 1).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        
+        client_ids, program_ids, enrollment_ops = set(), set(), {}
+        for entry in entries:
+            if entry.entity == 'client':
+                client_ids.add(entry.entity_id)
+            elif entry.entity == 'program':
+                program_ids.add(entry.entity_id)
+            elif entry.entity == 'enrollment':
+                enrollment_ops[(entry.entity_id, entry.related_id)] = entry.operation
+        
+        clients = Client.query.filter(Client.id.in_(client_ids)).order_by(Client.id).all() if client_ids else []
+        programs = (HealthProgram.query.filter(HealthProgram.id.in_(program_ids)).order_by(HealthProgram.id).all()
+                    if program_ids else [])
+        
+        current = {}
+        if enrollment_ops:
+            rows = Enrollment.query.filter(
+                Enrollment.client_id.in_({key[0] for key in enrollment_ops}),
+                Enrollment.program_id.in_({key[1] for key in enrollment_ops})
+            )
+            current = {(row.client_id, row.program_id): row for row in rows
+                       if (row.client_id, row.program_id) in enrollment_ops}
+        
+        changed_enrollments, removed_enrollments = [], []
+        for key in sorted(enrollment_ops):
+            row = current.get(key)
+            if row is None:
+                removed_enrollments.append({'client_id': key[0], 'program_id': key[1]})
+                continue
+            changed_enrollments.append(row.to_dict())
+        
+        return {
+            'token': entries[-1].id if entries else since,
+            'has_more': has_more,
+            'clients': [client.to_dict(include_programs=False) for client in clients],
+            'programs': [program.to_dict() for program in programs],
+            'enrollments': changed_enrollments,
+            'removed_enrollments': removed_enrollments
+        }
+
+class AnalyticsService:
+    CACHE_NAMESPACE = 'analytics'
+    # Lower bounds, in whole years, of the age bands on the dashboard
+    AGE_BANDS = (0, 18, 35, 50, 65)
+    WEEKS = 12
+    
+    @staticmethod
+    def age_band(today):
+        """CASE expression labelling each client with its age band on today, e.g. '18-34'"""
+        bands = AnalyticsService.AGE_BANDS
+        labels = [f'{low}-{high - 1}' for low, high in zip(bands, bands[1:])] + [f'{bands[-1]}+']
+        # Oldest band first, so each client lands in the first band it qualifies for
+        return case(
+            *[(Client.date_of_birth <= years_before(today, low), label)
+              for low, label in reversed(list(zip(bands, labels)))],
+            else_='unknown'
+        )
+    
+    @staticmethod
+    def week_starts(today):
+        """Mondays starting the last WEEKS weeks, newest first"""
+        monday = today - timedelta(days=today.weekday())
+        return [monday - timedelta(weeks=n) for n in range(AnalyticsService.WEEKS)]
+    
+    @staticmethod
+    def get_dashboard(today=None):
+        """Enrollment and client aggregates for the dashboard.
+
+        The result is cached under one key, versioned by the current change
+        token and the date, so it is computed once per change to the data (and
+        once a day, as ages move on) no matter how often the dashboard is
+        loaded, and each new version replaces the last instead of adding an
+        entry.
+        """
+        today = today or date.today()
+        token = SyncService.current_token()
+        return cache.get_or_set(AnalyticsService.CACHE_NAMESPACE, 'dashboard',
+                                lambda: AnalyticsService.compute_dashboard(today, token),
+                                version=(token, today.isoformat()))
+    
+    @staticmethod
+    def compute_dashboard(today, token=None):
+        """Run the dashboard's GROUP BY queries; each is one pass over an index or table"""
+        age_band = AnalyticsService.age_band(today).label('age_band')
+        
+        programs = {program['id']: {'id': program['id'], 'name': program['name'], 'status': program['status'],
+                                    'enrollments': {}, 'by_gender': {}, 'by_age_band': {}}
+                    for program in ProgramService.get_program_catalog()}
+        totals = {'clients': 0, 'programs': len(programs), 'enrollments': 0, 'active_enrollments': 0}
+        
+        status_counts = db.session.execute(
+            select(enrollments.c.program_id, enrollments.c.status, func.count())
+            .group_by(enrollments.c.program_id, enrollments.c.status)
+        )
+        for program_id, status, count in status_counts:
+            if program_id in programs:
+                programs[program_id]['enrollments'][status] = count
+            totals['enrollments'] += count
+            if status == 'Active':
+                totals['active_enrollments'] += count
+        
+        # Demographics of each program's active enrollees
+        demographics = db.session.execute(
+            select(enrollments.c.program_id, Client.gender, age_band, func.count())
+            .join(Client, Client.id == enrollments.c.client_id)
+            .where(enrollments.c.status == 'Active')
+            .group_by(enrollments.c.program_id, Client.gender, age_band)
+        )
+        for program_id, gender, band, count in demographics:
+            if program_id in programs:
+                program = programs[program_id]
+                program['by_gender'][gender] = program['by_gender'].get(gender, 0) + count
+                program['by_age_band'][band] = program['by_age_band'].get(band, 0) + count
+        
+        clients = {'by_gender': {}, 'by_age_band': {}}
+        for gender, band, count in db.session.execute(
+            select(Client.gender, age_band, func.count()).group_by(Client.gender, age_band)
+        ):
+            clients['by_gender'][gender] = clients['by_gender'].get(gender, 0) + count
+            clients['by_age_band'][band] = clients['by_age_band'].get(band, 0) + count
+            totals['clients'] += count
+        
+        week_starts = AnalyticsService.week_starts(today)
+        week = case(
+            *[(enrollments.c.enrollment_date >= datetime.combine(start, clock_time.min), start.isoformat())
+              for start in week_starts]
+        ).label('week')
+        weekly = dict(db.session.execute(
+            select(week, func.count())
+            .where(enrollments.c.enrollment_date >= datetime.combine(week_starts[-1], clock_time.min))
+            .group_by(week)
+        ).all())
+        
+        return {
+            'as_of': today.isoformat(),
+            'token': token,
+            'totals': totals,
+            'clients': clients,
+            'programs': sorted(programs.values(), key=lambda program: program['name']),
+            'weekly_enrollments': [{'week_start': start.isoformat(), 'enrollments': weekly.get(start.isoformat(), 0)}
+                                   for start in reversed(week_starts)]
+        }
+
+class DeduplicationService:
+    # Client fields the block keys are derived from
+    MATCHED_FIELDS = ('first_name', 'last_name', 'date_of_birth')
+    RECORD_COLUMNS = (Client.id, Client.first_name, Client.last_name, Client.date_of_birth, Client.gender,
+                      Client.contact_number)
+    
+    @staticmethod
+    def _describe(record, score):
+        return {
+            'id': record.id,
+            'first_name': record.first_name,
+            'last_name': record.last_name,
+            'date_of_birth': record.date_of_birth.isoformat() if record.date_of_birth else None,
+            'gender': record.gender,
+            'score': round(score, 3)
+        }
+    
+    @staticmethod
+    def find_possible_duplicates(first_name, last_name, date_of_birth, gender=None, contact_number=None,
+                                 exclude_id=None, threshold=None):
+        """Existing clients that may be the same person, best match first.
+
+        Only clients sharing a block key are scored: one index lookup, and
+        at most DEDUP_MAX_CANDIDATES clients, whatever the size of the table.
+        When the blocks hold more, clients sharing a full date-of-birth key
+        are kept before those sharing only the names and birth year, then
+        the lowest ids.
+        """
+        if isinstance(date_of_birth, str):
+            date_of_birth = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
+        keys = matching.blocking_keys(first_name, last_name, date_of_birth)
+        if not keys:
+            return []
+        threshold = threshold if threshold is not None else current_app.config['DEDUP_THRESHOLD']
+        
+        # A block is one name code and birth date, or both codes and a birth year, so each holds
+        # few clients; rank them all, then score the best DEDUP_MAX_CANDIDATES
+        born = f':{date_of_birth.isoformat()}'
+        full_date = client_block_keys.c.key.in_([key for key in keys if key.endswith(born)])
+        candidate_ids = select(client_block_keys.c.client_id).where(client_block_keys.c.key.in_(keys))
+        if exclude_id is not None:
+            candidate_ids = candidate_ids.where(client_block_keys.c.client_id != exclude_id)
+        candidate_ids = (candidate_ids.group_by(client_block_keys.c.client_id)
+                         .order_by(func.min(case((full_date, 0), else_=1)), client_block_keys.c.client_id)
+                         .limit(current_app.config['DEDUP_MAX_CANDIDATES']))
+        candidates = db.session.execute(
+            select(*DeduplicationService.RECORD_COLUMNS).where(Client.id.in_(candidate_ids))
+        ).all()
+        
+        probe = matching.ClientRecord(exclude_id, first_name, last_name, date_of_birth, gender, contact_number)
+        matches = []
+        for candidate in candidates:
+            score = matching.similarity(probe, candidate)
+            if score >= threshold:
+                matches.append((candidate, score))
+        matches.sort(key=lambda match: (-match[1], match[0].id))
+        return [DeduplicationService._describe(candidate, score) for candidate, score in matches]
+    
+    @staticmethod
+    def get_client_duplicates(client_id):
+        """Possible duplicates of an existing client; None if there is no such client"""
+        client = db.session.get(Client, client_id)
+        if not client:
+            return None
+        return DeduplicationService.find_possible_duplicates(
+            client.first_name, client.last_name, client.date_of_birth, client.gender, client.contact_number,
+            exclude_id=client.id
+        )
+    
+    @staticmethod
+    def rebuild_block_index(batch_size=10000):
+        """Recompute every client's block keys, one transaction per batch; returns the number of clients.
+
+        Each batch is re-keyed in place, so duplicate checks running
+        meanwhile still see every other client's keys. Keys left behind by
+        clients deleted outside the application are removed at the end.
+        """
+        def rekey_batch(after):
+            rows = db.session.execute(
+                select(Client.id, Client.first_name, Client.last_name, Client.date_of_birth)
+                .where(Client.id > after).order_by(Client.id).limit(batch_size)
+            ).all()
+            if rows:
+                record_block_keys(rows, replace=True)
+                db.session.commit()
+            return rows
+        
+        def drop_orphans():
+            db.session.execute(delete(client_block_keys).where(
+                client_block_keys.c.client_id.not_in(select(Client.id))))
+            db.session.commit()
+        
+        # A lock error rolls the batch back, so each retry re-runs the whole batch
+        indexed, after = 0, 0
+        while True:
+            rows = with_lock_retry(lambda: rekey_batch(after))
+            if not rows:
+                break
+            indexed += len(rows)
+            after = rows[-1].id
+        with_lock_retry(drop_orphans)
+        return indexed
+    
+    @staticmethod
+    def find_duplicate_pairs(threshold=None, max_block=None, batch_size=10000):
+        """Score every pair of clients that share a block; returns pairs above threshold and their clusters.
+
+        The block index is read once in key order, so each block arrives as a
+        consecutive run of rows and only one block is held in memory. Work is
+        linear in the number of clients for bounded block sizes; blocks larger
+        than max_block (DEDUP_MAX_BLOCK) are skipped and counted instead.
+        """
+        started = time.perf_counter()
+        threshold = threshold if threshold is not None else current_app.config['DEDUP_THRESHOLD']
+        max_block = max_block or current_app.config['DEDUP_MAX_BLOCK']
+        rows = db.session.execute(
+            select(client_block_keys.c.key, *DeduplicationService.RECORD_COLUMNS)
+            .join(Client, Client.id == client_block_keys.c.client_id)
+            .order_by(client_block_keys.c.key)
+            .execution_options(yield_per=batch_size)
+        )
+        
+        scores = {}
+        blocks = comparisons = oversized = 0
+        for _, block in groupby(rows, key=attrgetter('key')):
+            block = list(block)
+            blocks += 1
+            if len(block) > max_block:
+                oversized += 1
+                continue
+            for i, first in enumerate(block):
+                for second in block[i + 1:]:
+                    comparisons += 1
+                    score = matching.similarity(first, second)
+                    if score >= threshold:
+                        pair = (min(first.id, second.id), max(first.id, second.id))
+                        scores[pair] = score
+        
+        # Group linked clients with union-find so each cluster can be reviewed together
+        parent = {}
+        
+        def root(client_id):
+            while parent.setdefault(client_id, client_id) != client_id:
+                parent[client_id] = parent[parent[client_id]]
+                client_id = parent[client_id]
+            return client_id
+        
+        for a, b in scores:
+            parent[root(a)] = root(b)
+        clusters = {}
+        for client_id in parent:
+            clusters.setdefault(root(client_id), []).append(client_id)
+        
+        elapsed = time.perf_counter() - started
+        return {
+            'blocks': blocks,
+            'oversized_blocks': oversized,
+            'comparisons': comparisons,
+            'pairs': [{'client_id': a, 'duplicate_id': b, 'score': round(score, 3)}
+                      for (a, b), score in sorted(scores.items(), key=lambda item: (-item[1], item[0]))],
+            'clusters': sorted(sorted(members) for members in clusters.values()),
+            'elapsed_seconds': round(elapsed, 3)
+        }
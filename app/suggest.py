@@ -0,0 +1,316 @@
+"""In-memory prefix index for as-you-type client lookups.
+
+Each client is indexed under a few normalized terms (see client_terms):
+- the first and last names, lowercase ASCII letters only
+- both names run together, in either order, so "grace ka" and
+  "kamau gr" narrow to one person
+- the contact number, digits only
+
+A query is answered by bisecting into the sorted terms and reading the
+client ids of the terms that follow, so it costs O(log n + limit) with no
+database round trip for the matching itself.
+
+PrefixIndex is immutable and compact: the distinct terms are concatenated
+into one bytes object, and offsets and client ids are held in arrays of
+unsigned 32-bit ints, not Python objects. That is 4 bytes per (term,
+client) pair plus 8 bytes and the term's length per distinct term. With
+the synthetic benchmark data (benchmarks.suggest), 1M clients take 39 MB.
+With every name unique it would be about 110 MB. Building the index holds
+a dict of the terms, which briefly peaks at about 230 MB for 1M clients.
+
+SuggestIndex wraps it for a running application. The index is built once
+in a background thread, at startup with SUGGEST_PRELOAD or else on the
+first lookup. Until that build finishes, suggest() returns None and
+ClientService.suggest_clients answers from the full-text search, so no
+request waits for it. Once built, the index follows the change log, like
+the delta sync feed: clients created or updated since the last change
+token are re-indexed into a small sorted overlay, and their entries in the
+immutable index are skipped. The log is polled at most every
+SUGGEST_REFRESH_MS, by one thread at a time and outside the index lock;
+the lock is held only to apply the re-indexed clients, so lookups never
+wait on the database. Every worker process keeps its own copy, and all of
+them follow the same log. When the overlay outgrows SUGGEST_MAX_PENDING
+clients, a background rebuild folds it back into a new PrefixIndex.
+"""
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+from app.matching import normalize_name
+from app.models import ChangeLog, Client
+
+# Sorts after every character a term can contain
+_TERM_END = b'\xff'
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+# Names repeat a lot, so building the index normalizes each distinct one once
+@lru_cache(maxsize=100000)
+def _name_term(name):
+    return normalize_name(name).encode('ascii')
+
+
+def client_terms(first_name, last_name, contact_number):
+    """The set of terms a client is found under, as ASCII bytes"""
+    first, last = _name_term(first_name), _name_term(last_name)
+    terms = {first, last, first + last, last + first, _digits(contact_number).encode('ascii')}
+    terms.discard(b'')
+    return terms
+
+
+def query_key(prefix):
+    """The normalized form of a typed prefix: letters for names, else digits for phone numbers"""
+    if any(char.isalpha() for char in prefix or ''):
+        return normalize_name(prefix).encode('ascii')
+    return _digits(prefix).encode('ascii')
+
+
+class _TermView:
+    """Sequence of the terms in a PrefixIndex, for bisect"""
+
+    def __init__(self, blob, starts):
+        self._blob = blob
+        self._starts = starts
+
+    def __len__(self):
+        return len(self._starts) - 1
+
+    def __getitem__(self, i):
+        return self._blob[self._starts[i]:self._starts[i + 1]]
+
+
+class PrefixIndex:
+    """Immutable map from sorted terms to the ids of the clients having them"""
+
+    def __init__(self, postings=None):
+        """postings maps each term (bytes) to a client id or an iterable of them"""
+        postings = postings or {}
+        terms = sorted(postings)
+        self._blob = b''.join(terms)
+        self._starts = array('I', [0])
+        self._offsets = array('I', [0])
+        self._ids = array('I')
+        for term in terms:
+            self._starts.append(self._starts[-1] + len(term))
+            ids = postings[term]
+            if isinstance(ids, int):
+                self._ids.append(ids)
+            else:
+                self._ids.extend(sorted(ids))
+            self._offsets.append(len(self._ids))
+        self._terms = _TermView(self._blob, self._starts)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, first_name, last_name, contact_number) rows"""
+        # Most phone numbers and full names belong to one client, so a term
+        # holds a bare id until a second client shares it
+        postings = {}
+        for client_id, first_name, last_name, contact_number in rows:
+            for term in client_terms(first_name, last_name, contact_number):
+                ids = postings.get(term)
+                if ids is None:
+                    postings[term] = client_id
+                elif isinstance(ids, int):
+                    postings[term] = array('I', (ids, client_id))
+                else:
+                    ids.append(client_id)
+        return cls(postings)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def matches(self, key):
+        """(term, client_id) pairs for the terms starting with key, in order"""
+        lo = bisect_left(self._terms, key)
+        hi = bisect_left(self._terms, key + _TERM_END, lo)
+        for i in range(lo, hi):
+            term = self._terms[i]
+            for client_id in self._ids[self._offsets[i]:self._offsets[i + 1]]:
+                yield term, client_id
+
+    def memory_bytes(self):
+        """Bytes held by the index's buffers"""
+        return sum(sys.getsizeof(part) for part in (self._blob, self._starts, self._offsets, self._ids))
+
+
+def _first_distinct(pairs, limit):
+    """The first limit pairs with distinct client ids"""
+    seen, found = set(), []
+    for pair in pairs:
+        if pair[1] not in seen:
+            seen.add(pair[1])
+            found.append(pair)
+            if len(found) == limit:
+                break
+    return found
+
+
+class SuggestIndex:
+    """A PrefixIndex kept current from the change log"""
+
+    def __init__(self, max_pending=50000, refresh_interval=0.5, wait_for_build=False):
+        self.max_pending = max_pending
+        # Seconds between polls of the change log
+        self.refresh_interval = refresh_interval
+        # Build the index in the first lookup instead of in the background
+        self.wait_for_build = wait_for_build
+        self._next_poll = 0
+        self._base = PrefixIndex()
+        # Clients changed since the base was built: their current terms, in
+        # a sorted list of (term, client_id) and by client
+        self._pending = []
+        self._pending_terms = {}
+        self._token = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = False
+
+    @property
+    def built(self):
+        return self._token is not None
+
+    def build(self, batch_size=10000):
+        """Index every client, replacing the current index"""
+        with self._build_lock:
+            self._build(batch_size)
+
+    def _build(self, batch_size=10000):
+        token = db.session.execute(select(func.max(ChangeLog.id))).scalar() or 0
+        rows = db.session.execute(
+            select(Client.id, Client.first_name, Client.last_name, Client.contact_number)
+            .execution_options(yield_per=batch_size)
+        )
+        base = PrefixIndex.from_rows(rows)
+        with self._lock:
+            # Changes logged after token are replayed by the next refresh
+            self._base, self._pending, self._pending_terms, self._token = base, [], {}, token
+
+    def refresh(self):
+        """Re-index the clients changed since the last change token, polling at most once per refresh_interval"""
+        if not self.built:
+            with self._build_lock:
+                # Concurrent first lookups wait for one build
+                if not self.built:
+                    self._build()
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        # One thread polls at a time; the others serve the current overlay meanwhile
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = now + self.refresh_interval
+            compact = self._apply_changes(self._token)
+        finally:
+            self._refresh_lock.release()
+        if compact:
+            self.rebuild_in_background()
+
+    def _apply_changes(self, token):
+        """Read the clients changed after token, then apply them under the lock; True if the overlay needs compacting"""
+        newest = db.session.execute(select(func.max(ChangeLog.id))).scalar() or 0
+        if newest == token:
+            return False
+        changed = select(ChangeLog.entity_id).where(
+            ChangeLog.id > token, ChangeLog.id <= newest, ChangeLog.entity == 'client'
+        ).distinct().subquery()
+        rows = db.session.execute(
+            select(changed.c.entity_id, Client.first_name, Client.last_name, Client.contact_number)
+            .outerjoin(Client, Client.id == changed.c.entity_id)
+        )
+        changes = [(client_id, client_terms(first_name, last_name, contact_number) if first_name is not None else ())
+                   for client_id, first_name, last_name, contact_number in rows]
+        with self._lock:
+            # A rebuild that finished meanwhile starts from its own token; the next poll continues from there
+            if self._token != token:
+                return False
+            for client_id, terms in changes:
+                self._replace(client_id, terms)
+            self._token = newest
+            return len(self._pending_terms) > self.max_pending and not self._rebuilding
+
+    def _replace(self, client_id, terms):
+        for term in self._pending_terms.get(client_id, ()):
+            del self._pending[bisect_left(self._pending, (term, client_id))]
+        for term in terms:
+            insort(self._pending, (term, client_id))
+        self._pending_terms[client_id] = terms
+
+    def rebuild_in_background(self):
+        """Rebuild the index from the database in a thread, serving the current one meanwhile.
+
+        Returns the thread, or None if a rebuild is already running.
+        """
+        app = current_app._get_current_object()
+        with self._lock:
+            if self._rebuilding:
+                return None
+            self._rebuilding = True
+
+        def run():
+            try:
+                with app.app_context():
+                    self.build()
+            except Exception:
+                app.logger.exception('Rebuilding the client suggestion index failed')
+            finally:
+                self._rebuilding = False
+
+        thread = threading.Thread(target=run, name='suggest-index', daemon=True)
+        thread.start()
+        return thread
+
+    def suggest(self, prefix, limit=10):
+        """Ids of up to limit clients with a term starting with prefix, in term order.
+
+        None until the index has been built; the first lookup starts the
+        build unless wait_for_build is set.
+        """
+        key = query_key(prefix)
+        if not key:
+            return []
+        if not self.built and not self.wait_for_build:
+            self.rebuild_in_background()
+            return None
+        self.refresh()
+        with self._lock:
+            changed = self._pending_terms
+            base = _first_distinct(((term, client_id) for term, client_id in self._base.matches(key)
+                                    if client_id not in changed), limit)
+            lo = bisect_left(self._pending, (key,))
+            hi = bisect_left(self._pending, (key + _TERM_END,), lo)
+            pending = _first_distinct((self._pending[i] for i in range(lo, hi)), limit)
+        return [client_id for _, client_id in _first_distinct(merge(base, pending), limit)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'built': self.built,
+                'token': self._token,
+                'entries': len(self._base) + len(self._pending),
+                'pending_clients': len(self._pending_terms),
+                'index_bytes': self._base.memory_bytes(),
+            }
+
+
+def init_suggest(app, preload=False):
+    """Attach a SuggestIndex to app, with preload building it in a background thread now"""
+    index = app.extensions['suggest'] = SuggestIndex(app.config.get('SUGGEST_MAX_PENDING', 50000),
+                                                     app.config.get('SUGGEST_REFRESH_MS', 500) / 1000,
+                                                     app.config.get('SUGGEST_WAIT_FOR_BUILD', False))
+    if preload:
+        with app.app_context():
+            index.rebuild_in_background()
+    return index
@@ -1,3 +1,6 @@
+import base64
+import hashlib
+import json
 import re
 from datetime import datetime
 
@@ -19,4 +22,27 @@ def sanitize_input(text):
     if not text:
         return text
     # Remove potentially dangerous characters
-    return re.sub(r'[<>\'";]', '', text)
\ No newline at end of file
+    return re.sub(r'[<>\'";]', '', text)
+
+def encode_cursor(values):
+    """Encode keyset pagination values into an opaque cursor string"""
+    raw = json.dumps(list(values), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or not values:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def make_etag(*parts):
+    """Build a strong ETag value from the parts that identify a representation"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
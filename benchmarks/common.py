@@ -0,0 +1,82 @@
+"""Shared helpers for the benchmark scripts.
+
+Every benchmark prints one JSON document to stdout (or writes it to
+--output), so results can be diffed between commits or collected by CI.
+"""
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of samples (pct in 0..100)"""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples, digits=3):
+    """Summary statistics for a list of timings"""
+    return {
+        'runs': len(samples),
+        'min': round(min(samples), digits),
+        'p50': round(percentile(samples, 50), digits),
+        'p90': round(percentile(samples, 90), digits),
+        'p99': round(percentile(samples, 99), digits),
+        'max': round(max(samples), digits),
+        'mean': round(statistics.fmean(samples), digits),
+    }
+
+
+def argument_parser(description):
+    """ArgumentParser with the --output option every benchmark accepts"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser
+
+
+def emit(benchmark, results, output=None):
+    """Write a benchmark report as JSON"""
+    report = {
+        'benchmark': benchmark,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    return report
+
+
+def time_operation(operation, iterations, warmup=10, before=None):
+    """Milliseconds per call of operation(n) for n in range(iterations), after warmup untimed calls.
+
+    before(n), if given, runs untimed ahead of each call, e.g. to reset the session.
+    """
+    samples = []
+    for n in range(-warmup, iterations):
+        if before is not None:
+            before(n)
+        started = time.perf_counter()
+        operation(n)
+        if n >= 0:
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def throughput(samples_ms):
+    """Operations per second for back-to-back calls with these latencies"""
+    total = sum(samples_ms)
+    return round(len(samples_ms) / total * 1000, 1) if total else None
@@ -0,0 +1,176 @@
+"""Synthetic data for the benchmarks.
+
+Generates clients with plausible names, phone numbers, emails and ages,
+plus a program catalog whose popularity follows a Zipf-like curve. Each
+client enrolls in 0-4 programs, most often one. The same seed always
+produces the same data, so runs on different commits are comparable.
+
+Writing a large database once and reusing it saves time:
+
+    python -m benchmarks.data --size 1m --database /tmp/bench-1m.db
+
+Later benchmarks accept the file through --database. Without it, they
+generate a scratch database of the requested size.
+"""
+import contextlib
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from benchmarks.common import argument_parser, emit
+from sqlalchemy import insert
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+FIRST_NAMES = (
+    'Amina', 'Brian', 'Catherine', 'David', 'Esther', 'Faith', 'George', 'Grace', 'Hassan', 'Irene',
+    'James', 'Joyce', 'Kevin', 'Lucy', 'Mary', 'Mercy', 'Michael', 'Njeri', 'Otieno', 'Peter',
+    'Purity', 'Samuel', 'Sarah', 'Stephen', 'Wanjiku', 'Winnie', 'Yusuf', 'Zawadi', 'Daniel', 'Ann',
+)
+LAST_NAMES = (
+    'Achieng', 'Akinyi', 'Barasa', 'Chebet', 'Gitau', 'Hassan', 'Kamau', 'Kariuki', 'Kiprop', 'Kimani',
+    'Langat', 'Maina', 'Mohamed', 'Mutua', 'Mwangi', 'Njoroge', 'Nyambura', 'Ochieng', 'Odhiambo', 'Omondi',
+    'Onyango', 'Otieno', 'Owino', 'Rotich', 'Wafula', 'Wambui', 'Wanjala', 'Wekesa', 'Were', 'Yego',
+)
+PROGRAMS = (
+    'HIV Care', 'TB Treatment', 'Malaria Prevention', 'Maternal Health', 'Child Immunization',
+    'Diabetes Management', 'Hypertension Control', 'Family Planning', 'Nutrition Support', 'Mental Health',
+    'Cancer Screening', 'Hepatitis B', 'Eye Care', 'Dental Health', 'Adolescent Health',
+    'Elderly Care', 'Substance Use', 'Sickle Cell', 'Asthma Clinic', 'Palliative Care',
+)
+# Programs per client and how likely each count is
+FANOUT = ((0, 25), (1, 40), (2, 20), (3, 10), (4, 5))
+
+BENCH_USER = ('bench', 'bench@example.com', 'bench-password')
+
+
+def populate(clients, programs=len(PROGRAMS), seed=1, batch_size=20000):
+    """Insert synthetic programs, clients and enrollments with bulk statements; returns counts"""
+    from app import db
+    from app.models import Client, HealthProgram, enrollments
+    from app.services import UserService
+    rng = random.Random(seed)
+    UserService.create_user(*BENCH_USER)
+    db.session.execute(insert(HealthProgram), [
+        {'id': n, 'name': PROGRAMS[(n - 1) % len(PROGRAMS)] + ('' if n <= len(PROGRAMS) else f' {n}'),
+         'description': 'Synthetic benchmark program', 'start_date': date(2020, 1, 1)}
+        for n in range(1, programs + 1)
+    ])
+    program_ids = list(range(1, programs + 1))
+    popularity = [1 / rank for rank in program_ids]
+    fanout_values, fanout_weights = zip(*FANOUT)
+    today = date.today().toordinal()
+    started = datetime(2022, 1, 1)
+
+    enrolled = 0
+    for start in range(1, clients + 1, batch_size):
+        ids = range(start, min(start + batch_size, clients + 1))
+        client_rows, enrollment_rows = [], []
+        for client_id in ids:
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            registered = started + timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+            client_rows.append({
+                'id': client_id, 'first_name': first, 'last_name': last,
+                'date_of_birth': date.fromordinal(today - rng.randrange(90 * 365)),
+                'gender': rng.choice(('Female', 'Male')),
+                'contact_number': f'07{rng.randrange(10 ** 8):08d}',
+                'email': f'{first.lower()}.{last.lower()}{client_id}@example.com',
+                'address': f'{rng.randrange(1, 999)} Ngong Road, Nairobi',
+                'created_at': registered, 'updated_at': registered
+            })
+            count = rng.choices(fanout_values, fanout_weights)[0]
+            chosen = set()
+            while len(chosen) < min(count, programs):
+                chosen.add(rng.choices(program_ids, popularity)[0])
+            for program_id in chosen:
+                enrolled_on = registered + timedelta(days=rng.randrange(60))
+                enrollment_rows.append({
+                    'client_id': client_id, 'program_id': program_id, 'enrollment_date': enrolled_on,
+                    'status': 'Active' if rng.random() < 0.85 else 'Completed', 'updated_at': enrolled_on
+                })
+        db.session.execute(insert(Client), client_rows)
+        if enrollment_rows:
+            db.session.execute(insert(enrollments), enrollment_rows)
+        enrolled += len(enrollment_rows)
+        db.session.commit()
+    return {'clients': clients, 'programs': programs, 'enrollments': enrolled}
+
+
+def benchmark_config(path):
+    from config import TestConfig
+
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.abspath(path)}'
+        # The benchmarks measure steady-state code paths, not the profiler or metrics
+        METRICS_ENABLED = False
+    return BenchmarkConfig
+
+
+@contextlib.contextmanager
+def benchmark_app(database=None, clients=SIZES['10k'], seed=1):
+    """Yield (app, counts) for an app on a populated SQLite database.
+
+    An existing database file is reused as is. Otherwise a scratch file (or
+    the given path) is created and filled with `clients` clients.
+    """
+    from app import create_app, db
+    with tempfile.TemporaryDirectory() as directory:
+        path = database or os.path.join(directory, 'bench.db')
+        reuse = os.path.exists(path)
+        app = create_app(benchmark_config(path))
+        with app.app_context():
+            if reuse:
+                counts = dataset_counts()
+            else:
+                db.create_all()
+                counts = populate(clients, seed=seed)
+            db.session.remove()
+        yield app, counts
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def dataset_counts():
+    from app import db
+    from app.models import Client, HealthProgram, enrollments
+    from sqlalchemy import func, select
+    return {
+        'clients': db.session.execute(select(func.count()).select_from(Client)).scalar(),
+        'programs': db.session.execute(select(func.count()).select_from(HealthProgram)).scalar(),
+        'enrollments': db.session.execute(select(func.count()).select_from(enrollments)).scalar(),
+    }
+
+
+def size_arguments(parser):
+    """Add the --size, --clients, --database and --seed options shared by the benchmarks"""
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k', help='dataset preset')
+    parser.add_argument('--clients', type=int, help='client count, overriding --size')
+    parser.add_argument('--database', help='SQLite file to reuse, or to create if missing')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser
+
+
+def client_count(args):
+    return args.clients or SIZES[args.size]
+
+
+def main():
+    parser = size_arguments(argument_parser(__doc__.splitlines()[0]))
+    args = parser.parse_args()
+    if not args.database:
+        parser.error('--database is required when generating a dataset to keep')
+    if os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+
+    started = time.perf_counter()
+    with benchmark_app(args.database, client_count(args), args.seed) as (app, counts):
+        elapsed = time.perf_counter() - started
+    emit('data', dict(counts, database=args.database, seconds=round(elapsed, 2),
+                      clients_per_second=round(counts['clients'] / elapsed)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Duplicate detection: on-insert check latency and batch job throughput.
+
+On a synthetic dataset (benchmarks.data) this:
+- rebuilds the block index (the dataset is bulk inserted without keys)
+- times DeduplicationService.find_possible_duplicates, the check run for
+  each new registration, for misspelled copies of existing clients
+- times the batch job, DeduplicationService.find_duplicate_pairs
+
+The batch figures include clients_per_second; running two sizes shows
+whether it stays flat as the table grows.
+
+    python -m benchmarks.dedup --size 100k
+"""
+import random
+import time
+from benchmarks.common import argument_parser, emit, summarize, throughput, time_operation
+from benchmarks.data import benchmark_app, client_count, size_arguments
+
+
+def misspell(name, rng):
+    """name with one letter doubled, dropped or swapped with its neighbour"""
+    i = rng.randrange(1, len(name) - 1)
+    edit = rng.choice(('double', 'drop', 'swap'))
+    if edit == 'double':
+        return name[:i] + name[i] + name[i:]
+    if edit == 'drop':
+        return name[:i] + name[i + 1:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def main():
+    parser = size_arguments(argument_parser(__doc__.splitlines()[0]))
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    with benchmark_app(args.database, client_count(args), args.seed) as (app, counts):
+        from app.models import Client
+        from app.services import DeduplicationService
+        with app.app_context():
+            started = time.perf_counter()
+            DeduplicationService.rebuild_block_index()
+            index_seconds = time.perf_counter() - started
+
+            rng = random.Random(args.seed)
+            ids = rng.sample(range(1, counts['clients'] + 1), min(args.iterations + 10, counts['clients']))
+            probes = [(misspell(client.first_name, rng), client.last_name, client.date_of_birth, client.gender)
+                      for client in Client.query.filter(Client.id.in_(ids))]
+            samples = time_operation(
+                lambda n: DeduplicationService.find_possible_duplicates(*probes[n % len(probes)]),
+                args.iterations, 10)
+
+            batch = DeduplicationService.find_duplicate_pairs()
+
+    emit('dedup', {
+        'dataset': counts,
+        'index_seconds': round(index_seconds, 2),
+        'on_insert_check_ms': dict(summarize(samples), ops_per_second=throughput(samples)),
+        'batch': {
+            'seconds': batch['elapsed_seconds'],
+            'clients_per_second': round(counts['clients'] / batch['elapsed_seconds']),
+            'blocks': batch['blocks'],
+            'oversized_blocks': batch['oversized_blocks'],
+            'comparisons': batch['comparisons'],
+            'pairs': len(batch['pairs']),
+            'clusters': len(batch['clusters']),
+        },
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
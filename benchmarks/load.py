@@ -0,0 +1,202 @@
+"""End-to-end load driver for the JSON API.
+
+Logs in as the benchmark user and runs a weighted mix of requests from
+several threads:
+
+- list: GET /api/clients (first page, with programs)
+- client: GET /api/clients/<id>
+- search: GET /api/clients/search?query=...
+- programs: GET /api/programs
+- enroll: POST then DELETE /api/clients/<id>/programs/<id>, so the
+  dataset is unchanged afterwards. A client who is already enrolled gets
+  a 400 from the POST; that pair is left alone and not counted as an error.
+
+By default the requests go through the Flask test client, in process,
+against a synthetic dataset (benchmarks.data). With --url they go over
+HTTP to a running server instead, which must hold a dataset made by
+benchmarks.data (for the bench user and the client id range):
+
+    python -m benchmarks.data --size 100k --database /tmp/bench.db
+    DATABASE_URL=sqlite:////tmp/bench.db python run.py
+    python -m benchmarks.load --url http://127.0.0.1:5000 --size 100k --threads 8
+
+Reports requests per second overall and per scenario latency (ms)
+percentiles, plus error counts.
+"""
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import quote, urlsplit
+from benchmarks.common import argument_parser, emit, summarize
+from benchmarks.data import BENCH_USER, LAST_NAMES, benchmark_app, client_count, size_arguments
+
+# Scenario name and relative weight
+MIX = (('list', 25), ('client', 30), ('search', 20), ('programs', 15), ('enroll', 10))
+
+
+class InProcessTarget:
+    """Requests through the Flask test client; one test client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, headers=None, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, headers=headers, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HttpTarget:
+    """Requests over HTTP to a running server; one keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, headers=None, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.host, self.port, timeout=30)
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, self.prefix + path, body=payload, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+def login(target):
+    username, _, password = BENCH_USER
+    status, data = target.request('POST', '/api/login', body={'username': username, 'password': password})
+    if status != 200:
+        raise SystemExit(f'login as {username} failed ({status}); was the dataset made by benchmarks.data?')
+    return {'Authorization': f"Bearer {json.loads(data)['access_token']}"}
+
+
+class LoadRun:
+    """Shared state of one run: the target, dataset bounds and per-scenario results"""
+
+    def __init__(self, target, headers, clients, programs, page_size):
+        self.target = target
+        self.headers = headers
+        self.clients = clients
+        self.programs = programs
+        self.page_size = page_size
+        self.latencies = {name: [] for name, _ in MIX}
+        self.errors = {name: 0 for name, _ in MIX}
+        self.lock = threading.Lock()
+
+    def call(self, name, method, path, expected=(200,)):
+        """Time one request; returns its status, or None if it failed"""
+        started = time.perf_counter()
+        try:
+            status, _ = self.target.request(method, path, self.headers)
+        except Exception:
+            status = None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            if status in expected:
+                self.latencies[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+        return status
+
+    def scenario(self, name, rng):
+        if name == 'list':
+            self.call(name, 'GET', f'/api/clients?limit={self.page_size}')
+        elif name == 'client':
+            self.call(name, 'GET', f'/api/clients/{rng.randint(1, self.clients)}')
+        elif name == 'search':
+            self.call(name, 'GET', f'/api/clients/search?query={quote(rng.choice(LAST_NAMES))}'
+                                   f'&limit={self.page_size}')
+        elif name == 'programs':
+            self.call(name, 'GET', '/api/programs')
+        elif name == 'enroll':
+            path = f'/api/clients/{rng.randint(1, self.clients)}/programs/{rng.randint(1, self.programs)}'
+            if self.call(name, 'POST', path, expected=(200, 400)) == 200:
+                self.call(name, 'DELETE', path)
+
+    def worker(self, seed, deadline, remaining):
+        rng = random.Random(seed)
+        names = [name for name, _ in MIX]
+        weights = [weight for _, weight in MIX]
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            self.scenario(rng.choices(names, weights)[0], rng)
+
+    def run(self, threads, duration, requests, seed):
+        """Run the mix until duration seconds pass or requests scenarios have started"""
+        deadline = time.perf_counter() + duration
+        remaining = [requests or float('inf')]
+        workers = [threading.Thread(target=self.worker, args=(seed + n, deadline, remaining))
+                   for n in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        total = sum(len(samples) for samples in self.latencies.values())
+        errors = sum(self.errors.values())
+        results = {
+            'unit': 'ms',
+            'threads': threads,
+            'seconds': round(elapsed, 2),
+            'requests': total + errors,
+            'errors': errors,
+            'requests_per_second': round((total + errors) / elapsed, 1),
+            'all': summarize([ms for samples in self.latencies.values() for ms in samples]) if total else None,
+        }
+        for name, samples in self.latencies.items():
+            results[name] = dict(summarize(samples) if samples else {'runs': 0},
+                                 errors=self.errors[name],
+                                 requests_per_second=round(len(samples) / elapsed, 1))
+        return results
+
+
+def main():
+    parser = size_arguments(argument_parser(__doc__.splitlines()[0]))
+    parser.add_argument('--url', help='base URL of a running server; default is the in-process test client')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='stop after this many scenarios instead')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--programs', type=int, default=20, help='program id range, with --url')
+    args = parser.parse_args()
+
+    if args.url:
+        target = HttpTarget(args.url)
+        load = LoadRun(target, login(target), client_count(args), args.programs, args.page_size)
+        results = load.run(args.threads, args.duration, args.requests, args.seed)
+        emit('load', dict(target=args.url, **results), args.output)
+        return
+
+    with benchmark_app(args.database, client_count(args), args.seed) as (app, counts):
+        target = InProcessTarget(app)
+        load = LoadRun(target, login(target), counts['clients'], counts['programs'], args.page_size)
+        results = load.run(args.threads, args.duration, args.requests, args.seed)
+    emit('load', dict(target='test_client', dataset=counts, **results), args.output)
+
+
+if __name__ == '__main__':
+    main()
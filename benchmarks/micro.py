@@ -0,0 +1,127 @@
+"""Micro-benchmarks of the service-layer hot paths.
+
+Times, in milliseconds per call, on a synthetic dataset (benchmarks.data):
+- ClientService.search_clients for name, phone and email queries
+- ClientService.fuzzy_search_clients for misspelled names
+- ClientService.get_clients_page with structured filters and sorts, from
+  one selective criterion to combinations matching much of the table
+- EnrollmentService.enroll_client and unenroll_client on clients not yet
+  in the program; every enrollment is removed again, so a reused
+  --database is left as it was
+- Client.to_dict with programs already loaded, and with programs lazy
+  loaded (one query per client, the N+1 pattern)
+- EnrollmentService.get_program_clients for the most popular program, a
+  middling one and the least popular, and a page of each one's active
+  enrollments (get_program_enrollments_page)
+
+The session is cleared before every call, as at the start of a request.
+Each operation reports summary statistics and ops_per_second.
+
+    python -m benchmarks.micro --size 100k --iterations 200
+"""
+from benchmarks.common import argument_parser, emit, summarize, throughput, time_operation
+from benchmarks.data import benchmark_app, client_count, size_arguments
+
+SEARCH_QUERIES = {
+    'search_name': ('Mwangi', 'Grace', 'Kamau Peter', 'Otieno', 'Njeri Wanjala'),
+    'search_prefix': ('Mwa', 'Gra', 'Kip', 'Wek'),
+    'search_phone': ('0712', '07234', '0799'),
+    'search_email': ('grace.kamau', 'peter.mwangi1', 'example.com'),
+}
+FUZZY_QUERIES = ('Mwangy', 'Otiyeno', 'Wanjeku Kamawu', 'Kiprob', 'Grase Wafulah')
+# (criteria, sort) for a page of /api/clients; the synthetic clients registered in 2022-2023
+FILTER_QUERIES = {
+    'filter_program_officers': ({'gender': 'Female', 'min_age': 15, 'max_age': 49, 'program': 2,
+                                 'status': 'Active', 'registered_after': '2023-06-01',
+                                 'registered_before': '2023-06-30'}, None),
+    'filter_enrolled_week': ({'enrolled_after': '2023-03-06', 'enrolled_before': '2023-03-12'}, 'name'),
+    'filter_program_status': ({'program': 2, 'status': 'Completed'}, '-created_at'),
+    'filter_women_by_age': ({'gender': 'Female', 'min_age': 15, 'max_age': 49}, 'date_of_birth'),
+}
+
+
+def report(samples, digits=3):
+    return dict(summarize(samples, digits), ops_per_second=throughput(samples))
+
+
+def run(app, iterations, warmup, search_limit):
+    from app import db
+    from app.models import Client, HealthProgram, enrollments
+    from app.services import ClientService, EnrollmentService
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import selectinload
+
+    def reset(n):
+        db.session.remove()
+
+    results = {'unit': 'ms'}
+    with app.app_context():
+        for name, queries in SEARCH_QUERIES.items():
+            results[name] = report(time_operation(
+                lambda n: ClientService.search_clients(queries[n % len(queries)], with_programs=True,
+                                                       limit=search_limit),
+                iterations, warmup, reset))
+        results['fuzzy_search'] = report(time_operation(
+            lambda n: ClientService.fuzzy_search_clients(FUZZY_QUERIES[n % len(FUZZY_QUERIES)], 10,
+                                                         with_programs=True),
+            iterations, warmup, reset))
+        for name, (criteria, sort) in FILTER_QUERIES.items():
+            results[name] = report(time_operation(
+                lambda n: ClientService.get_clients_page(50, with_programs=True, criteria=criteria, sort=sort),
+                iterations, warmup, reset))
+
+        # Clients outside the least popular program, enrolled and then withdrawn one by one
+        program_id = db.session.execute(select(func.max(HealthProgram.id))).scalar()
+        enrolled = select(enrollments.c.client_id).where(enrollments.c.program_id == program_id)
+        candidates = db.session.execute(
+            select(Client.id).where(Client.id.not_in(enrolled)).order_by(Client.id).limit(iterations + warmup)
+        ).scalars().all()
+        results['enroll_client'] = report(time_operation(
+            lambda n: EnrollmentService.enroll_client(candidates[n + warmup], program_id),
+            len(candidates) - warmup, warmup, reset))
+        results['unenroll_client'] = report(time_operation(
+            lambda n: EnrollmentService.unenroll_client(candidates[n + warmup], program_id),
+            len(candidates) - warmup, warmup, reset))
+
+        # to_dict alone: the clients (and for the eager case their programs) are loaded untimed
+        count = iterations + warmup
+        loaded = Client.query.options(selectinload(Client.programs)).order_by(Client.id).limit(count).all()
+        results['client_to_dict'] = report(time_operation(
+            lambda n: loaded[n + warmup].to_dict(), iterations, warmup), digits=4)
+        db.session.remove()
+        lazy = Client.query.order_by(Client.id).limit(count).all()
+        results['client_to_dict_lazy_programs'] = report(time_operation(
+            lambda n: lazy[n + warmup].to_dict(), iterations, warmup), digits=4)
+        db.session.remove()
+
+        popularity = db.session.execute(
+            select(enrollments.c.program_id, func.count()).group_by(enrollments.c.program_id)
+            .order_by(func.count().desc())
+        ).all()
+        rosters = iterations // 10 or 1
+        for label, index in (('top', 0), ('median', len(popularity) // 2), ('tail', -1)):
+            program_id, size = popularity[index]
+            results[f'get_program_clients_{label}'] = dict(report(time_operation(
+                lambda n: EnrollmentService.get_program_clients(program_id), rosters, 1, reset)),
+                program_id=program_id, clients=size)
+            results[f'active_enrollments_page_{label}'] = dict(report(time_operation(
+                lambda n: EnrollmentService.get_program_enrollments_page(program_id, 50, status='Active'),
+                iterations, warmup, reset)), program_id=program_id)
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = size_arguments(argument_parser(__doc__.splitlines()[0]))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--search-limit', type=int, default=50)
+    args = parser.parse_args()
+
+    with benchmark_app(args.database, client_count(args), args.seed) as (app, counts):
+        results = run(app, args.iterations, args.warmup, args.search_limit)
+    emit('micro', dict(dataset=counts, **results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Cohort reporting benchmark: NumPy extracts against per-object ORM loops.
+
+Fills a scratch SQLite database with synthetic clients and enrollments,
+then times the quarterly report two ways:
+
+- per_object: iterate Client instances (with their programs) and
+  enrollment rows in Python, as the reports used to
+- vectorized: app.reporting, columnar extracts and NumPy array operations
+
+Both produce the same age distribution, cohort sizes and co-enrollment
+counts; the benchmark checks that before reporting timings in seconds.
+
+    python -m benchmarks.reporting --clients 1000000
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from benchmarks.common import argument_parser, emit
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
+
+AS_OF = date(2024, 6, 30)
+
+
+def populate(db, clients, programs, seed=1):
+    """Insert synthetic clients, programs and enrollments in bulk; returns the enrollment count"""
+    from app.models import Client, HealthProgram, enrollments
+    rng = random.Random(seed)
+    db.session.execute(insert(HealthProgram), [{'id': n, 'name': f'Program {n}'} for n in range(1, programs + 1)])
+    first_day = date(1930, 1, 1).toordinal()
+    enrolled = 0
+    batch = 50000
+    for start in range(1, clients + 1, batch):
+        ids = range(start, min(start + batch, clients + 1))
+        db.session.execute(insert(Client), [{
+            'id': client_id, 'first_name': f'F{client_id}', 'last_name': f'L{client_id}',
+            'date_of_birth': date.fromordinal(first_day + rng.randrange(33000)),
+            'gender': rng.choice(('Female', 'Male'))
+        } for client_id in ids])
+        rows = []
+        for client_id in ids:
+            for program_id in rng.sample(range(1, programs + 1), rng.choice((0, 1, 1, 2, 3))):
+                rows.append({
+                    'client_id': client_id, 'program_id': program_id,
+                    'enrollment_date': datetime(2023, 1, 1) + timedelta(days=rng.randrange(540)),
+                    'status': rng.choice(('Active', 'Active', 'Completed'))
+                })
+        if rows:
+            db.session.execute(insert(enrollments), rows)
+        enrolled += len(rows)
+        db.session.commit()
+    return enrolled
+
+
+def per_object_report(db):
+    """The report computed by looping over ORM instances and rows"""
+    from app.models import Client, enrollments
+    from app.services import AnalyticsService, years_before
+    bands = AnalyticsService.AGE_BANDS
+    cutoffs = [years_before(AS_OF, low) for low in bands]
+
+    age_counts = {}
+    co_enrollment = {}
+    for client in Client.query.options(selectinload(Client.programs)).order_by(Client.id).yield_per(10000):
+        band = None
+        for index, cutoff in enumerate(cutoffs):
+            if client.date_of_birth <= cutoff:
+                band = index
+        if band is not None:
+            key = (client.gender, band)
+            age_counts[key] = age_counts.get(key, 0) + 1
+
+    first_month, months, active = {}, {}, set()
+    for row in db.session.execute(select(enrollments)):
+        month = row.enrollment_date.year * 12 + row.enrollment_date.month - 1
+        first_month[row.client_id] = min(first_month.get(row.client_id, month), month)
+        months.setdefault(row.client_id, set()).add(month)
+        if row.status == 'Active':
+            active.add(row.client_id)
+            co_enrollment.setdefault(row.client_id, []).append(row.program_id)
+
+    cohort_sizes = {}
+    for client_id, first in first_month.items():
+        cohort_sizes[first] = cohort_sizes.get(first, 0) + 1
+    matrix = {}
+    for program_ids in co_enrollment.values():
+        for a in program_ids:
+            for b in program_ids:
+                matrix[(a, b)] = matrix.get((a, b), 0) + 1
+    return {'age_counts': age_counts, 'cohort_sizes': [cohort_sizes[m] for m in sorted(cohort_sizes)],
+            'co_enrollment': matrix}
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000000)
+    parser.add_argument('--programs', type=int, default=12)
+    parser.add_argument('--horizon', type=int, default=12)
+    args = parser.parse_args()
+
+    from app import create_app, db, reporting
+    from config import TestConfig
+    reporting.require_numpy()
+
+    with tempfile.TemporaryDirectory() as directory:
+        class BenchmarkConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'reporting.db')}"
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            enrolled = populate(db, args.clients, args.programs)
+            populate_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            baseline = per_object_report(db)
+            per_object_seconds = time.perf_counter() - started
+            db.session.remove()
+
+            started = time.perf_counter()
+            report = reporting.quarterly_report(AS_OF, args.horizon)
+            vectorized_seconds = time.perf_counter() - started
+
+    distribution = report['age_distribution']
+    for gender, counts in zip(distribution['genders'], distribution['counts']):
+        for band, count in enumerate(counts):
+            assert baseline['age_counts'].get((gender, band), 0) == count, (gender, band)
+    assert baseline['cohort_sizes'] == report['cohorts']['sizes']
+    co_enrollment = report['co_enrollment']
+    for i, a in enumerate(co_enrollment['program_ids']):
+        for j, b in enumerate(co_enrollment['program_ids']):
+            assert baseline['co_enrollment'].get((a, b), 0) == co_enrollment['counts'][i][j], (a, b)
+
+    emit('reporting', {
+        'unit': 's',
+        'clients': args.clients,
+        'enrollments': enrolled,
+        'populate': round(populate_seconds, 3),
+        'per_object': round(per_object_seconds, 3),
+        'vectorized': round(vectorized_seconds, 3),
+        'speedup': round(per_object_seconds / vectorized_seconds, 1),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
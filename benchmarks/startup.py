@@ -0,0 +1,76 @@
+"""Cold-start benchmark: import, create_app() and first-request latency.
+
+Each run uses a fresh interpreter, as a serverless cold start does, and
+times three phases in milliseconds:
+
+- import: `from app import create_app`
+- create_app: building the application with the production Config
+- first_request: the first GET of the login page, including template compilation
+
+Runs are repeated with the Jinja bytecode cache off ("cold") and with a
+warmed cache directory ("warm").
+
+    python -m benchmarks.startup --runs 20
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from benchmarks.common import argument_parser, emit, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'create_app': (created - imported) * 1000,
+    'first_request': (done - created) * 1000,
+    'total': (done - start) * 1000,
+}))
+"""
+
+
+def run_once(env):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs, env):
+    samples = {}
+    for _ in range(runs):
+        for phase, elapsed in run_once(env).items():
+            samples.setdefault(phase, []).append(elapsed)
+    return {phase: summarize(values) for phase, values in samples.items()}
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per scenario')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        cold = measure(args.runs, dict(env, TEMPLATE_CACHE='0'))
+        cache_dir = os.path.join(directory, 'templates')
+        warm_env = dict(env, TEMPLATE_CACHE_DIR=cache_dir)
+        run_once(warm_env)
+        warm = measure(args.runs, warm_env)
+    
+    emit('startup', {'unit': 'ms', 'cold_template_cache': cold, 'warm_template_cache': warm}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Typeahead: prefix index build cost, memory and lookup latency.
+
+On a synthetic dataset (benchmarks.data) this:
+- builds the in-memory prefix index (app/suggest.py), reporting the time,
+  the size of its buffers and the peak memory allocated while building
+- times ClientService.suggest_clients for name, full-name and phone
+  prefixes of one to six characters
+- times GET /api/clients/suggest through the test client, so the figures
+  include routing, JWT checks and JSON serialization
+
+    python -m benchmarks.suggest --size 1m
+"""
+import random
+import time
+import tracemalloc
+from benchmarks.common import argument_parser, emit, summarize, throughput, time_operation
+from benchmarks.data import FIRST_NAMES, LAST_NAMES, benchmark_app, client_count, size_arguments
+from benchmarks.load import InProcessTarget, login
+
+
+def prefixes(count, rng):
+    """Typed prefixes: a name, both names, or a phone number, cut after one to six characters"""
+    found = []
+    for _ in range(count):
+        kind = rng.choice(('name', 'full_name', 'phone'))
+        if kind == 'name':
+            text = rng.choice(FIRST_NAMES + LAST_NAMES)
+        elif kind == 'full_name':
+            text = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        else:
+            text = f'07{rng.randrange(10 ** 8):08d}'
+        found.append(text[:rng.randint(1, 6)])
+    return found
+
+
+def main():
+    parser = size_arguments(argument_parser(__doc__.splitlines()[0]))
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with benchmark_app(args.database, client_count(args), args.seed) as (app, counts):
+        from app.services import ClientService
+        index = app.extensions['suggest']
+        with app.app_context():
+            started = time.perf_counter()
+            index.build()
+            build_seconds = time.perf_counter() - started
+            # Again under tracemalloc, which slows the build too much to time it
+            tracemalloc.start()
+            index.build()
+            _, build_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            typed = prefixes(args.iterations, random.Random(args.seed))
+            service = time_operation(lambda n: ClientService.suggest_clients(typed[n % len(typed)]),
+                                     args.iterations)
+
+        target = InProcessTarget(app)
+        headers = login(target)
+        api = time_operation(
+            lambda n: target.request('GET', f'/api/clients/suggest?prefix={typed[n % len(typed)]}', headers),
+            args.iterations)
+
+    emit('suggest', {
+        'dataset': counts,
+        'index': dict(index.stats(), build_seconds=round(build_seconds, 2), build_peak_bytes=build_peak),
+        'suggest_clients_ms': dict(summarize(service), ops_per_second=throughput(service)),
+        'api_ms': dict(summarize(api), requests_per_second=throughput(api)),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
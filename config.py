@@ -5,5 +5,110 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///health_system.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Create missing tables on startup. Off by default: the schema is managed with
+    # 'flask db upgrade', and create_all costs every cold start a round of reflection
+    AUTO_CREATE_SCHEMA = os.environ.get('AUTO_CREATE_SCHEMA', '0') == '1'
+    # Compiled Jinja templates are cached on disk across processes. Without a TEMPLATE_CACHE_DIR,
+    # Jinja keeps them in a private per-user directory (mode 0700, owner checked); a directory set
+    # here must be writable by the app's user only, since its bytecode is loaded and run
+    TEMPLATE_CACHE = os.environ.get('TEMPLATE_CACHE', '1') == '1'
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR') or None
+    # Optional read replica for list, search and export reads (see app/replica.py)
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    
+    # Connection pool for server databases such as PostgreSQL; SQLite keeps SQLAlchemy's defaults
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    # Recycle connections before server or firewall idle timeouts close them
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    
+    # Request latency histograms and counters served at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    
+    # Opt-in request profiling (see app/profiling.py)
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+    PROFILE_HISTORY = int(os.environ.get('PROFILE_HISTORY', 200))
+    PROFILE_REPEATED_QUERY_WARNING = int(os.environ.get('PROFILE_REPEATED_QUERY_WARNING', 10))
+    PROFILE_SAMPLER_ENABLED = os.environ.get('PROFILE_SAMPLER_ENABLED', '0') == '1'
+    PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+    PROFILE_SLOW_REQUEST_MS = float(os.environ.get('PROFILE_SLOW_REQUEST_MS', 500))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    
+    # Password hashing; hashes made with other settings are upgraded on the user's next login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+    # Seconds a JWT's user is served from the cache instead of the user table
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or secrets.token_hex(16)
-    JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
+    
+    # Keyset pagination for list views and API endpoints
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+    
+    # Rows inserted per transaction by the bulk client import
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    
+    # Clients fetched per round trip by the streaming export
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+    
+    # Duplicate client detection (see app/matching.py): minimum similarity score to report a
+    # possible duplicate, candidates scored per new client, and the largest block the batch job compares
+    DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.9))
+    DEDUP_MAX_CANDIDATES = int(os.environ.get('DEDUP_MAX_CANDIDATES', 200))
+    DEDUP_MAX_BLOCK = int(os.environ.get('DEDUP_MAX_BLOCK', 1000))
+    
+    # Fuzzy name search: candidates taken from each index, and the minimum Jaro-Winkler score returned
+    FUZZY_SEARCH_CANDIDATES = int(os.environ.get('FUZZY_SEARCH_CANDIDATES', 200))
+    FUZZY_SEARCH_MIN_SCORE = float(os.environ.get('FUZZY_SEARCH_MIN_SCORE', 0.8))
+    
+    # In-memory typeahead index (see app/suggest.py): start its background build at startup (off by
+    # default; every process that imports the app would pay for it) rather than on the first lookup,
+    # build it inside the first lookup instead of answering from the database until it is ready,
+    # clients re-indexed since the last build before rebuilding, how often lookups poll the change
+    # log, and suggestions per lookup
+    SUGGEST_PRELOAD = os.environ.get('SUGGEST_PRELOAD', '0') == '1'
+    SUGGEST_WAIT_FOR_BUILD = os.environ.get('SUGGEST_WAIT_FOR_BUILD', '0') == '1'
+    SUGGEST_MAX_PENDING = int(os.environ.get('SUGGEST_MAX_PENDING', 50000))
+    SUGGEST_REFRESH_MS = int(os.environ.get('SUGGEST_REFRESH_MS', 500))
+    SUGGEST_LIMIT = int(os.environ.get('SUGGEST_LIMIT', 10))
+    
+    # Read-through cache for the program catalog; 'memory' or 'file' (shared by local workers)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_DIR = os.environ.get('CACHE_DIR')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    
+    # SQLite connection pragmas: WAL lets readers run alongside the writer, and
+    # synchronous=NORMAL is durable under WAL except across power loss
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'temp_store': 'MEMORY',
+    }
+    # Whole-transaction retries when a write still hits "database is locked"
+    SQLITE_LOCK_RETRIES = int(os.environ.get('SQLITE_LOCK_RETRIES', 5))
+    SQLITE_RETRY_BACKOFF = float(os.environ.get('SQLITE_RETRY_BACKOFF', 0.05))
+    SQLITE_RETRY_MAX_BACKOFF = float(os.environ.get('SQLITE_RETRY_MAX_BACKOFF', 1.0))
+    # Route registration/enrollment writes through one group-committing writer thread
+    SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE', '0') == '1'
+    SQLITE_WRITE_QUEUE_MAX_BATCH = int(os.environ.get('SQLITE_WRITE_QUEUE_MAX_BATCH', 64))
+    SQLITE_WRITE_QUEUE_MAX_WAIT = float(os.environ.get('SQLITE_WRITE_QUEUE_MAX_WAIT', 0.002))
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    TEMPLATE_CACHE = False
+    # Full-cost hashing would dominate the suite's runtime
+    PASSWORD_HASH_ITERATIONS = 1000
+    # A background build would race each test's schema setup
+    SUGGEST_PRELOAD = False
+    SUGGEST_WAIT_FOR_BUILD = True
+    # Lookups see each test's writes immediately
+    SUGGEST_REFRESH_MS = 0
+    WTF_CSRF_ENABLED = False
@@ -0,0 +1,50 @@
+"""updated_at columns and change log for conditional GET and delta sync
+
+Revision ID: 8c4e7b1a2f36
+Revises: 5a1f3c2d9e01
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e7b1a2f36'
+down_revision = '5a1f3c2d9e01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('health_program', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Existing rows have not changed since they were created
+    op.execute('UPDATE client SET updated_at = created_at')
+    op.execute('UPDATE health_program SET updated_at = created_at')
+    op.execute('UPDATE enrollments SET updated_at = enrollment_date')
+
+    op.create_table('change_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=True),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('change_log')
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+    with op.batch_alter_table('health_program', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,91 @@
+"""phonetic codes and name trigrams on client for fuzzy search
+
+Existing clients get their keys from app.matching in batches. On SQLite the
+trigrams are then indexed in an FTS5 table kept in sync by triggers.
+
+Revision ID: a4d8e2c7f913
+Revises: f1c6a3d8b254
+Create Date: 2026-10-18 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.matching import name_keys
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d8e2c7f913'
+down_revision = 'f1c6a3d8b254'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('first_name_phonetic', sa.String(length=4), nullable=True))
+        batch_op.add_column(sa.Column('last_name_phonetic', sa.String(length=4), nullable=True))
+        batch_op.add_column(sa.Column('name_ngrams', sa.Text(), nullable=True))
+        batch_op.create_index('ix_client_last_name_phonetic_date_of_birth',
+                              ['last_name_phonetic', 'date_of_birth'], unique=False)
+        batch_op.create_index('ix_client_first_name_phonetic_date_of_birth',
+                              ['first_name_phonetic', 'date_of_birth'], unique=False)
+
+    bind = op.get_bind()
+    client = sa.table('client', sa.column('id'), sa.column('first_name'), sa.column('last_name'),
+                      sa.column('first_name_phonetic'), sa.column('last_name_phonetic'), sa.column('name_ngrams'))
+    update = client.update().where(client.c.id == sa.bindparam('client_id')).values(
+        first_name_phonetic=sa.bindparam('first_name_phonetic'),
+        last_name_phonetic=sa.bindparam('last_name_phonetic'),
+        name_ngrams=sa.bindparam('name_ngrams')
+    )
+    after = 0
+    while True:
+        rows = bind.execute(
+            sa.select(client.c.id, client.c.first_name, client.c.last_name)
+            .where(client.c.id > after).order_by(client.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(update, [dict(name_keys(row.first_name, row.last_name), client_id=row.id) for row in rows])
+        after = rows[-1].id
+
+    if bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE client_ngram_fts USING fts5("
+                   "name_ngrams, content='client', content_rowid='id')")
+        op.execute(
+            "CREATE TRIGGER client_ngram_fts_ai AFTER INSERT ON client BEGIN "
+            "INSERT INTO client_ngram_fts(rowid, name_ngrams) VALUES (new.id, new.name_ngrams); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER client_ngram_fts_ad AFTER DELETE ON client BEGIN "
+            "INSERT INTO client_ngram_fts(client_ngram_fts, rowid, name_ngrams) "
+            "VALUES ('delete', old.id, old.name_ngrams); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER client_ngram_fts_au AFTER UPDATE OF name_ngrams ON client BEGIN "
+            "INSERT INTO client_ngram_fts(client_ngram_fts, rowid, name_ngrams) "
+            "VALUES ('delete', old.id, old.name_ngrams); "
+            "INSERT INTO client_ngram_fts(rowid, name_ngrams) VALUES (new.id, new.name_ngrams); "
+            "END"
+        )
+        op.execute("INSERT INTO client_ngram_fts(client_ngram_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS client_ngram_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS client_ngram_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS client_ngram_fts_ai")
+        op.execute("DROP TABLE IF EXISTS client_ngram_fts")
+
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.drop_index('ix_client_first_name_phonetic_date_of_birth')
+        batch_op.drop_index('ix_client_last_name_phonetic_date_of_birth')
+        batch_op.drop_column('name_ngrams')
+        batch_op.drop_column('last_name_phonetic')
+        batch_op.drop_column('first_name_phonetic')
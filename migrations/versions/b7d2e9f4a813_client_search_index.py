@@ -0,0 +1,76 @@
+"""client full-text search index
+
+FTS5 table and sync triggers on SQLite, trigram indexes on PostgreSQL.
+
+Revision ID: b7d2e9f4a813
+Revises: 8c4e7b1a2f36
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e9f4a813'
+down_revision = '8c4e7b1a2f36'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'first_name, last_name, contact_number, email'
+TRIGRAM_COLUMNS = ('first_name', 'last_name', 'contact_number', 'email')
+
+
+def indexed_values(row):
+    phone = f'{row}.contact_number'
+    for char in (' ', '-', '(', ')', '+'):
+        phone = f"replace({phone}, '{char}', '')"
+    return f'{row}.first_name, {row}.last_name, {phone}, {row}.email'
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute(
+            f"CREATE VIRTUAL TABLE client_fts USING fts5("
+            f"{COLUMNS}, content='client', content_rowid='id', prefix='2 3')"
+        )
+        op.execute(
+            f"CREATE TRIGGER client_fts_ai AFTER INSERT ON client BEGIN "
+            f"INSERT INTO client_fts(rowid, {COLUMNS}) VALUES (new.id, {indexed_values('new')}); "
+            f"END"
+        )
+        op.execute(
+            f"CREATE TRIGGER client_fts_ad AFTER DELETE ON client BEGIN "
+            f"INSERT INTO client_fts(client_fts, rowid, {COLUMNS}) "
+            f"VALUES ('delete', old.id, {indexed_values('old')}); "
+            f"END"
+        )
+        op.execute(
+            f"CREATE TRIGGER client_fts_au AFTER UPDATE OF {COLUMNS} ON client BEGIN "
+            f"INSERT INTO client_fts(client_fts, rowid, {COLUMNS}) "
+            f"VALUES ('delete', old.id, {indexed_values('old')}); "
+            f"INSERT INTO client_fts(rowid, {COLUMNS}) VALUES (new.id, {indexed_values('new')}); "
+            f"END"
+        )
+        op.execute(
+            f"INSERT INTO client_fts(rowid, {COLUMNS}) "
+            f"SELECT client.id, {indexed_values('client')} FROM client"
+        )
+    elif bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in TRIGRAM_COLUMNS:
+            op.create_index(f'ix_client_{column}_trgm', 'client', [column],
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS client_fts_au')
+        op.execute('DROP TRIGGER IF EXISTS client_fts_ad')
+        op.execute('DROP TRIGGER IF EXISTS client_fts_ai')
+        op.execute('DROP TABLE IF EXISTS client_fts')
+    elif bind.dialect.name == 'postgresql':
+        for column in TRIGRAM_COLUMNS:
+            op.drop_index(f'ix_client_{column}_trgm', table_name='client')
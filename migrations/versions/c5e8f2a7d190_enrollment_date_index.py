@@ -0,0 +1,27 @@
+"""index for client filters on enrollment date
+
+Revision ID: c5e8f2a7d190
+Revises: a4d8e2c7f913
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8f2a7d190'
+down_revision = 'a4d8e2c7f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollments_enrollment_date_program_id', ['enrollment_date', 'program_id'],
+                              unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_enrollment_date_program_id')
@@ -0,0 +1,29 @@
+"""program roster index covers the client id, for status rosters paged by client
+
+Revision ID: d9b3f61e8a24
+Revises: c5e8f2a7d190
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f61e8a24'
+down_revision = 'c5e8f2a7d190'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_program_id_status')
+        batch_op.create_index('ix_enrollments_program_id_status_client_id',
+                              ['program_id', 'status', 'client_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_program_id_status_client_id')
+        batch_op.create_index('ix_enrollments_program_id_status', ['program_id', 'status'], unique=False)
@@ -0,0 +1,42 @@
+"""indexes for the listing, search, filter and roster queries
+
+Revision ID: e3a95c6d0b47
+Revises: b7d2e9f4a813
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a95c6d0b47'
+down_revision = 'b7d2e9f4a813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.create_index('ix_client_last_name_first_name', ['last_name', 'first_name'], unique=False)
+        batch_op.create_index('ix_client_first_name', ['first_name'], unique=False)
+        batch_op.create_index('ix_client_date_of_birth', ['date_of_birth'], unique=False)
+        batch_op.create_index('ix_client_gender_date_of_birth', ['gender', 'date_of_birth'], unique=False)
+        batch_op.create_index('ix_client_created_at', ['created_at'], unique=False)
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollments_program_id_status', ['program_id', 'status'], unique=False)
+        batch_op.create_index('ix_enrollments_status', ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_status')
+        batch_op.drop_index('ix_enrollments_program_id_status')
+
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.drop_index('ix_client_created_at')
+        batch_op.drop_index('ix_client_gender_date_of_birth')
+        batch_op.drop_index('ix_client_date_of_birth')
+        batch_op.drop_index('ix_client_first_name')
+        batch_op.drop_index('ix_client_last_name_first_name')
@@ -0,0 +1,58 @@
+"""blocking index for duplicate client detection
+
+The block keys are phonetic codes computed in Python (app.matching), so
+existing clients are keyed here in batches rather than with one SQL
+statement.
+
+Revision ID: f1c6a3d8b254
+Revises: e3a95c6d0b47
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.matching import blocking_keys
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c6a3d8b254'
+down_revision = 'e3a95c6d0b47'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    block_keys = op.create_table('client_block_key',
+        sa.Column('key', sa.String(length=40), nullable=False),
+        sa.Column('client_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['client_id'], ['client.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('key', 'client_id')
+    )
+    with op.batch_alter_table('client_block_key', schema=None) as batch_op:
+        batch_op.create_index('ix_client_block_key_client_id', ['client_id'], unique=False)
+
+    bind = op.get_bind()
+    client = sa.table('client', sa.column('id'), sa.column('first_name'), sa.column('last_name'),
+                      sa.column('date_of_birth', sa.Date))
+    after = 0
+    while True:
+        rows = bind.execute(
+            sa.select(client.c.id, client.c.first_name, client.c.last_name, client.c.date_of_birth)
+            .where(client.c.id > after).order_by(client.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        keys = [{'key': key, 'client_id': row.id}
+                for row in rows for key in blocking_keys(row.first_name, row.last_name, row.date_of_birth)]
+        if keys:
+            op.bulk_insert(block_keys, keys)
+        after = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('client_block_key', schema=None) as batch_op:
+        batch_op.drop_index('ix_client_block_key_client_id')
+
+    op.drop_table('client_block_key')
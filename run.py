@@ -16,6 +16,10 @@ def make_shell_context():
 
 if __name__ == '__main__':
     with app.app_context():
+        # Local development server: create any missing tables. Deployed
+        # instances get their schema from 'flask db upgrade' instead.
+        db.create_all()
+        
         # Create a default admin user if none exists
         if not User.query.filter_by(username='admin').first():
             UserService.create_user(
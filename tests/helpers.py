@@ -0,0 +1,63 @@
+"""Shared test utilities.
+
+QueryCountMixin guards against N+1 regressions: wrap a service call or a
+request in assertMaxQueries and the test fails if it runs more SQL
+statements than the bound. Pick bounds on data with several rows, so a
+per-row lazy load (such as to_dict() touching client.programs for every
+client of a page) pushes the count past the limit.
+"""
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event
+
+
+class QueryRecorder:
+    """Collects the SQL statements executed on a set of engines while active"""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'after_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, 'after_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def app_engines(app=None):
+    """The primary engines of app (default: the current app) and its replica, if any"""
+    from app import db
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        engines = list(db.engines.values())
+    if app.extensions.get('replica_engine') is not None:
+        engines.append(app.extensions['replica_engine'])
+    return engines
+
+
+def count_queries(app=None):
+    """Context manager recording the statements run on app's engines"""
+    return QueryRecorder(app_engines(app))
+
+
+class QueryCountMixin:
+    """assertMaxQueries for unittest.TestCase subclasses running inside an app context"""
+
+    @contextmanager
+    def assertMaxQueries(self, limit, app=None):
+        with count_queries(app) as recorder:
+            yield recorder
+        if recorder.count > limit:
+            statements = '\n'.join(f'  {n}. {statement}' for n, statement in enumerate(recorder.statements, 1))
+            self.fail(f'{recorder.count} queries executed, expected at most {limit}:\n{statements}')
@@ -0,0 +1,96 @@
+import tempfile
+import time
+import unittest
+from app import create_app, db, cache
+from config import TestConfig
+from app.cache import CacheStore, FileBackend, MemoryBackend
+from app.services import ProgramService
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+    
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+    
+    def test_get_or_set_counts_hits_and_misses(self):
+        store = CacheStore(MemoryBackend())
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+        
+        self.assertEqual(store.get_or_set('ns', 'key', loader), 'value')
+        self.assertEqual(store.get_or_set('ns', 'key', loader), 'value')
+        self.assertEqual(len(calls), 1)
+        
+        store.invalidate('ns')
+        store.get_or_set('ns', 'key', loader)
+        self.assertEqual(len(calls), 2)
+        
+        stats = store.stats()['namespaces']['ns']
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (1, 2, 1))
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3, places=3)
+    
+    def test_version_replaces_entry(self):
+        store = CacheStore(MemoryBackend())
+        self.assertEqual(store.get_or_set('ns', 'key', lambda: 'v1', version=1), 'v1')
+        self.assertEqual(store.get_or_set('ns', 'key', lambda: 'unused', version=1), 'v1')
+        self.assertEqual(store.get_or_set('ns', 'key', lambda: 'v2', version=2), 'v2')
+        self.assertEqual(store.stats()['entries'], 1)
+    
+    def test_eviction_at_capacity(self):
+        store = CacheStore(MemoryBackend(), max_entries=2)
+        store.get_or_set('ns', 'a', lambda: 'a')
+        store.get_or_set('ns', 'b', lambda: 'b')
+        
+        # Replacing an entry evicts nothing else
+        store.get_or_set('ns', 'a', lambda: 'a2', version=2)
+        self.assertEqual(store.get_or_set('ns', 'b', lambda: 'unused'), 'b')
+        
+        # Expired entries go first, then the oldest live one
+        store.get_or_set('ns', 'c', lambda: 'c', ttl=0.01)
+        time.sleep(0.02)
+        store.get_or_set('ns', 'd', lambda: 'd')
+        self.assertEqual(store.get_or_set('ns', 'a', lambda: 'unused', version=2), 'a2')
+        self.assertEqual(store.stats()['entries'], 2)
+        store.get_or_set('ns', 'e', lambda: 'e')
+        self.assertEqual(store.get_or_set('ns', 'd', lambda: 'unused'), 'd')
+    
+    def test_ttl_expiry(self):
+        store = CacheStore(MemoryBackend(), default_ttl=0.01)
+        store.get_or_set('ns', 'key', lambda: 'old')
+        time.sleep(0.02)
+        self.assertEqual(store.get_or_set('ns', 'key', lambda: 'new'), 'new')
+    
+    def test_file_backend_shares_invalidation_between_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker_a = CacheStore(FileBackend(directory))
+            worker_b = CacheStore(FileBackend(directory))
+            worker_a.get_or_set('ns', 'key', lambda: 'a1')
+            worker_b.get_or_set('ns', 'key', lambda: 'b1')
+            
+            # Invalidating in one worker orphans the other worker's entry too
+            worker_a.invalidate('ns')
+            self.assertEqual(worker_b.get_or_set('ns', 'key', lambda: 'b2'), 'b2')
+    
+    def test_program_catalog_is_cached_and_invalidated(self):
+        program = ProgramService.create_program(name='TB Program')
+        self.assertEqual([p['name'] for p in ProgramService.get_program_catalog()], ['TB Program'])
+        self.assertEqual(ProgramService.get_program_data(program.id)['name'], 'TB Program')
+        self.assertEqual(cache.stats()['namespaces']['programs']['misses'], 2)
+        
+        ProgramService.get_program_catalog()
+        self.assertEqual(cache.stats()['namespaces']['programs']['hits'], 1)
+        
+        ProgramService.update_program(program.id, name='TB Care')
+        ProgramService.create_program(name='HIV Program')
+        self.assertEqual([p['name'] for p in ProgramService.get_program_catalog()],
+                         ['TB Care', 'HIV Program'])
+        self.assertEqual(ProgramService.get_program_data(program.id)['name'], 'TB Care')
+
+if __name__ == '__main__':
+    unittest.main()
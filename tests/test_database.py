@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import date
+from app import create_app, db
+from config import TestConfig
+from app.database import pool_options, with_lock_retry
+from app.models import Client
+from app.replica import replica_engine
+from app.services import ClientService, UserService
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert, text
+from sqlalchemy.exc import OperationalError
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(self.directory.name, 'test.db')}"
+            SQLITE_RETRY_BACKOFF = 0.001
+
+        self.config_class = FileConfig
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_app(self, **overrides):
+        config_class = type('Config', (self.config_class,), overrides)
+        app = create_app(config_class)
+        with app.app_context():
+            db.create_all()
+        return app
+
+    def test_pragmas_applied_to_connections(self):
+        app = self.make_app()
+        with app.app_context():
+            self.assertEqual(db.session.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+            self.assertEqual(db.session.execute(text('PRAGMA synchronous')).scalar(), 1)
+            self.assertEqual(db.session.execute(text('PRAGMA busy_timeout')).scalar(), 5000)
+
+    def test_template_cache_directories_are_private(self):
+        # Jinja's own per-user directory by default, never a shared, predictable one
+        app = self.make_app(TEMPLATE_CACHE=True)
+        directory = app.jinja_env.bytecode_cache.directory
+        self.assertEqual(os.stat(directory).st_uid, os.getuid())
+        self.assertEqual(os.stat(directory).st_mode & 0o077, 0)
+        
+        configured = os.path.join(self.directory.name, 'templates')
+        app = self.make_app(TEMPLATE_CACHE=True, TEMPLATE_CACHE_DIR=configured)
+        self.assertEqual(app.jinja_env.bytecode_cache.directory, configured)
+        self.assertEqual(os.stat(configured).st_mode & 0o077, 0)
+        self.assertEqual(app.test_client().get('/login').status_code, 200)
+        self.assertTrue(os.listdir(configured))
+    
+    def test_lock_errors_are_retried(self):
+        app = self.make_app()
+        attempts = []
+
+        def unit_of_work():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OperationalError('INSERT', {}, sqlite3.OperationalError('database is locked'))
+            return 'done'
+
+        with app.app_context():
+            self.assertEqual(with_lock_retry(unit_of_work), 'done')
+        self.assertEqual(len(attempts), 3)
+
+        def fails():
+            raise OperationalError('INSERT', {}, sqlite3.OperationalError('no such table: x'))
+
+        with app.app_context():
+            with self.assertRaises(OperationalError):
+                with_lock_retry(fails)
+
+    def test_write_queue_group_commits_concurrent_writes(self):
+        app = self.make_app(SQLITE_WRITE_QUEUE=True, SQLITE_WRITE_QUEUE_MAX_WAIT=0.05)
+        write_queue = app.extensions['write_queue']
+        created = []
+
+        def register(n):
+            with app.app_context():
+                client = ClientService.create_client(f'First{n}', 'Queued', '1990-01-01', 'Female')
+                created.append(client.id)
+
+        threads = [threading.Thread(target=register, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(created), 20)
+        self.assertLess(write_queue.commits, 20)
+        with app.app_context():
+            self.assertEqual(Client.query.filter_by(last_name='Queued').count(), 20)
+
+            # Jobs that fail are reported to their caller without sinking the group
+            self.assertIsNone(ClientService.update_client(999999, first_name='Nobody'))
+            client = ClientService.update_client(created[0], first_name='Renamed')
+            self.assertEqual(client.first_name, 'Renamed')
+
+    def test_pool_options_only_for_server_databases(self):
+        app = self.make_app()
+        self.assertEqual(pool_options('sqlite:///health_system.db', app.config), {})
+        options = pool_options('postgresql://db/health', app.config)
+        self.assertEqual(options['pool_size'], app.config['DB_POOL_SIZE'])
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_reads_routed_to_replica(self):
+        replica_url = f"sqlite:///{os.path.join(self.directory.name, 'replica.db')}"
+        app = self.make_app(REPLICA_DATABASE_URL=replica_url)
+        http = app.test_client()
+        with app.app_context():
+            db.metadata.create_all(replica_engine())
+            user = UserService.create_user('desk', 'desk@example.com', 'password123')
+            token = create_access_token(identity=user.id)
+            ClientService.create_client('Primary', 'Only', '1990-01-01', 'Female')
+            with replica_engine().begin() as connection:
+                connection.execute(insert(Client).values(
+                    first_name='Replica', last_name='Only', date_of_birth=date(1990, 1, 1), gender='Male'
+                ))
+        headers = {'Authorization': f'Bearer {token}'}
+
+        response = http.get('/api/clients', headers=headers)
+        self.assertEqual([c['first_name'] for c in response.get_json()], ['Replica'])
+
+        # Writes go to the primary even though the replica is configured
+        response = http.post('/api/clients', headers=headers, json={
+            'first_name': 'Posted', 'last_name': 'Only', 'date_of_birth': '1991-02-03', 'gender': 'Male'
+        })
+        self.assertEqual(response.status_code, 201)
+        with app.app_context():
+            self.assertEqual(sorted(c.first_name for c in Client.query.all()), ['Posted', 'Primary'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import io
+import sqlite3
+import unittest
+from unittest import mock
+from datetime import date
+from app import create_app, db
+from config import TestConfig
+from app.matching import ClientRecord, blocking_keys, jaro_winkler, similarity, soundex
+from app.models import client_block_keys
+from app.services import UserService, ClientService, DeduplicationService, ImportService
+from flask_jwt_extended import create_access_token
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from tests.helpers import QueryCountMixin
+
+class MatchingTestCase(unittest.TestCase):
+    def test_soundex(self):
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('Tymczak'), 'T522')
+        self.assertEqual(soundex('Pfister'), 'P236')
+        self.assertEqual(soundex('Lee'), 'L000')
+        self.assertEqual(soundex("O'Neill-Kamau"), soundex('ONeillKamau'))
+        self.assertEqual(soundex('  '), '')
+
+    def test_jaro_winkler(self):
+        self.assertAlmostEqual(jaro_winkler('martha', 'marhta'), 0.961, places=3)
+        self.assertAlmostEqual(jaro_winkler('dixon', 'dicksonx'), 0.813, places=3)
+        self.assertEqual(jaro_winkler('otieno', 'otieno'), 1.0)
+        self.assertEqual(jaro_winkler('', 'otieno'), 0.0)
+
+    def test_blocking_keys_and_similarity(self):
+        keys = blocking_keys('Brian', 'Otieno', date(1988, 7, 21))
+        self.assertEqual(keys, {'B650:1988-07-21', 'O350:1988-07-21', 'B650O350:1988'})
+        # Swapped names share the name keys
+        self.assertTrue(keys & blocking_keys('Otieno', 'Brian', date(1988, 7, 21)))
+        self.assertEqual(blocking_keys('Brian', 'Otieno', None), set())
+
+        brian = ClientRecord(1, 'Brian', 'Otieno', date(1988, 7, 21), 'Male', '0712 345 678')
+        self.assertGreater(similarity(brian, brian._replace(first_name='Brayan')), 0.9)
+        self.assertGreater(similarity(brian, brian._replace(first_name='Otieno', last_name='Brian')), 0.9)
+        self.assertGreater(similarity(brian, brian._replace(date_of_birth=date(1988, 7, 12))), 0.9)
+        self.assertLess(similarity(brian, brian._replace(last_name='Kamau')), 0.8)
+        self.assertLess(similarity(brian, brian._replace(first_name='Mary', gender='Female')), 0.8)
+
+class DeduplicationServiceTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.brian = ClientService.create_client('Brian', 'Otieno', date(1988, 7, 21), 'Male',
+                                                 contact_number='0712 345 678')
+        self.grace = ClientService.create_client('Grace', 'Wanjiru', date(1993, 11, 2), 'Female')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def keys_of(self, client_id):
+        return set(db.session.execute(
+            select(client_block_keys.c.key).where(client_block_keys.c.client_id == client_id)
+        ).scalars())
+
+    def test_block_index_follows_writes(self):
+        self.assertEqual(self.keys_of(self.brian.id), blocking_keys('Brian', 'Otieno', date(1988, 7, 21)))
+
+        ClientService.update_client(self.grace.id, last_name='Kamau')
+        self.assertEqual(self.keys_of(self.grace.id), blocking_keys('Grace', 'Kamau', date(1993, 11, 2)))
+
+        report = ImportService.import_clients(ImportService.read_rows(io.StringIO(
+            '{"first_name": "Brayan", "last_name": "Otieno", "date_of_birth": "1988-07-21", "gender": "Male"}\n'
+        ), 'ndjson'))
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(len(DeduplicationService.get_client_duplicates(self.brian.id)), 1)
+
+        # The rebuild re-keys clients in place and drops keys of clients that no longer exist
+        db.session.execute(client_block_keys.insert(), [{'key': 'X000:1900-01-01', 'client_id': self.grace.id},
+                                                        {'key': 'X000:1900-01-01', 'client_id': 999}])
+        db.session.commit()
+        self.assertEqual(DeduplicationService.rebuild_block_index(batch_size=2), 3)
+        self.assertEqual(self.keys_of(self.grace.id), blocking_keys('Grace', 'Kamau', date(1993, 11, 2)))
+        self.assertEqual(self.keys_of(999), set())
+
+    def test_possible_duplicates_on_insert(self):
+        with self.assertMaxQueries(1):
+            matches = DeduplicationService.find_possible_duplicates('Brayan', 'Otieno', '1988-07-21', 'Male')
+        self.assertEqual([match['id'] for match in matches], [self.brian.id])
+        self.assertGreaterEqual(matches[0]['score'], self.app.config['DEDUP_THRESHOLD'])
+
+        self.assertEqual(DeduplicationService.find_possible_duplicates('Brian', 'Kamau', '1988-07-21', 'Male'), [])
+        self.assertEqual(DeduplicationService.get_client_duplicates(self.grace.id), [])
+        self.assertIsNone(DeduplicationService.get_client_duplicates(999))
+
+        user = UserService.create_user('registrar', 'registrar@example.com', 'password123')
+        headers = {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+        response = self.client.post('/api/clients', headers=headers, json={
+            'first_name': 'Otieno', 'last_name': 'Brian', 'date_of_birth': '1988-07-21', 'gender': 'Male'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([match['id'] for match in response.get_json()['possible_duplicates']], [self.brian.id])
+
+        response = self.client.get(f'/api/clients/{self.brian.id}/duplicates', headers=headers)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertEqual(self.client.get('/api/clients/999/duplicates', headers=headers).status_code, 404)
+
+    def test_rebuild_retries_a_locked_batch(self):
+        db.session.execute(client_block_keys.delete())
+        db.session.commit()
+        commit, calls = db.session.commit, []
+        
+        def locked_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('COMMIT', {}, sqlite3.OperationalError('database is locked'))
+            commit()
+        
+        with mock.patch.object(db.session, 'commit', locked_once):
+            self.assertEqual(DeduplicationService.rebuild_block_index(), 2)
+        # The retry re-ran the batch's writes, not just an empty commit
+        self.assertEqual(self.keys_of(self.brian.id), blocking_keys('Brian', 'Otieno', date(1988, 7, 21)))
+        self.assertEqual(self.keys_of(self.grace.id), blocking_keys('Grace', 'Wanjiru', date(1993, 11, 2)))
+    
+    def test_candidates_prefer_full_date_of_birth_keys(self):
+        # Same names and birth year as the probe, born on other days, and registered first
+        for day in (1, 2, 3):
+            ClientService.create_client('Moses', 'Achieng', date(1979, 1, day), 'Male')
+        # Shares only the M220 date-of-birth key, whose block is read last
+        twin = ClientService.create_client('Moses', 'Ochieng', date(1979, 5, 5), 'Male')
+        twin_id = twin.id
+        self.app.config['DEDUP_MAX_CANDIDATES'] = 2
+        
+        with self.assertMaxQueries(1):
+            matches = DeduplicationService.find_possible_duplicates('Moses', 'Achieng', '1979-05-05', 'Male')
+        self.assertEqual(matches[0]['id'], twin_id)
+    
+    def test_batch_pairs_and_clusters(self):
+        ClientService.create_client('Brayan', 'Otieno', date(1988, 7, 21), 'Male')
+        ClientService.create_client('Otieno', 'Brian', date(1988, 7, 12), 'Male')
+        grace = ClientService.create_client('Grace', 'Wanjiru', date(1993, 11, 2), 'Female')
+        ClientService.create_client('Brian', 'Kamau', date(1988, 7, 21), 'Male')
+
+        report = DeduplicationService.find_duplicate_pairs()
+        self.assertEqual(len(report['clusters']), 2)
+        self.assertEqual(report['clusters'][0][0], self.brian.id)
+        self.assertEqual(len(report['clusters'][0]), 3)
+        self.assertEqual(report['clusters'][1], [self.grace.id, grace.id])
+        self.assertEqual(report['oversized_blocks'], 0)
+
+        # Blocks over the size limit are skipped, not compared
+        report = DeduplicationService.find_duplicate_pairs(max_block=1)
+        self.assertEqual((report['comparisons'], report['pairs']), (0, []))
+        self.assertGreater(report['oversized_blocks'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import threading
+import unittest
+from datetime import date
+from app import create_app, db, metrics
+from config import TestConfig
+from app.metrics import Counter, Histogram, MetricsRegistry
+from app.services import UserService, ClientService, ProgramService, EnrollmentService
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        UserService.create_user('metrics', 'metrics@example.com', 'password123')
+    
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+    
+    def test_counter_sums_thread_shards(self):
+        counter = Counter('jobs_total', 'Jobs', ('kind',))
+        
+        def work():
+            for _ in range(1000):
+                counter.inc(kind='a')
+        
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(5, kind='b')
+        self.assertEqual(counter.value(kind='a'), 8000)
+        self.assertEqual(counter.render()[2:], ['jobs_total{kind="a"} 8000', 'jobs_total{kind="b"} 5'])
+    
+    def test_exited_thread_shards_are_retired(self):
+        counter = Counter('jobs_total', 'Jobs', ('kind',))
+        histogram = Histogram('job_seconds', 'Job time', buckets=(1.0,))
+        
+        def work():
+            counter.inc(kind='a')
+            histogram.observe(0.5)
+        
+        for _ in range(50):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        # Only the live threads keep a shard; the rest are folded into one total
+        self.assertLessEqual(len(counter._shards), 1)
+        self.assertLessEqual(len(histogram._shards), 1)
+        self.assertEqual(counter.value(kind='a'), 50)
+        self.assertEqual(histogram.values()[()], ([50, 0], 25.0))
+        counter.inc(kind='a')
+        self.assertEqual(counter.value(kind='a'), 51)
+    
+    def test_histogram_rendering(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value, route='x')
+        text = registry.render()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{route="x",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="x",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="x",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum{route="x"} 4.25', text)
+        self.assertIn('latency_seconds_count{route="x"} 4', text)
+    
+    def test_metrics_endpoint(self):
+        self.client.post('/api/login', json={'username': 'metrics', 'password': 'wrong'})
+        self.client.post('/api/login', json={'username': 'metrics', 'password': 'password123'})
+        program = ProgramService.create_program(name='TB')
+        client = ClientService.create_client('Metric', 'Client', date(1990, 1, 1), 'Female')
+        EnrollmentService.enroll_client(client.id, program.id)
+        EnrollmentService.unenroll_client(client.id, program.id)
+        EnrollmentService.bulk_enroll(program.id, client_ids=[client.id])
+        ProgramService.get_program_catalog()
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('login_attempts_total{channel="api",result="failure"} 1', text)
+        self.assertIn('login_attempts_total{channel="api",result="success"} 1', text)
+        self.assertIn('enrollment_changes_total{operation="enroll",mode="single"} 1', text)
+        self.assertIn('enrollment_changes_total{operation="unenroll",mode="single"} 1', text)
+        self.assertIn('enrollment_changes_total{operation="enroll",mode="bulk"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="api.api_login",method="POST"} 2', text)
+        self.assertIn('http_requests_total{endpoint="api.api_login",method="POST",status="401"} 1', text)
+        self.assertIn('cache_requests_total{namespace="programs",result="miss"}', text)
+        self.assertEqual(metrics.registry.metrics['http_request_duration_seconds'].count(
+            endpoint='api.api_login', method='POST'), 2)
+
+if __name__ == '__main__':
+    unittest.main()
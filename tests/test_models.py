@@ -1,11 +1,16 @@
+import os
+import tempfile
 import unittest
 from datetime import date
-from app import create_app, db
-from app.models import User, Client, HealthProgram
+from app import create_app, db, init_migrations
+from config import TestConfig
+from app.models import User, Client, HealthProgram, enrollments
+from app.services import EnrollmentService, client_filter_clauses, client_filter_parts
+from sqlalchemy import select
 
 class ModelsTestCase(unittest.TestCase):
     def setUp(self):
-        self.app = create_app()
+        self.app = create_app(TestConfig)
         self.app.config['TESTING'] = True
         self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.app_context = self.app.app_context()
@@ -79,5 +84,75 @@ class ModelsTestCase(unittest.TestCase):
         self.assertEqual(program1.clients.count(), 1)
         self.assertEqual(program2.clients.count(), 1)
 
+    def query_plan(self, statement):
+        """SQLite's EXPLAIN QUERY PLAN output for statement, as one string"""
+        compiled = statement.compile(dialect=db.engine.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+        return ' | '.join(row[-1] for row in rows)
+    
+    def test_hot_queries_use_indexes(self):
+        program = HealthProgram(name='TB Program')
+        db.session.add(program)
+        db.session.commit()
+        
+        roster = program.clients.statement
+        self.assertIn('ix_enrollments_program_id_status', self.query_plan(roster))
+        
+        active = select(enrollments.c.client_id).where(
+            enrollments.c.program_id == program.id, enrollments.c.status == 'Active')
+        self.assertIn('ix_enrollments_program_id_status', self.query_plan(active))
+        
+        # A page of a program's defaulters is a range scan in client order, with no sort
+        defaulters_page = (select(enrollments.c.client_id)
+                           .where(enrollments.c.program_id == program.id, enrollments.c.status == 'Defaulted',
+                                  enrollments.c.client_id > 100)
+                           .order_by(enrollments.c.client_id).limit(50))
+        plan = self.query_plan(defaulters_page)
+        self.assertIn('ix_enrollments_program_id_status_client_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        
+        defaulters = select(enrollments.c.client_id).where(enrollments.c.status == 'Defaulted')
+        self.assertIn('ix_enrollments_status', self.query_plan(defaulters))
+        
+        by_name = select(Client.id).where(Client.last_name == 'Otieno', Client.first_name == 'Brian')
+        self.assertIn('ix_client_last_name_first_name', self.query_plan(by_name))
+        
+        under_five = select(Client.id).where(*client_filter_clauses({'max_age': 4}))
+        self.assertIn('ix_client_date_of_birth', self.query_plan(under_five))
+        
+        girls = select(Client.id).where(*client_filter_clauses({'gender': 'Female', 'min_age': 15, 'max_age': 49}))
+        self.assertIn('ix_client_gender_date_of_birth', self.query_plan(girls))
+        
+        recently_enrolled = select(enrollments.c.client_id).where(
+            *client_filter_parts({'enrolled_after': '2024-01-01'})[1])
+        self.assertIn('ix_enrollments_enrollment_date_program_id', self.query_plan(recently_enrolled))
+
+        newest = select(Client.id).order_by(Client.created_at.desc()).limit(20)
+        self.assertIn('ix_client_created_at', self.query_plan(newest))
+
+    def test_migrations_match_models(self):
+        from alembic.autogenerate import compare_metadata
+        from alembic.migration import MigrationContext
+        from flask_migrate import check, upgrade
+        
+        with tempfile.TemporaryDirectory() as directory:
+            class MigratedConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'migrated.db')}"
+                AUTO_CREATE_SCHEMA = False
+            
+            app = create_app(MigratedConfig)
+            init_migrations(app)
+            with app.app_context():
+                upgrade(directory=os.path.join(os.path.dirname(__file__), '..', 'migrations'))
+                with db.engine.connect() as connection:
+                    context = MigrationContext.configure(connection, opts={
+                        'include_object': lambda obj, name, type_, *args: not name.startswith(('client_fts', 'client_ngram_fts'))
+                    })
+                    self.assertEqual(compare_metadata(context, db.metadata), [])
+                # 'flask db check' uses the filters in migrations/env.py; it exits on any difference
+                check(directory=os.path.join(os.path.dirname(__file__), '..', 'migrations'))
+                db.engine.dispose()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
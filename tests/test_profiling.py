@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import date
+from app import create_app, db
+from config import TestConfig
+from app.models import Client
+from app.services import UserService, ClientService, ProgramService, EnrollmentService
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from flask_jwt_extended import create_access_token
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        class ProfilingConfig(TestConfig):
+            PROFILING_ENABLED = True
+            PROFILE_SAMPLER_ENABLED = True
+            PROFILE_SAMPLE_INTERVAL = 0.001
+            PROFILE_SLOW_REQUEST_MS = 30
+            PROFILE_REPEATED_QUERY_WARNING = 3
+            PROFILE_DIR = self.directory.name
+
+        self.app = create_app(ProfilingConfig)
+
+        # Deliberately N+1: every client's programs are lazy loaded one by one
+        @self.app.route('/n-plus-one')
+        def n_plus_one():
+            return jsonify([client.to_dict() for client in Client.query.all()])
+
+        @self.app.route('/slow')
+        def slow():
+            time.sleep(0.06)
+            return 'done'
+
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        user = UserService.create_user('profiler', 'profiler@example.com', 'password123')
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+        program = ProgramService.create_program(name='TB')
+        for n in range(4):
+            client = ClientService.create_client(f'Client{n}', 'Profiled', date(1990, 1, 1), 'Female')
+            EnrollmentService.enroll_client(client.id, program.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def test_server_timing_and_stats(self):
+        response = self.client.get('/api/clients', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        timings = response.headers.getlist('Server-Timing')
+        self.assertTrue(any(timing.startswith('db;dur=') for timing in timings))
+        self.assertTrue(any(timing.startswith('total;dur=') for timing in timings))
+
+        stats = self.client.get('/api/profiling', headers=self.headers).get_json()
+        record = [r for r in stats['recent'] if r['endpoint'] == 'api.api_get_clients'][0]
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['orm_loads'], 6)  # the token's user, four clients and their program
+        self.assertEqual(record['max_repeats'], 1)
+        self.assertEqual(stats['endpoints']['api.api_get_clients']['requests'], 1)
+
+    def test_rows_counted_for_listing(self):
+        self.client.get('/api/clients', headers=self.headers)
+        record = self.app.extensions['profiler'].recent[-1]
+        # The token's user, the page of four clients, the catalog version,
+        # then the four clients again with their enrollment rows
+        self.assertEqual(record['rows'], 14)
+
+    def test_failed_statement_start_discarded(self):
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            with self.assertRaises(OperationalError):
+                db.session.execute(text('SELECT * FROM missing_table'))
+            self.assertEqual(db.session.connection().info['profile_query_start'], {})
+            db.session.rollback()
+
+    def test_repeated_statements_flagged(self):
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/n-plus-one')
+        record = self.app.extensions['profiler'].recent[-1]
+        self.assertEqual(record['max_repeats'], 4)
+        self.assertIn('possible N+1', logs.output[0])
+
+    def test_slow_request_stacks_dumped(self):
+        with self.assertLogs(self.app.logger, 'WARNING'):
+            self.client.get('/slow')
+        dumps = os.listdir(self.directory.name)
+        self.assertEqual(len(dumps), 1)
+        with open(os.path.join(self.directory.name, dumps[0])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any(':slow:' in line for line in lines))
+
+if __name__ == '__main__':
+    unittest.main()
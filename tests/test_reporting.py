@@ -0,0 +1,87 @@
+import unittest
+from datetime import date, datetime
+from app import create_app, db
+from config import TestConfig
+from app import reporting
+from app.models import Client, HealthProgram, enrollments
+from sqlalchemy import insert
+
+@unittest.skipIf(reporting.np is None, 'NumPy is not installed')
+class ReportingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.execute(insert(HealthProgram), [
+            {'id': 1, 'name': 'TB'}, {'id': 2, 'name': 'HIV'}, {'id': 3, 'name': 'Malaria'}
+        ])
+        db.session.execute(insert(Client), [
+            {'id': 1, 'first_name': 'A', 'last_name': 'A', 'date_of_birth': date(2010, 6, 13), 'gender': 'Female'},
+            {'id': 2, 'first_name': 'B', 'last_name': 'B', 'date_of_birth': date(1980, 6, 12), 'gender': 'Male'},
+            {'id': 3, 'first_name': 'C', 'last_name': 'C', 'date_of_birth': date(1950, 2, 28), 'gender': 'Female'},
+            {'id': 4, 'first_name': 'D', 'last_name': 'D', 'date_of_birth': date(2000, 1, 1), 'gender': 'Male'},
+        ])
+        db.session.execute(insert(enrollments), [
+            {'client_id': 1, 'program_id': 1, 'enrollment_date': datetime(2024, 1, 5), 'status': 'Active'},
+            {'client_id': 1, 'program_id': 2, 'enrollment_date': datetime(2024, 3, 1), 'status': 'Active'},
+            {'client_id': 2, 'program_id': 1, 'enrollment_date': datetime(2024, 1, 20), 'status': 'Completed'},
+            {'client_id': 3, 'program_id': 1, 'enrollment_date': datetime(2024, 2, 2), 'status': 'Active'},
+            {'client_id': 3, 'program_id': 2, 'enrollment_date': datetime(2024, 2, 9), 'status': 'Active'},
+            {'client_id': 3, 'program_id': 3, 'enrollment_date': datetime(2024, 4, 1), 'status': 'Active'},
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_extracts(self):
+        clients = reporting.load_clients(batch_size=3)
+        self.assertEqual(clients.ids.tolist(), [1, 2, 3, 4])
+        self.assertEqual(str(clients.birth_dates[2]), '1950-02-28')
+        self.assertEqual([clients.genders[code] for code in clients.gender_codes], ['Female', 'Male', 'Female', 'Male'])
+
+        extract = reporting.load_enrollments(batch_size=4)
+        self.assertEqual(extract.client_ids.tolist(), [1, 1, 2, 3, 3, 3])
+        self.assertEqual(str(extract.enrollment_dates[2]), '2024-01-20')
+        self.assertEqual(extract.statuses[extract.status_codes[2]], 'Completed')
+
+    def test_ages_and_distribution(self):
+        clients = reporting.load_clients()
+        # Client 1 turns 14 the day after, client 2 turns 44 on the day
+        self.assertEqual(reporting.ages(clients.birth_dates, date(2024, 6, 12)).tolist(), [13, 44, 74, 24])
+
+        distribution = reporting.age_distribution(clients, date(2024, 6, 12))
+        self.assertEqual(distribution['bands'], ['0-17', '18-34', '35-49', '50-64', '65+'])
+        counts = dict(zip(distribution['genders'], distribution['counts']))
+        self.assertEqual(counts['Female'], [1, 0, 0, 0, 1])
+        self.assertEqual(counts['Male'], [0, 1, 1, 0, 0])
+        self.assertEqual(distribution['totals'], [1, 1, 1, 0, 1])
+
+    def test_cohorts(self):
+        table = reporting.cohort_table(reporting.load_enrollments(), horizon=3)
+        self.assertEqual(table['cohorts'], ['2024-01', '2024-02'])
+        self.assertEqual(table['sizes'], [2, 1])
+        # Client 1 enrolled again two months in; client 3 again two months in
+        self.assertEqual(table['retained'], [[2, 0, 1], [1, 0, 1]])
+        self.assertEqual(table['still_active'], [1, 1])
+
+    def test_co_enrollment_matrix(self):
+        extract = reporting.load_enrollments()
+        matrix = reporting.co_enrollment_matrix(extract)
+        self.assertEqual(matrix['program_ids'], [1, 2, 3])
+        self.assertEqual(matrix['counts'], [[2, 2, 1], [2, 2, 1], [1, 1, 1]])
+
+        everything = reporting.co_enrollment_matrix(extract, active_only=False)
+        self.assertEqual(everything['counts'][0][0], 3)
+
+    def test_quarterly_report(self):
+        report = reporting.quarterly_report(date(2024, 6, 30))
+        self.assertEqual((report['clients'], report['enrollments']), (4, 6))
+        self.assertEqual(report['as_of'], '2024-06-30')
+
+if __name__ == '__main__':
+    unittest.main()
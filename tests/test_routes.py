@@ -1,13 +1,17 @@
+import io
 import unittest
 import json
 from datetime import date
-from app import create_app, db
+from app import create_app, db, cache
+from config import TestConfig
 from app.models import User, Client, HealthProgram
-from app.services import UserService, ClientService, ProgramService
+from app.services import UserService, ClientService, ProgramService, EnrollmentService
+from app.utils import encode_cursor
+from tests.helpers import QueryCountMixin
 
-class RoutesTestCase(unittest.TestCase):
+class RoutesTestCase(QueryCountMixin, unittest.TestCase):
     def setUp(self):
-        self.app = create_app()
+        self.app = create_app(TestConfig)
         self.app.config['TESTING'] = True
         self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.app.config['WTF_CSRF_ENABLED'] = False
@@ -81,9 +85,10 @@ class RoutesTestCase(unittest.TestCase):
     
     def test_api_get_clients(self):
         token = self.get_api_token()
-        response = self.client.get('/api/clients', headers={
-            'Authorization': f'Bearer {token}'
-        })
+        with self.assertMaxQueries(5):
+            response = self.client.get('/api/clients', headers={
+                'Authorization': f'Bearer {token}'
+            })
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertIsInstance(data, list)
@@ -91,9 +96,10 @@ class RoutesTestCase(unittest.TestCase):
     
     def test_api_get_client(self):
         token = self.get_api_token()
-        response = self.client.get(f'/api/clients/{self.test_client.id}', headers={
-            'Authorization': f'Bearer {token}'
-        })
+        with self.assertMaxQueries(3):
+            response = self.client.get(f'/api/clients/{self.test_client.id}', headers={
+                'Authorization': f'Bearer {token}'
+            })
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(data['first_name'], 'Test')
@@ -177,13 +183,361 @@ class RoutesTestCase(unittest.TestCase):
     
     def test_api_search_clients(self):
         token = self.get_api_token()
-        response = self.client.get('/api/clients/search?query=Test', headers={
-            'Authorization': f'Bearer {token}'
-        })
+        with self.assertMaxQueries(3):
+            response = self.client.get('/api/clients/search?query=Test', headers={
+                'Authorization': f'Bearer {token}'
+            })
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['first_name'], 'Test')
 
+    def test_api_fuzzy_search_clients(self):
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        response = self.client.get('/api/clients/search?query=Klient&fuzzy=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([client['id'] for client in data], [self.test_client.id])
+        self.assertGreaterEqual(data[0]['score'], 0.8)
+        
+        response = self.client.get('/api/clients/search?query=Klient&fuzzy=1&born_after=2000-01-01', headers=headers)
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get('/api/clients/search?query=Klient&fuzzy=1&born_after=soon', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        
+        # The web search falls back to similar names when nothing matches exactly
+        self.login()
+        response = self.client.get('/clients/search?query=Klient')
+        self.assertIn(b'Showing clients with similar names', response.data)
+        self.assertIn(b'Test Client', response.data)
+        
+        # A cut-off list says so and links to a longer one
+        for n in range(3):
+            ClientService.create_client(f'Other{n}', 'Client', date(1991, 1, 1), 'Female')
+        response = self.client.get('/clients/search?query=Client&limit=2')
+        self.assertIn(b'Showing the best 2 matches', response.data)
+        self.assertIn(b'/clients/search?query=Client&amp;limit=4', response.data)
+        response = self.client.get('/clients/search?query=Client&limit=4')
+        self.assertNotIn(b'Showing the best', response.data)
+        self.app.config['MAX_PAGE_SIZE'] = 2
+        response = self.client.get('/clients/search?query=Client&limit=2')
+        self.assertIn(b'Refine the search to see the rest', response.data)
+        self.assertNotIn(b'Show more', response.data)
+        
+        # The API says so in a header
+        for fuzzy in ('0', '1'):
+            response = self.client.get(f'/api/clients/search?query=Client&fuzzy={fuzzy}&limit=2', headers=headers)
+            self.assertEqual(len(response.get_json()), 2)
+            self.assertEqual(response.headers['X-Truncated'], 'true')
+        self.app.config['MAX_PAGE_SIZE'] = 4
+        for fuzzy in ('0', '1'):
+            response = self.client.get(f'/api/clients/search?query=Client&fuzzy={fuzzy}&limit=4', headers=headers)
+            self.assertEqual(len(response.get_json()), 4)
+            self.assertEqual(response.headers['X-Truncated'], 'false')
+
+    def test_suggest_clients(self):
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        response = self.client.get('/api/clients/suggest?prefix=test%20cl', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([client['id'] for client in response.get_json()], [self.test_client.id])
+        response = self.client.get('/api/clients/suggest?prefix=123456', headers=headers)
+        self.assertEqual(response.get_json()[0]['contact_number'], '1234567890')
+        self.assertEqual(self.client.get('/api/clients/suggest?prefix=x', headers=headers).get_json(), [])
+
+        # The search page's typeahead uses the session-authenticated twin
+        self.assertEqual(self.client.get('/clients/suggest?prefix=Te').status_code, 401)
+        self.login()
+        response = self.client.get('/clients/suggest?prefix=Te')
+        self.assertEqual(response.get_json()[0]['last_name'], 'Client')
+        self.assertIn(b'client-suggestions', self.client.get('/clients/search').data)
+
+    def test_api_get_clients_paginated(self):
+        ClientService.create_client(
+            first_name='Second',
+            last_name='Client',
+            date_of_birth=date(1992, 2, 2),
+            gender='Female'
+        )
+        token = self.get_api_token()
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        response = self.client.get('/api/clients?limit=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 1)
+        self.assertIn('rel="next"', response.headers['Link'])
+        
+        # Follow the next link to the last page
+        next_url = response.headers['Link'].split(';')[0].strip('<>')
+        response = self.client.get(next_url, headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['first_name'], 'Second')
+        self.assertNotIn('Link', response.headers)
+        
+        response = self.client.get('/api/clients?cursor=garbage', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        
+        # Well-formed cursors whose values cannot be an id are rejected too
+        for after in ([{}], [[1]], ['x'], [1.5], [True]):
+            for url in ('/api/clients', '/api/programs'):
+                response = self.client.get(f'{url}?cursor={encode_cursor(after)}', headers=headers)
+                self.assertEqual(response.status_code, 400, (url, after))
+                self.assertEqual(json.loads(response.data)['error'], 'Invalid cursor')
+
+    def test_api_get_clients_filtered(self):
+        for name in ('Ann', 'Beth', 'Cleo'):
+            client = ClientService.create_client(name, 'Filtered', date(2000, 1, 1), 'Female')
+            EnrollmentService.enroll_client(client.id, self.program.id)
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+
+        query = f'program={self.program.id}&status=Active&gender=Female&min_age=15&max_age=49&sort=-name&limit=2'
+        response = self.client.get(f'/api/clients?{query}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([client['first_name'] for client in response.get_json()], ['Cleo', 'Beth'])
+        # The next page keeps the filters and the sort
+        next_url = response.headers['Link'].split(';')[0].strip('<>')
+        self.assertIn(f'program={self.program.id}', next_url)
+        self.assertIn('sort=-name', next_url)
+        # One filter probe, the page's versions, then its clients and their programs by ID
+        with self.assertMaxQueries(4):
+            response = self.client.get(next_url, headers=headers)
+        self.assertEqual([client['first_name'] for client in response.get_json()], ['Ann'])
+        self.assertNotIn('Link', response.headers)
+
+        response = self.client.get(f'/api/clients?registered_after={date.today().isoformat()}&gender=Male',
+                                   headers=headers)
+        self.assertEqual([client['first_name'] for client in response.get_json()], ['Test'])
+
+        for query in ('sort=shoe_size', 'status=Active&enrolled_after=yesterday', 'program=TB'):
+            response = self.client.get(f'/api/clients?{query}', headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_api_import_clients(self):
+        token = self.get_api_token()
+        csv_data = (
+            'first_name,last_name,date_of_birth,gender\n'
+            'Imported,One,1990-05-05,Female\n'
+            'Broken,Row,not-a-date,Male\n'
+        )
+        response = self.client.post(
+            '/api/clients/import',
+            data={'file': (io.BytesIO(csv_data.encode()), 'clients.csv', 'text/csv')},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['errors'][0]['row'], 2)
+        self.assertIn('rows_per_second', report)
+        self.assertEqual(Client.query.count(), 2)
+        
+        response = self.client.post(
+            '/api/clients/import?format=ndjson',
+            data=b'{"first_name": "Raw", "last_name": "Body", "date_of_birth": "1970-01-01", "gender": "Male"}\n',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(json.loads(response.data)['imported'], 1)
+        
+        # A spreadsheet saved as Windows-1252 rather than UTF-8
+        response = self.client.post(
+            '/api/clients/import',
+            data={'file': (io.BytesIO('first_name,last_name,date_of_birth,gender\nZoë,Njeri,1990-05-05,Female\n'
+                                      .encode('cp1252')), 'clients.csv', 'text/csv')},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('UTF-8', json.loads(response.data)['error'])
+
+    def test_api_bulk_enrollment(self):
+        token = self.get_api_token()
+        headers = {'Authorization': f'Bearer {token}'}
+        url = f'/api/programs/{self.program.id}/enrollments'
+        
+        response = self.client.post(url, json={'client_ids': [self.test_client.id]}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['enrolled'], 1)
+        
+        response = self.client.post(url, json={'filter': {'gender': 'Male'}}, headers=headers)
+        self.assertEqual(json.loads(response.data)['already_enrolled'], 1)
+        
+        response = self.client.delete(url, json={'client_ids': [self.test_client.id]}, headers=headers)
+        self.assertEqual(json.loads(response.data)['unenrolled'], 1)
+        
+        self.assertEqual(self.client.post(url, json={}, headers=headers).status_code, 400)
+        # A filter without any usable criterion must not target every client
+        response = self.client.post(url, json={'filter': {'gender': None}}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(EnrollmentService.get_program_clients(self.program.id)), 0)
+        self.client.post(url, json={'client_ids': [self.test_client.id]}, headers=headers)
+        response = self.client.delete(url, json={'filter': {'min_age': None, 'gender': ''}}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(EnrollmentService.get_program_clients(self.program.id)), 1)
+        response = self.client.post('/api/programs/999/enrollments', json={'client_ids': [1]}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_enrollment_status(self):
+        other = ClientService.create_client('Other', 'Client', date(1995, 5, 5), 'Female')
+        for client in (self.test_client, other):
+            EnrollmentService.enroll_client(client.id, self.program.id)
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        url = f'/api/clients/{self.test_client.id}/programs/{self.program.id}'
+
+        response = self.client.patch(url, json={'status': 'Defaulted'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.patch(url, json={'status': 'Defaulted'}, headers=headers).status_code, 400)
+        self.assertEqual(self.client.patch(url, json={'status': 'Lost'}, headers=headers).status_code, 400)
+
+        # Defaulters of the program, one page at a time; the next link keeps the status
+        roster = f'/api/programs/{self.program.id}/enrollments'
+        response = self.client.get(f'{roster}?status=Defaulted&limit=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([(e['client']['first_name'], e['status']) for e in data], [('Test', 'Defaulted')])
+        self.assertNotIn('Link', response.headers)
+        response = self.client.get(f'{roster}?limit=1', headers=headers)
+        self.assertIn('status', response.get_json()[0])
+        next_url = response.headers['Link'].split(';')[0].strip('<>')
+        self.assertEqual(self.client.get(next_url, headers=headers).get_json()[0]['client']['first_name'], 'Other')
+        self.assertEqual(self.client.get(f'{roster}?status=Lost', headers=headers).status_code, 400)
+        self.assertEqual(self.client.get('/api/programs/999/enrollments', headers=headers).status_code, 404)
+
+        response = self.client.post(f'{roster}/status', json={'status': 'Withdrawn', 'filter': {'gender': 'Female'}},
+                                    headers=headers)
+        self.assertEqual(response.get_json(), {'program_id': self.program.id, 'status': 'Withdrawn', 'changed': 1})
+        response = self.client.get(f'{roster}?status=Withdrawn', headers=headers)
+        self.assertEqual([e['client_id'] for e in response.get_json()], [other.id])
+        self.assertEqual(self.client.post(f'{roster}/status', json={'status': 'Active'}, headers=headers).status_code, 400)
+        # An empty filter is rejected rather than changing every enrollment in the program
+        response = self.client.post(f'{roster}/status', json={'status': 'Completed', 'filter': {'gender': ''}},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'{roster}?status=Completed', headers=headers)
+        self.assertEqual(response.get_json(), [])
+        response = self.client.post('/api/programs/999/enrollments/status',
+                                    json={'status': 'Active', 'client_ids': [1]}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_export_clients(self):
+        token = self.get_api_token()
+        response = self.client.get('/api/clients/export?format=csv', headers={
+            'Authorization': f'Bearer {token}'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('id,first_name'))
+
+    def test_api_conditional_get(self):
+        token = self.get_api_token()
+        headers = {'Authorization': f'Bearer {token}'}
+        url = f'/api/clients/{self.test_client.id}'
+        
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.last_modified)
+        
+        response = self.client.get(url, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        
+        # Enrolling the client changes its representation and therefore its ETag
+        self.client.post(f'/api/clients/{self.test_client.id}/programs/{self.program.id}', headers=headers)
+        response = self.client.get(url, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['programs']), 1)
+        
+        response = self.client.get('/api/clients', headers=headers)
+        list_etag = response.headers['ETag']
+        response = self.client.get('/api/clients', headers={**headers, 'If-None-Match': list_etag})
+        self.assertEqual(response.status_code, 304)
+        
+        # A program edit is embedded in every client, so the list changes too
+        response = self.client.get('/api/programs', headers=headers)
+        programs_etag = response.headers['ETag']
+        ProgramService.update_program(self.program.id, description='Changed')
+        response = self.client.get('/api/programs', headers={**headers, 'If-None-Match': programs_etag})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/clients', headers={**headers, 'If-None-Match': list_etag})
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get(f'/api/programs/{self.program.id}', headers=headers)
+        response = self.client.get(f'/api/programs/{self.program.id}', headers={
+            **headers, 'If-Modified-Since': response.headers['Last-Modified']
+        })
+        self.assertEqual(response.status_code, 304)
+
+    def test_api_sync(self):
+        token = self.get_api_token()
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        response = self.client.get('/api/sync', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([c['id'] for c in data['clients']], [self.test_client.id])
+        self.assertNotIn('programs', data['clients'][0])
+        
+        self.client.post(f'/api/clients/{self.test_client.id}/programs/{self.program.id}', headers=headers)
+        response = self.client.get(f"/api/sync?since={data['token']}", headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['clients'], [])
+        self.assertEqual(len(data['enrollments']), 1)
+        
+        self.assertEqual(self.client.get('/api/sync?since=abc', headers=headers).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync?since=²', headers=headers).status_code, 400)
+
+    def test_jwt_user_lookup_is_cached(self):
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/programs', headers=headers).status_code, 200)
+        users = cache.stats()['namespaces']['users']
+        self.assertEqual((users['misses'], users['hits']), (1, 2))
+        
+        # Tokens for users that no longer exist are rejected once the entry is gone
+        User.query.filter_by(id=self.user.id).delete()
+        db.session.commit()
+        cache.invalidate(UserService.CACHE_NAMESPACE)
+        self.assertEqual(self.client.get('/api/programs', headers=headers).status_code, 401)
+    
+    def test_dashboard(self):
+        EnrollmentService.enroll_client(self.test_client.id, self.program.id)
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        response = self.client.get('/api/analytics/dashboard', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['totals']['active_enrollments'], 1)
+        self.assertEqual(data['programs'][0]['by_gender'], {'Male': 1})
+        
+        response = self.client.get('/api/analytics/dashboard', headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        self.assertEqual(response.status_code, 304)
+        
+        self.login()
+        response = self.client.get('/')
+        self.assertIn(b'Active enrollments', response.data)
+        self.assertIn(b'Test Program', response.data)
+    
+    def test_api_list_queries_do_not_grow_with_rows(self):
+        second = ProgramService.create_program(name='Second Program')
+        for i in range(5):
+            client = ClientService.create_client(f'Listed{i}', 'Client', date(1991, 1, 1), 'Female')
+            EnrollmentService.enroll_client(client.id, self.program.id)
+            EnrollmentService.enroll_client(client.id, second.id)
+        headers = {'Authorization': f'Bearer {self.get_api_token()}'}
+        db.session.expunge_all()
+        
+        # A lazy load per row would add one query per client to each of these
+        for path, limit in (('/api/clients', 5), ('/api/clients/search?query=Client', 3),
+                            ('/api/clients/export', 3), ('/api/programs', 1)):
+            with self.subTest(path=path), self.assertMaxQueries(limit):
+                response = self.client.get(path, headers=headers)
+                self.assertEqual(response.status_code, 200)
+        
+        self.login()
+        with self.assertMaxQueries(2):
+            self.assertEqual(self.client.get('/clients').status_code, 200)
+    
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
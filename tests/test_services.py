@@ -1,12 +1,20 @@
+import io
+import json
+import sqlite3
 import unittest
-from datetime import date
+from unittest import mock
+from datetime import date, datetime, timedelta
 from app import create_app, db
-from app.models import User, Client, HealthProgram
-from app.services import UserService, ClientService, ProgramService, EnrollmentService
+from config import TestConfig
+from app.models import User, Client, Enrollment, HealthProgram, enrollments
+from app.services import UserService, ClientService, ProgramService, EnrollmentService, ImportService, ExportService, SyncService, AnalyticsService, years_before
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from tests.helpers import QueryCountMixin
 
-class ServicesTestCase(unittest.TestCase):
+class ServicesTestCase(QueryCountMixin, unittest.TestCase):
     def setUp(self):
-        self.app = create_app()
+        self.app = create_app(TestConfig)
         self.app.config['TESTING'] = True
         self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.app_context = self.app.app_context()
@@ -114,7 +122,8 @@ class ServicesTestCase(unittest.TestCase):
         )
         
         # Test enrollment
-        enrollment_result = EnrollmentService.enroll_client(client.id, program.id)
+        with self.assertMaxQueries(6):
+            enrollment_result = EnrollmentService.enroll_client(client.id, program.id)
         self.assertTrue(enrollment_result)
         
         # Test client programs retrieval
@@ -123,7 +132,8 @@ class ServicesTestCase(unittest.TestCase):
         self.assertEqual(client_programs[0].id, program.id)
         
         # Test program clients retrieval
-        program_clients = EnrollmentService.get_program_clients(program.id)
+        with self.assertMaxQueries(2):
+            program_clients = EnrollmentService.get_program_clients(program.id)
         self.assertEqual(len(program_clients), 1)
         self.assertEqual(program_clients[0].id, client.id)
         
@@ -132,7 +142,8 @@ class ServicesTestCase(unittest.TestCase):
         self.assertFalse(duplicate_enrollment)
         
         # Test unenrollment
-        unenrollment_result = EnrollmentService.unenroll_client(client.id, program.id)
+        with self.assertMaxQueries(5):
+            unenrollment_result = EnrollmentService.unenroll_client(client.id, program.id)
         self.assertTrue(unenrollment_result)
         
         # Verify client is no longer enrolled
@@ -151,5 +162,493 @@ class ServicesTestCase(unittest.TestCase):
         self.assertEqual(len(EnrollmentService.get_client_programs(999)), 0)
         self.assertEqual(len(EnrollmentService.get_program_clients(999)), 0)
 
+    def test_client_pagination(self):
+        clients = [
+            ClientService.create_client(
+                first_name=f'Client{i}',
+                last_name='Paged',
+                date_of_birth='1990-01-01',
+                gender='Female'
+            )
+            for i in range(5)
+        ]
+        
+        # Walk the pages and make sure every client is returned exactly once
+        page, cursor = ClientService.get_clients_page(2)
+        self.assertEqual([c.id for c in page], [clients[0].id, clients[1].id])
+        self.assertIsNotNone(cursor)
+        
+        page, cursor = ClientService.get_clients_page(2, cursor)
+        self.assertEqual([c.id for c in page], [clients[2].id, clients[3].id])
+        
+        page, cursor = ClientService.get_clients_page(2, cursor)
+        self.assertEqual([c.id for c in page], [clients[4].id])
+        self.assertIsNone(cursor)
+        
+        # Malformed cursors are rejected
+        with self.assertRaises(ValueError):
+            ClientService.get_clients_page(2, 'not-a-cursor')
+
+    def test_clients_page_loads_programs_eagerly(self):
+        program = ProgramService.create_program(name='Malaria Program')
+        for i in range(3):
+            client = ClientService.create_client(
+                first_name=f'Eager{i}',
+                last_name='Loaded',
+                date_of_birth='2001-03-04',
+                gender='Male'
+            )
+            EnrollmentService.enroll_client(client.id, program.id)
+        db.session.expunge_all()
+        
+        # The page and its programs take two statements however many clients it holds
+        with self.assertMaxQueries(2):
+            clients, _ = ClientService.get_clients_page(10, with_programs=True)
+            pages = [client.to_dict() for client in clients]
+        self.assertEqual(len(clients), 3)
+        for client, data in zip(clients, pages):
+            # Programs were fetched with the page, so to_dict() triggers no lazy load
+            self.assertNotIn('programs', inspect(client).unloaded)
+            self.assertEqual(data['programs'][0]['name'], 'Malaria Program')
+        
+        db.session.expunge_all()
+        # Plus the one-off check that the full-text index exists
+        with self.assertMaxQueries(3):
+            found = [client.to_dict() for client in ClientService.search_clients('Loaded', with_programs=True)]
+        self.assertEqual(len(found), 3)
+
+    def test_client_filters_and_sorting(self):
+        today = date.today()
+        hiv = ProgramService.create_program(name='HIV')
+        tb = ProgramService.create_program(name='TB')
+        amina = ClientService.create_client('Amina', 'Wekesa', years_before(today, 20), 'Female')
+        brenda = ClientService.create_client('Brenda', 'Achieng', years_before(today, 30), 'Female')
+        cynthia = ClientService.create_client('Cynthia', 'Wekesa', years_before(today, 60), 'Female')
+        david = ClientService.create_client('David', 'Otieno', years_before(today, 25), 'Male')
+        for client in (amina, brenda, cynthia, david):
+            EnrollmentService.enroll_client(client.id, hiv.id)
+        EnrollmentService.enroll_client(brenda.id, tb.id)
+        db.session.execute(enrollments.update().where(enrollments.c.client_id == brenda.id,
+                                                      enrollments.c.program_id == hiv.id).values(status='Defaulted'))
+        db.session.execute(Client.__table__.update().where(Client.id == cynthia.id)
+                           .values(created_at=datetime(2020, 3, 4, 12, 0)))
+        db.session.commit()
+
+        def ids(criteria, sort=None, limit=10):
+            clients, _ = ClientService.get_clients_page(limit, criteria=criteria, sort=sort)
+            return [client.id for client in clients]
+
+        # Program officers' query: women 15-49 active in HIV, registered this month
+        officers = {'gender': 'Female', 'min_age': 15, 'max_age': 49, 'program': hiv.id,
+                    'status': 'Active', 'registered_after': today.replace(day=1).isoformat()}
+        self.assertEqual(ids(officers), [amina.id])
+        # Program and status apply to the same enrollment
+        self.assertEqual(ids({'program': tb.id, 'status': 'Defaulted'}), [])
+        self.assertEqual(ids({'status': 'Defaulted'}), [brenda.id])
+        self.assertEqual(ids({'program': tb.id}), [brenda.id])
+        self.assertEqual(ids({'enrolled_after': today.isoformat(), 'enrolled_before': today.isoformat()}),
+                         [amina.id, brenda.id, cynthia.id, david.id])
+        self.assertEqual(ids({'enrolled_before': (today - timedelta(days=1)).isoformat()}), [])
+        self.assertEqual(ids({'registered_before': '2020-03-04'}), [cynthia.id])
+
+        # Probing each group first or filtering directly gives the same clients
+        selective = ClientService.SELECTIVE_FILTER_ROWS
+        try:
+            ClientService.SELECTIVE_FILTER_ROWS = 0
+            self.assertEqual(ids(officers), [amina.id])
+            self.assertEqual(ids({'gender': 'Female', 'program': hiv.id}), [amina.id, brenda.id, cynthia.id])
+        finally:
+            ClientService.SELECTIVE_FILTER_ROWS = selective
+
+        # Sorted pages carry the sort columns in the cursor
+        self.assertEqual(ids({}, sort='name'), [brenda.id, david.id, amina.id, cynthia.id])
+        self.assertEqual(ids({}, sort='-date_of_birth'), [amina.id, david.id, brenda.id, cynthia.id])
+        self.assertEqual(ids({'gender': 'Female'}, sort='-created_at'), [brenda.id, amina.id, cynthia.id])
+        for sort in ('name', '-name', 'date_of_birth', '-created_at', '-id'):
+            walked, cursor = [], None
+            while True:
+                page, cursor = ClientService.get_clients_page(1, cursor, sort=sort)
+                walked += [client.id for client in page]
+                if cursor is None:
+                    break
+            self.assertEqual(walked, ids({}, sort=sort))
+
+        with self.assertMaxQueries(3):
+            ClientService.get_clients_page(10, with_programs=True, criteria=officers, sort='name')
+
+        for criteria, sort in (({'colour': 'red'}, None), ({'program': 'HIV'}, None),
+                               ({'enrolled_after': 'June'}, None), ({}, 'shoe_size')):
+            with self.assertRaises(ValueError):
+                ClientService.get_clients_page(10, criteria=criteria, sort=sort)
+        # A cursor from one sort order doesn't fit another
+        _, cursor = ClientService.get_clients_page(1, sort='name')
+        with self.assertRaises(ValueError):
+            ClientService.get_clients_page(1, cursor)
+
+    def test_client_search_index(self):
+        otieno = ClientService.create_client(
+            first_name='Brian',
+            last_name='Otieno',
+            date_of_birth='1988-07-21',
+            gender='Male',
+            contact_number='0712 345 678',
+            email='brian.otieno@example.com'
+        )
+        wanjiru = ClientService.create_client(
+            first_name='Grace',
+            last_name='Wanjiru',
+            date_of_birth='1993-11-02',
+            gender='Female',
+            contact_number='0722-000-111'
+        )
+        
+        # Prefix matches on names, phone number digits and email
+        self.assertEqual([c.id for c in ClientService.search_clients('Oti')], [otieno.id])
+        self.assertEqual([c.id for c in ClientService.search_clients('0712345')], [otieno.id])
+        self.assertEqual([c.id for c in ClientService.search_clients('0722 000')], [wanjiru.id])
+        self.assertEqual([c.id for c in ClientService.search_clients('brian.otieno@')], [otieno.id])
+        self.assertEqual(ClientService.search_clients('grace otieno'), [])
+        self.assertEqual(ClientService.search_clients('  '), [])
+        
+        # The index follows updates
+        ClientService.update_client(wanjiru.id, last_name='Kamau')
+        self.assertEqual(ClientService.search_clients('Wanjiru'), [])
+        self.assertEqual([c.id for c in ClientService.search_clients('kamau')], [wanjiru.id])
+
+    def test_fuzzy_client_search(self):
+        otieno = ClientService.create_client('Brian', 'Otieno', '1988-07-21', 'Male')
+        ClientService.create_client('Grace', 'Otieno', '2001-02-03', 'Female')
+        ClientService.create_client('Grace', 'Wanjiru', '1993-11-02', 'Female')
+        ImportService.import_clients(ImportService.read_rows(io.StringIO(
+            '{"first_name": "Moses", "last_name": "Achieng", "date_of_birth": "1979-05-05", "gender": "Male"}\n'
+        ), 'ndjson'))
+
+        # Keys are filled on every insert path and follow name changes
+        self.assertEqual((otieno.first_name_phonetic, otieno.last_name_phonetic), ('B650', 'O350'))
+        self.assertIn('tie', otieno.name_ngrams.split())
+        self.assertEqual(Client.query.filter_by(last_name='Achieng').one().last_name_phonetic, 'A252')
+
+        self.assertEqual(ClientService.search_clients('Otiyeno'), [])
+        matches = ClientService.fuzzy_search_clients('Otiyeno')
+        self.assertEqual(len(matches), 2)
+        self.assertTrue(all(client.last_name == 'Otieno' and score >= 0.8 for client, score in matches))
+
+        # Edit distance beyond the phonetic code: a dropped letter changes Soundex, not most trigrams
+        self.assertEqual([client.last_name for client, _ in ClientService.fuzzy_search_clients('Achien')],
+                         ['Achieng'])
+        self.assertEqual([client.id for client, _ in ClientService.fuzzy_search_clients('brayan otiyeno')][0],
+                         otieno.id)
+
+        matches = ClientService.fuzzy_search_clients('Otiyeno', criteria={'born_before': '1990-01-01'})
+        self.assertEqual([client.id for client, _ in matches], [otieno.id])
+        self.assertEqual(ClientService.search_clients('otieno', criteria={'born_after': '2000-01-01'})[0].first_name,
+                         'Grace')
+        self.assertEqual(ClientService.fuzzy_search_clients('12345'), [])
+
+        ClientService.update_client(otieno.id, last_name='Kamau')
+        self.assertEqual(otieno.last_name_phonetic, 'K500')
+        self.assertEqual(len(ClientService.fuzzy_search_clients('Otiyeno')), 1)
+        self.assertEqual(ClientService.fuzzy_search_clients('Kamawu')[0][0].id, otieno.id)
+
+        # Two index lookups, the scoring query and the winners with their programs
+        with self.assertMaxQueries(5):
+            [client.to_dict() for client, _ in ClientService.fuzzy_search_clients('Wanjiro', with_programs=True)]
+
+    def test_fuzzy_candidates_prefer_exact_names(self):
+        from app import search
+        
+        # Same Soundex code (O350) as Otieno, and registered first
+        for first_name in ('Amos', 'Ben', 'Carol'):
+            ClientService.create_client(first_name, 'Otten', '1980-01-01', 'Male')
+        otieno = ClientService.create_client('Brian', 'Otieno', '1988-07-21', 'Male')
+        
+        # Two of the four share the code; the exact spelling is always one of the candidates
+        phonetic = search.fuzzy_candidates(['otieno'], db.engine, [], 2)[0]
+        candidates = db.session.execute(phonetic).scalars().all()
+        self.assertEqual(candidates[0], otieno.id)
+        self.assertEqual(len(set(candidates[1:])), 2)
+    
+    def test_bulk_import(self):
+        ndjson = io.StringIO(
+            '{"first_name": "Amina", "last_name": "Hassan", "date_of_birth": "1991-04-12", "gender": "Female"}\n'
+            '{"first_name": "Peter", "last_name": "Kamau", "date_of_birth": "12/04/1991", "gender": "Male"}\n'
+            '\n'
+            'not json\n'
+            '{"first_name": "Mary", "last_name": "Akinyi", "date_of_birth": "2015-09-30", "gender": "Female", "email": "bad"}\n'
+            '{"first_name": "Joseph", "last_name": "Mwangi", "date_of_birth": "1979-01-05", "gender": "Male", "contact_number": "0733111222"}\n'
+            '{"last_name": "Nameless", "date_of_birth": "1980-01-01", "gender": "Male"}\n'
+        )
+        report = ImportService.import_clients(ImportService.read_rows(ndjson, 'ndjson'), batch_size=1)
+        
+        self.assertEqual(report['total'], 6)
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(report['failed'], 4)
+        self.assertEqual(report['batches'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 4, 6])
+        self.assertEqual(Client.query.count(), 2)
+        
+        # Imported clients are searchable straight away
+        self.assertEqual(ClientService.search_clients('0733111222')[0].first_name, 'Joseph')
+        
+        csv_data = io.StringIO(
+            'first_name,last_name,date_of_birth,gender,email\n'
+            'Ann,Wairimu,2000-02-29,Female,\n'
+            'Tom,Ochieng,1999-12-31,Male,tom@example.com\n'
+        )
+        report = ImportService.import_clients(ImportService.read_rows(csv_data, 'csv'), batch_size=10)
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(report['batches'], 1)
+        self.assertIsNone(Client.query.filter_by(first_name='Ann').one().email)
+        
+        # Values of the wrong JSON type are per-row errors, not a failed import
+        ndjson = io.StringIO(
+            '{"first_name": "Ruth", "last_name": "Chebet", "date_of_birth": "1990-01-01", "gender": "Female", "email": 5}\n'
+            '{"first_name": 5, "last_name": "Kiprop", "date_of_birth": "1990-01-01", "gender": "Male"}\n'
+            '{"first_name": "Ann", "last_name": "Njeri", "date_of_birth": "1990-01-01", "gender": ["F"], "address": {}}\n'
+            '{"first_name": "Esther", "last_name": "Moraa", "date_of_birth": "1990-01-01", "gender": "Female", "email": null}\n'
+        )
+        report = ImportService.import_clients(ImportService.read_rows(ndjson, 'ndjson'))
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['errors'], [
+            {'row': 1, 'error': 'Fields must be text or null: email'},
+            {'row': 2, 'error': 'Fields must be text or null: first_name'},
+            {'row': 3, 'error': 'Fields must be text or null: gender, address'},
+        ])
+
+    def test_bulk_enrollment(self):
+        program = ProgramService.create_program(name='Malaria Under 5')
+        today = date.today()
+        children = [
+            ClientService.create_client(
+                first_name=f'Child{i}',
+                last_name='Young',
+                date_of_birth=today - timedelta(days=365 * i + 30),
+                gender='Female' if i % 2 else 'Male'
+            )
+            for i in range(5)
+        ]
+        adult = ClientService.create_client(
+            first_name='Grown',
+            last_name='Up',
+            date_of_birth='1980-01-01',
+            gender='Female'
+        )
+        EnrollmentService.enroll_client(children[0].id, program.id)
+        
+        # Filter targets every child under five, skipping the existing enrollment
+        report = EnrollmentService.bulk_enroll(program.id, criteria={'max_age': 4})
+        self.assertEqual(report['matched'], 5)
+        self.assertEqual(report['enrolled'], 4)
+        self.assertEqual(report['already_enrolled'], 1)
+        self.assertEqual(len(EnrollmentService.get_program_clients(program.id)), 5)
+        
+        # Explicit IDs, including an unknown one and duplicates
+        report = EnrollmentService.bulk_enroll(program.id, client_ids=[adult.id, adult.id, 999])
+        self.assertEqual(report['enrolled'], 1)
+        self.assertEqual(report['not_found'], 1)
+        
+        report = EnrollmentService.bulk_unenroll(program.id, criteria={'gender': 'Female'})
+        self.assertEqual(report['unenrolled'], 3)
+        self.assertEqual(len(EnrollmentService.get_program_clients(program.id)), 3)
+        
+        self.assertIsNone(EnrollmentService.bulk_enroll(999, client_ids=[adult.id]))
+        with self.assertRaises(ValueError):
+            EnrollmentService.bulk_enroll(program.id, criteria={'favourite_colour': 'blue'})
+
+    def test_enrollment_status_transitions(self):
+        program = ProgramService.create_program(name='HIV Program')
+        clients = [ClientService.create_client(f'Status{i}', 'Tracked', date(1990, 1, 1), 'Female' if i % 2 else 'Male')
+                   for i in range(5)]
+        for client in clients:
+            EnrollmentService.enroll_client(client.id, program.id)
+        first = clients[0]
+        client_id, program_id = first.id, program.id
+        token = SyncService.current_token()
+
+        # The allowed-from check and the change are one UPDATE, plus the client touch and the change log
+        with self.assertMaxQueries(3):
+            self.assertTrue(EnrollmentService.set_status(client_id, program_id, 'Defaulted'))
+        self.assertFalse(EnrollmentService.set_status(first.id, program.id, 'Defaulted'))
+        self.assertTrue(EnrollmentService.set_status(first.id, program.id, 'Completed'))
+        self.assertFalse(EnrollmentService.set_status(first.id, program.id, 'Active'))
+        self.assertFalse(EnrollmentService.set_status(999, program.id, 'Withdrawn'))
+        with self.assertRaises(ValueError):
+            EnrollmentService.set_status(first.id, program.id, 'Lost')
+
+        enrollment = db.session.get(Enrollment, (first.id, program.id))
+        self.assertEqual(enrollment.status, 'Completed')
+        self.assertEqual(enrollment.client.first_name, 'Status0')
+        self.assertEqual([e.program_id for e in db.session.get(Client, first.id).enrollments], [program.id])
+        changes = SyncService.get_changes(token)
+        self.assertEqual(changes['enrollments'][0]['status'], 'Completed')
+
+        # Bulk transitions skip enrollments whose status can't move, here the completed one
+        report = EnrollmentService.bulk_set_status(program.id, 'Defaulted', criteria={'gender': 'Male'})
+        self.assertEqual(report, {'program_id': program.id, 'status': 'Defaulted', 'changed': 2})
+        report = EnrollmentService.bulk_set_status(program.id, 'Withdrawn', client_ids=[c.id for c in clients])
+        self.assertEqual(report['changed'], 4)
+        report = EnrollmentService.bulk_set_status(program.id, 'Active', client_ids=[clients[1].id, clients[2].id])
+        self.assertEqual(report['changed'], 2)
+        self.assertIsNone(EnrollmentService.bulk_set_status(999, 'Active', client_ids=[first.id]))
+        with self.assertRaises(ValueError):
+            EnrollmentService.bulk_set_status(program.id, 'Withdrawn', criteria={'gender': '', 'min_age': None})
+
+        # Status rosters page through the program in client order
+        walked, cursor = [], None
+        while True:
+            page, cursor = EnrollmentService.get_program_enrollments_page(program.id, 1, cursor, 'Withdrawn')
+            walked += [enrollment.client_id for enrollment in page]
+            if cursor is None:
+                break
+        self.assertEqual(walked, [clients[3].id, clients[4].id])
+        db.session.expunge_all()
+        with self.assertMaxQueries(2):
+            page, _ = EnrollmentService.get_program_enrollments_page(program.id, 10, status='Active')
+            self.assertEqual([enrollment.client.first_name for enrollment in page], ['Status1', 'Status2'])
+        page, _ = EnrollmentService.get_program_enrollments_page(program.id, 10)
+        self.assertEqual(len(page), 5)
+        self.assertIsNone(EnrollmentService.get_program_enrollments_page(999, 10))
+        with self.assertRaises(ValueError):
+            EnrollmentService.get_program_enrollments_page(program.id, 10, status='Lost')
+
+    def test_client_export_streams_in_batches(self):
+        program = ProgramService.create_program(name='TB Program')
+        for i in range(5):
+            client = ClientService.create_client(
+                first_name=f'Export{i}',
+                last_name='Client',
+                date_of_birth='1990-01-01',
+                gender='Male'
+            )
+            if i % 2 == 0:
+                EnrollmentService.enroll_client(client.id, program.id)
+        
+        batches = list(ExportService.iter_client_batches(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        
+        chunks = list(ExportService.iter_export('ndjson', batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        records = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual([r['first_name'] for r in records], [f'Export{i}' for i in range(5)])
+        self.assertEqual(records[0]['enrollments'][0]['program_name'], 'TB Program')
+        self.assertEqual(records[1]['enrollments'], [])
+        
+        csv_lines = ''.join(ExportService.iter_export('csv', batch_size=2)).splitlines()
+        self.assertEqual(len(csv_lines), 6)
+        self.assertTrue(csv_lines[1].endswith('TB Program (Active)'))
+
+    def test_sync_changes_since_token(self):
+        program = ProgramService.create_program(name='HIV Program')
+        client = ClientService.create_client(
+            first_name='Sync',
+            last_name='Client',
+            date_of_birth='1990-01-01',
+            gender='Female'
+        )
+        EnrollmentService.enroll_client(client.id, program.id)
+        
+        changes = SyncService.get_changes(0)
+        self.assertEqual([c['id'] for c in changes['clients']], [client.id])
+        self.assertEqual([p['id'] for p in changes['programs']], [program.id])
+        self.assertEqual(changes['enrollments'][0]['status'], 'Active')
+        self.assertFalse(changes['has_more'])
+        token = changes['token']
+        self.assertEqual(token, SyncService.current_token())
+        
+        # Nothing new since the token
+        changes = SyncService.get_changes(token)
+        self.assertEqual((changes['clients'], changes['enrollments']), ([], []))
+        self.assertEqual(changes['token'], token)
+        
+        other = ClientService.create_client(
+            first_name='Other',
+            last_name='Client',
+            date_of_birth='1991-01-01',
+            gender='Male'
+        )
+        ClientService.update_client(client.id, contact_number='0700000000')
+        EnrollmentService.unenroll_client(client.id, program.id)
+        EnrollmentService.bulk_enroll(program.id, client_ids=[client.id, other.id])
+        EnrollmentService.bulk_unenroll(program.id, client_ids=[other.id])
+        
+        changes = SyncService.get_changes(token)
+        self.assertEqual([c['id'] for c in changes['clients']], [client.id, other.id])
+        self.assertEqual(changes['clients'][0]['contact_number'], '0700000000')
+        self.assertEqual([(e['client_id'], e['program_id']) for e in changes['enrollments']],
+                         [(client.id, program.id)])
+        self.assertEqual(changes['removed_enrollments'], [{'client_id': other.id, 'program_id': program.id}])
+        
+        # Pages are bounded by limit and chain through the returned token
+        first = SyncService.get_changes(token, limit=2)
+        self.assertTrue(first['has_more'])
+        rest = SyncService.get_changes(first['token'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(rest['token'], changes['token'])
+
+    def test_password_rehashed_on_login_when_cost_changes(self):
+        user = UserService.create_user('rehash', 'rehash@example.com', 'password123')
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(user.needs_rehash())
+        
+        self.app.config['PASSWORD_HASH_ITERATIONS'] = 2000
+        self.assertTrue(user.needs_rehash())
+        self.assertIsNotNone(UserService.authenticate_user('rehash', 'password123'))
+        
+        db.session.expire_all()
+        user = db.session.get(User, user.id)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertIsNotNone(UserService.authenticate_user('rehash', 'password123'))
+        self.assertIsNone(UserService.authenticate_user('rehash', 'wrongpassword'))
+        
+        # A locked database on the first commit still stores the new hash
+        self.app.config['PASSWORD_HASH_ITERATIONS'] = 3000
+        commit, calls = db.session.commit, []
+        
+        def locked_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('COMMIT', {}, sqlite3.OperationalError('database is locked'))
+            commit()
+        
+        with mock.patch.object(db.session, 'commit', locked_once):
+            self.assertIsNotNone(UserService.authenticate_user('rehash', 'password123'))
+        db.session.expire_all()
+        self.assertTrue(db.session.get(User, user.id).password_hash.startswith('pbkdf2:sha256:3000$'))
+    
+    def test_dashboard_aggregates(self):
+        today = date(2024, 6, 12)
+        tb = ProgramService.create_program(name='TB')
+        hiv = ProgramService.create_program(name='HIV')
+        child = ClientService.create_client('Child', 'One', date(2015, 1, 1), 'Female')
+        adult = ClientService.create_client('Adult', 'Two', date(1980, 1, 1), 'Male')
+        elder = ClientService.create_client('Elder', 'Three', date(1950, 1, 1), 'Female')
+        for client in (child, adult, elder):
+            EnrollmentService.enroll_client(client.id, tb.id)
+        EnrollmentService.enroll_client(adult.id, hiv.id)
+        
+        dashboard = AnalyticsService.compute_dashboard(today)
+        self.assertEqual(dashboard['totals'], {'clients': 3, 'programs': 2, 'enrollments': 4, 'active_enrollments': 4})
+        self.assertEqual(dashboard['clients']['by_gender'], {'Female': 2, 'Male': 1})
+        self.assertEqual(dashboard['clients']['by_age_band'], {'0-17': 1, '35-49': 1, '65+': 1})
+        
+        by_name = {program['name']: program for program in dashboard['programs']}
+        self.assertEqual(by_name['TB']['enrollments'], {'Active': 3})
+        self.assertEqual(by_name['TB']['by_gender'], {'Female': 2, 'Male': 1})
+        self.assertEqual(by_name['HIV']['by_age_band'], {'35-49': 1})
+        self.assertEqual(len(dashboard['weekly_enrollments']), AnalyticsService.WEEKS)
+        self.assertEqual(dashboard['weekly_enrollments'][-1]['week_start'], '2024-06-10')
+        
+        # Cached until the next recorded change
+        first = AnalyticsService.get_dashboard()
+        self.assertIs(AnalyticsService.get_dashboard(), first)
+        EnrollmentService.unenroll_client(child.id, tb.id)
+        self.assertEqual(AnalyticsService.get_dashboard()['totals']['enrollments'], 3)
+        self.assertEqual(sum(week['enrollments'] for week in first['weekly_enrollments']), 4)
+        # Each new token or day replaces the cached dashboard rather than adding an entry
+        AnalyticsService.get_dashboard(today)
+        entries = [key for key in self.app.extensions['cache']._entries
+                   if key[0] == AnalyticsService.CACHE_NAMESPACE]
+        self.assertEqual(len(entries), 1)
+    
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,135 @@
+import threading
+import unittest
+from datetime import date
+from app import create_app, db
+from config import TestConfig
+from app.suggest import PrefixIndex, client_terms, query_key
+from app.services import ClientService, ImportService
+from tests.helpers import QueryCountMixin
+
+class PrefixIndexTestCase(unittest.TestCase):
+    def test_terms_and_query_keys(self):
+        self.assertEqual(client_terms('Grace', "Wanjiku-O'Neill", '+254 712-345'),
+                         {b'grace', b'wanjikuoneill', b'gracewanjikuoneill', b'wanjikuoneillgrace', b'254712345'})
+        self.assertEqual(query_key('Grace Wa'), b'gracewa')
+        self.assertEqual(query_key('0712 34'), b'071234')
+        self.assertEqual(query_key(' - '), b'')
+
+    def test_prefix_matches(self):
+        index = PrefixIndex.from_rows([
+            (1, 'Grace', 'Kamau', '0712000001'),
+            (2, 'Grant', 'Otieno', '0733000002'),
+            (3, 'Peter', 'Grady', None),
+        ])
+        self.assertEqual(len(index), 14)
+        self.assertEqual([client_id for _, client_id in index.matches(b'gra')], [1, 1, 3, 3, 2, 2])
+        self.assertEqual([term for term, _ in index.matches(b'gracek')], [b'gracekamau'])
+        self.assertEqual([client_id for _, client_id in index.matches(b'07')], [1, 2])
+        self.assertEqual(list(index.matches(b'zz')), [])
+        self.assertGreater(index.memory_bytes(), 0)
+
+class SuggestTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.grace = ClientService.create_client('Grace', 'Kamau', date(1990, 5, 1), 'Female', '0712 345 678')
+        self.grant = ClientService.create_client('Grant', 'Otieno', date(1985, 2, 3), 'Male', '0733 111 222')
+        self.index = self.app.extensions['suggest']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def suggested_ids(self, prefix, limit=10):
+        return [client['id'] for client in ClientService.suggest_clients(prefix, limit)]
+
+    def test_suggest_by_name_and_phone(self):
+        self.assertFalse(self.index.built)
+        self.assertEqual(self.suggested_ids('Gra'), [self.grace.id, self.grant.id])
+        self.assertTrue(self.index.built)
+        self.assertEqual(self.suggested_ids('grace ka'), [self.grace.id])
+        self.assertEqual(self.suggested_ids('Kamau G'), [self.grace.id])
+        self.assertEqual(self.suggested_ids('0733-11'), [self.grant.id])
+        self.assertEqual(self.suggested_ids('Gra', limit=1), [self.grace.id])
+        self.assertEqual(self.suggested_ids(''), [])
+        self.assertEqual(self.suggested_ids('Wanjiku'), [])
+
+        suggestion = ClientService.suggest_clients('otieno')[0]
+        self.assertEqual(suggestion['first_name'], 'Grant')
+        self.assertEqual(suggestion['date_of_birth'], '1985-02-03')
+        self.assertNotIn('medical_history', suggestion)
+
+        # Once built, an unchanged index costs the change-token check and the row fetch
+        with self.assertMaxQueries(2):
+            self.suggested_ids('Gra')
+
+    def test_suggest_follows_creates_and_updates(self):
+        self.assertEqual(self.suggested_ids('Gra'), [self.grace.id, self.grant.id])
+
+        ClientService.update_client(self.grace.id, first_name='Wanjiru', contact_number='0799 000 000')
+        gracie = ClientService.create_client('Gracie', 'Achieng', date(2001, 1, 1), 'Female')
+        ImportService.import_clients([(1, {'first_name': 'Graham', 'last_name': 'Mutua',
+                                           'date_of_birth': '1970-03-04', 'gender': 'Male'})])
+        graham_id = self.suggested_ids('Graham')[0]
+
+        self.assertEqual(self.suggested_ids('Gra'), [gracie.id, graham_id, self.grant.id])
+        self.assertEqual(self.suggested_ids('Wanjiru'), [self.grace.id])
+        self.assertEqual(self.suggested_ids('0712'), [])
+        self.assertEqual(self.suggested_ids('0799'), [self.grace.id])
+        # Updating a re-indexed client again replaces its pending entries
+        ClientService.update_client(self.grace.id, first_name='Grace')
+        self.assertEqual(self.suggested_ids('Wanjiru'), [])
+        self.assertEqual(self.index.stats()['pending_clients'], 3)
+
+        # A rebuild folds the pending changes into the immutable index
+        self.index.build()
+        self.assertEqual(self.index.stats()['pending_clients'], 0)
+        self.assertEqual(self.suggested_ids('Gra'), [self.grace.id, gracie.id, graham_id, self.grant.id])
+        self.assertEqual(self.suggested_ids('0799'), [self.grace.id])
+
+    def test_refresh_polls_at_most_once_per_interval(self):
+        self.index.refresh_interval = 60
+        self.assertEqual(self.suggested_ids('Gra'), [self.grace.id, self.grant.id])
+        gracie = ClientService.create_client('Gracie', 'Achieng', date(2001, 1, 1), 'Female')
+        known = [self.grace.id, self.grant.id]
+
+        # Within the interval a lookup skips the change log: only its rows are fetched
+        with self.assertMaxQueries(1):
+            self.assertEqual(self.suggested_ids('Gra'), known)
+
+        self.index._next_poll = 0
+        self.assertEqual(self.suggested_ids('Gra'), [known[0], gracie.id, known[1]])
+
+    def test_refresh_skips_changes_read_before_a_rebuild(self):
+        self.suggested_ids('Gra')
+        stale_token = self.index.stats()['token']
+        ClientService.update_client(self.grace.id, first_name='Wanjiru')
+        self.index.build()
+
+        # A poll that started before the rebuild must not apply its older changes over it
+        self.assertFalse(self.index._apply_changes(stale_token - 1))
+        self.assertEqual(self.index.stats()['pending_clients'], 0)
+        self.assertEqual(self.suggested_ids('Wanjiru'), [self.grace.id])
+
+    def test_first_lookup_builds_in_background(self):
+        self.index.wait_for_build = False
+        with self.index._build_lock:
+            # Until the build finishes, lookups are answered from the full-text search
+            self.assertEqual(self.suggested_ids('Grant'), [self.grant.id])
+            self.assertEqual(self.suggested_ids('0712 345'), [self.grace.id])
+            self.assertFalse(self.index.built)
+            # The build the first lookup started is the only one
+            self.assertIsNone(self.index.rebuild_in_background())
+        for thread in threading.enumerate():
+            if thread.name == 'suggest-index':
+                thread.join()
+        self.assertTrue(self.index.built)
+        with self.assertMaxQueries(2):
+            self.assertEqual(self.suggested_ids('Gra'), [self.grace.id, self.grant.id])
+
+if __name__ == '__main__':
+    unittest.main()